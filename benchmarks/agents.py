@@ -0,0 +1,291 @@
+"""Timings of the multi-agent plumbing with a scripted model.
+
+Run from the repository root:
+    poetry run python -m benchmarks.agents
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from typing import List, Tuple
+
+from autogen_core.base import AgentId, AgentInstantiationContext
+from autogen_core.components.models import UserMessage
+
+from ner.agents.agent_config import AgentConfig
+from ner.agents.direct_executor import DirectRuntime
+from ner.agents.history_budget import HistoryBudget
+from ner.agents.multi_agent_tagger import MultiAgentTagger
+from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE, ResearchAgent
+from ner.agents.research_service import ResearchService
+from ner.agents.review_policy import ReviewPolicy
+from ner.agents.tools.search_cache import SearchCache, normalize_query
+from ner.eval.dataset import NERDatasetEntry
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+from tests.scripted_client import ScriptedClient, ScriptedSearch
+
+
+AGENT_CONFIG = AgentConfig(
+    tagger_system_prompt="tagger",
+    reviewer_system_prompt="reviewer",
+    researcher_system_prompt="researcher",
+)
+TOKENS = "IL-2 gene expression requires NF-kappa B activation .".split()
+SENTENCES = 200
+
+
+def quietly():
+    # the agents print every turn, only the timings are kept
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def to_entries(texts: List[str]) -> List[NERDatasetEntry]:
+    return [
+        NERDatasetEntry(left_context="", right_context="", text=text, tokens=text.split(), labels=[])
+        for text in texts
+    ]
+
+
+def create_researcher(session: int, client: ScriptedClient, search: ScriptedSearch, **kwargs) -> ResearchAgent:
+    with AgentInstantiationContext.populate_context((DirectRuntime(), AgentId(RESEARCHER_TOPIC_TYPE, str(session)))):  # type: ignore
+        return ResearchAgent(
+            description="researcher",
+            group_chat_topic_type="GroupChat",
+            model_client=client,  # type: ignore
+            system_prompt="researcher",
+            search_tool=search.as_tool(),
+            **kwargs,
+        )
+
+
+def benchmark_runtime_reuse() -> None:
+    for reuse_runtime in [False, True]:
+        tagger = MultiAgentTagger(["DNA", "protein"], AGENT_CONFIG, ScriptedClient())  # type: ignore
+        start = time.perf_counter()
+        with quietly():
+            for _ in range(SENTENCES):
+                if not reuse_runtime:
+                    # what every sentence paid before: a new runtime and event loop
+                    tagger.close()
+                tagger.recognize(TOKENS)
+        elapsed = (time.perf_counter() - start) / SENTENCES
+        tagger.close()
+        print(f"{'Reused' if reuse_runtime else 'New'} runtime per sentence: {elapsed * 1000:.2f}ms per sentence")
+
+
+def benchmark_setup() -> None:
+    async def time_setup() -> Tuple[float, float]:
+        tagger = MultiAgentTagger(["DNA", "protein"], AGENT_CONFIG, ScriptedClient())  # type: ignore
+        start = time.perf_counter()
+        for _ in range(SENTENCES):
+            await tagger.close_async()
+            await tagger.initialize_agents()
+        new_runtime = (time.perf_counter() - start) / SENTENCES
+
+        start = time.perf_counter()
+        for _ in range(SENTENCES):
+            session_id, _ = tagger.open_session()
+            tagger.close_session(session_id)
+        session = (time.perf_counter() - start) / SENTENCES
+        await tagger.close_async()
+        return new_runtime, session
+
+    new_runtime, session = asyncio.run(time_setup())
+    print(f"Setup only: new runtime {new_runtime * 1e6:.0f}us, new session {session * 1e6:.0f}us per sentence")
+
+
+def benchmark_concurrency() -> None:
+    # with 50ms per model call, sentences tagged one at a time are bound by latency
+    entries = to_entries([f"sentence number {i} about IL-2 ." for i in range(64)])
+    tagger = MultiAgentTagger(["DNA", "protein"], AGENT_CONFIG, ScriptedClient(latency=0.05))  # type: ignore
+    with quietly():
+        start = time.perf_counter()
+        for entry in entries:
+            tagger.recognize(entry.tokens)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tagger.recognize_many(entries, max_concurrency=16)
+        concurrent = time.perf_counter() - start
+    tagger.close()
+    print(f"{len(entries)} sentences: serial {serial:.2f}s, 16 concurrent sessions {concurrent:.2f}s")
+
+
+def benchmark_direct_execution() -> None:
+    for direct_execution in [False, True]:
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], AGENT_CONFIG, ScriptedClient(detours=True),  # type: ignore
+            internet_access=False, direct_execution=direct_execution,
+        )
+        start = time.perf_counter()
+        with quietly():
+            for _ in range(SENTENCES):
+                tagger.recognize(TOKENS)
+        elapsed = (time.perf_counter() - start) / SENTENCES
+        tagger.close()
+        print(f"{'Direct executor' if direct_execution else 'Agent runtime'}: {elapsed * 1000:.2f}ms per sentence")
+
+
+def benchmark_history_budget() -> None:
+    context = " ".join(f"Context sentence {i} about T cells and cytokines ." for i in range(30))
+    for budgeted in [False, True]:
+        client = ScriptedClient(detours=True)
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], AGENT_CONFIG, client, internet_access=False,  # type: ignore
+            history_budget=HistoryBudget() if budgeted else None, direct_execution=True,
+        )
+        with quietly():
+            for _ in range(20):
+                tagger.recognize(TOKENS, context, context)
+        tagger.close()
+        print(f"{'Budgeted' if budgeted else 'Full'} history: {client.input_tokens // 20} input tokens per sentence")
+        if tagger.history_budget:
+            print(tagger.history_budget.report())
+
+
+def benchmark_review_policy() -> None:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", 10)
+    knowledge_base.add("cd28", "DNA", 10)
+    entries = to_entries(["The cells were washed twice .", "IL-2 expression was induced .", "CD28 signals were blocked ."] * 10)
+    for review_policy in [None, ReviewPolicy()]:
+        client = ScriptedClient(latency=0.05, tags={"IL-2": "protein", "CD28": "protein"})
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], AGENT_CONFIG, client,  # type: ignore
+            GroundingEngine(knowledge_base=knowledge_base), review_policy=review_policy,
+        )
+        with quietly():
+            start = time.perf_counter()
+            for entry in entries:
+                tagger.recognize(entry.tokens)
+            elapsed = time.perf_counter() - start
+        tagger.close()
+        print(f"{'With' if review_policy else 'Without'} review policy: {client.calls / len(entries):.1f} model calls and {elapsed / len(entries) * 1000:.0f}ms per sentence")
+        if review_policy:
+            print(review_policy.report())
+
+
+def benchmark_single_call_research(sessions: int = 10, requests: int = 2) -> None:
+    request = "I am not sure about two mentions.\n<search>\n1. What is NF-kappa B?\n2. What is IL-2?\n</search>"
+    for single_call in [False, True]:
+        client = ScriptedClient(latency=0.1)
+        search = ScriptedSearch(latency=0.05)
+
+        async def run() -> float:
+            start = time.perf_counter()
+            for session in range(sessions):
+                researcher = create_researcher(session, client, search, single_call=single_call)
+                for _ in range(requests):
+                    researcher.receive(UserMessage(content=request, source="Tagger"))
+                    researcher.receive(UserMessage(content=await researcher.speak(), source=RESEARCHER_TOPIC_TYPE))
+            return (time.perf_counter() - start) / (sessions * requests)
+
+        with quietly():
+            latency = asyncio.run(run())
+        print(
+            f"{'Single call' if single_call else 'Tool-choice call'}: {latency * 1000:.0f}ms, "
+            f"{client.calls / (sessions * requests):.0f} model calls, {client.input_tokens // (sessions * requests)} input "
+            f"and {client.output_tokens // (sessions * requests)} output tokens per research request"
+        )
+
+
+def benchmark_shared_research() -> None:
+    # 32 concurrent sessions asking about a few recurring entities within 1s
+    rng = random.Random(50)
+    entities = [f"entity-{i}" for i in range(12)]
+    requests = [
+        (rng.uniform(0, 1), [f"What is {entity}?" for entity in rng.sample(entities, 2)])
+        for _ in range(32)
+    ]
+    for shared in [False, True]:
+        client = ScriptedClient(latency=0.3)
+        search = ScriptedSearch(latency=0.1)
+        service = ResearchService(client, "researcher", search.as_tool()) if shared else None  # type: ignore
+        latencies: List[float] = list()
+
+        async def run_session(session: int, delay: float, questions: List[str]) -> None:
+            researcher = create_researcher(session, client, search, single_call=True, research_service=service)
+            await asyncio.sleep(delay)
+            researcher.receive(UserMessage(content="<search>\n" + "\n".join(questions) + "\n</search>", source="Tagger"))
+            start = time.perf_counter()
+            await researcher.speak()
+            latencies.append(time.perf_counter() - start)
+
+        async def run() -> None:
+            await asyncio.gather(*(run_session(session, *request) for session, request in enumerate(requests)))
+
+        with quietly():
+            asyncio.run(run())
+        print(
+            f"{'Shared researcher' if shared else 'Researcher per session'}: {client.calls} model calls, "
+            f"{client.input_tokens} input tokens, {len(search.queries)} searched queries, "
+            f"{sum(latencies) / len(latencies) * 1000:.0f}ms per request"
+        )
+        if service:
+            print(service.report())
+
+
+def benchmark_search_cache() -> None:
+    # researcher questions of 16 concurrent sessions, a few entities recur a lot
+    rng = random.Random(46)
+    entities = [f"entity-{i}" for i in range(200)]
+    weights = [1 / (rank + 1) for rank in range(len(entities))]
+    questions = [
+        rng.choice(["What is {}?", "what is {}", "What is  {} ?"]).format(entity)
+        for entity in rng.choices(entities, weights, k=2000)
+    ]
+    searched: List[str] = list()
+
+    async def slow_search(query: str) -> str:
+        searched.append(query)
+        await asyncio.sleep(0.02)
+        return f"{normalize_query(query)} is a thing"
+
+    async def ask_all(lookup) -> float:
+        sessions = asyncio.Semaphore(16)
+
+        async def ask(question: str) -> None:
+            async with sessions:
+                await lookup(question)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(question) for question in questions))
+        return time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "search_cache.jsonl")
+        cache = SearchCache(path=path)
+        for label, lookup in [
+            ("Uncached", slow_search),
+            ("Cached", lambda question: cache.get_or_search_async("test", question, slow_search)),
+        ]:
+            searched.clear()
+            elapsed = asyncio.run(ask_all(lookup))
+            print(f"{label}: {len(questions)} questions from 16 sessions, {len(searched)} searches in {elapsed:.2f}s")
+        print(cache.report())
+
+        restarted = SearchCache(path=path)
+        searched.clear()
+        asyncio.run(ask_all(lambda question: restarted.get_or_search_async("test", question, slow_search)))
+        print(f"Restarted cache: {len(restarted)} entries loaded, {len(searched)} searches for the same questions")
+
+
+BENCHMARKS = [
+    benchmark_runtime_reuse,
+    benchmark_setup,
+    benchmark_concurrency,
+    benchmark_direct_execution,
+    benchmark_history_budget,
+    benchmark_review_policy,
+    benchmark_single_call_research,
+    benchmark_shared_research,
+    benchmark_search_cache,
+]
+
+
+if __name__ == "__main__":
+    for benchmark in BENCHMARKS:
+        benchmark()
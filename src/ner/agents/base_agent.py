@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, Optional
 
-from autogen_core.base import MessageContext
+from autogen_core.base import CancellationToken, MessageContext
 from autogen_core.components import (
     DefaultTopicId,
     RoutedAgent,
@@ -17,6 +17,8 @@ from pydantic import BaseModel
 from rich.console import Console
 from rich.markdown import Markdown
 
+from ner.agents.history_budget import HistoryBudget, HistoryPolicy
+
 
 class GroupChatMessage(BaseModel):
     body: UserMessage
@@ -27,36 +29,42 @@ class RequestToSpeak(BaseModel):
 
 
 class BaseGroupChatAgent(RoutedAgent):
+    # what the agent role needs of the chat history, None sends all of it
+    history_policy: Optional[HistoryPolicy] = None
+
     def __init__(
         self,
         description: str,
         group_chat_topic_type: str,
         model_client: ChatCompletionClient,
         system_message: str,
+        history_budget: Optional[HistoryBudget] = None,
     ) -> None:
         super().__init__(description=description)
         self._group_chat_topic_type = group_chat_topic_type
         self._model_client = model_client
         self._system_message = SystemMessage(system_message)
         self._chat_history: List[LLMMessage] = []
+        self._history_budget = history_budget
 
-    @message_handler
-    async def handle_message(
-        self, message: GroupChatMessage, ctx: MessageContext
-    ) -> None:
+    def receive(self, body: UserMessage) -> None:
         self._chat_history.extend(
             [
-                UserMessage(
-                    content=f"Transferred to {message.body.source}", source="system"
-                ),
-                message.body,
+                UserMessage(content=f"Transferred to {body.source}", source="system"),
+                body,
             ]
         )
 
-    @message_handler
-    async def handle_request_to_speak(
-        self, message: RequestToSpeak, ctx: MessageContext
-    ) -> None:
+    def get_history(self) -> List[LLMMessage]:
+        # the chat history as sent to the model
+        if self._history_budget is None or self.history_policy is None:
+            return self._chat_history
+        return self._history_budget.compact(
+            self.id.type, self.id.key, self.history_policy, self._chat_history
+        )
+
+    async def speak(self, cancellation_token: CancellationToken | None = None) -> str:
+        # the agent's next message in the group chat
         Console().print(Markdown(f"### {self.id.type}: "))
         # self._chat_history.append(
         #     UserMessage(
@@ -66,7 +74,7 @@ class BaseGroupChatAgent(RoutedAgent):
         # )
         print(f"Taking into account last message:\n {self._chat_history[-1].content}")
         completion = await self._model_client.create(
-            [self._system_message] + self._chat_history,
+            [self._system_message] + self.get_history(),
             extra_create_args={"temperature": 0},
         )
         assert isinstance(completion.content, str)
@@ -74,10 +82,20 @@ class BaseGroupChatAgent(RoutedAgent):
             AssistantMessage(content=completion.content, source=self.id.type)
         )
         # Console().print(Markdown(completion.content))
+        return completion.content
+
+    @message_handler
+    async def handle_message(
+        self, message: GroupChatMessage, ctx: MessageContext
+    ) -> None:
+        self.receive(message.body)
 
+    @message_handler
+    async def handle_request_to_speak(
+        self, message: RequestToSpeak, ctx: MessageContext
+    ) -> None:
+        content = await self.speak(ctx.cancellation_token)
         await self.publish_message(
-            GroupChatMessage(
-                body=UserMessage(content=completion.content, source=self.id.type)
-            ),
+            GroupChatMessage(body=UserMessage(content=content, source=self.id.type)),
             topic_id=DefaultTopicId(type=self._group_chat_topic_type),
         )
@@ -1,3 +1,5 @@
+import time
+from collections import namedtuple
 from copy import deepcopy
 from typing import List, Any, Dict, Optional
 
@@ -13,6 +15,7 @@ from autogen_core.components.models import (
 )
 from ner.agents.base_agent import GroupChatMessage, RequestToSpeak
 from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE
+from ner.agents.review_policy import ReviewPolicy
 from ner.agents.reviewer_agent import REVIEWER_TOPIC_TYPE
 from ner.agents.tagger_agent import TAGGER_TOPIC_TYPE
 from ner.converter import Converter
@@ -21,6 +24,8 @@ from ner.grounding import GroundingEngine
 
 MAX_AGENT_TURNS = 10
 
+Route = namedtuple("Route", ["tagger_messages", "next_speaker"])
+
 
 class ChatSupervisor(RoutedAgent):
     def __init__(
@@ -31,6 +36,7 @@ class ChatSupervisor(RoutedAgent):
         metadata: Dict[str, Any],
         grounding_engine: Optional[GroundingEngine] = None,
         researcher: bool = True,
+        review_policy: Optional[ReviewPolicy] = None,
     ) -> None:
         super().__init__("Group chat manager")
         self._participant_topic_types = participant_topic_types
@@ -43,41 +49,62 @@ class ChatSupervisor(RoutedAgent):
         self._grounding_engine = grounding_engine
         self._researcher = researcher
         self._output_grounded = False
+        self._review_policy = review_policy
+        self._last_route_time: Optional[float] = None
+        # every message of the session as the supervisor saw it
+        self._metadata["transcript"] = self._chat_history
 
     @message_handler
     async def handle_message(
         self, message: GroupChatMessage, ctx: MessageContext
     ) -> None:
         assert isinstance(message.body, UserMessage)
-        self._chat_history.append(message.body)
+        route = await self.route(message.body)
+        for tagger_message in route.tagger_messages:
+            await self.publish_message(
+                GroupChatMessage(body=tagger_message),
+                DefaultTopicId(type=TAGGER_TOPIC_TYPE),
+            )
+        if route.next_speaker is not None:
+            await self.publish_message(
+                RequestToSpeak(), DefaultTopicId(type=route.next_speaker)
+            )
+
+    async def route(self, body: UserMessage) -> Route:
+        # what follows a group chat message: messages only the tagger gets,
+        # then who speaks next. The chat ends when nobody is asked to speak
+        self._chat_history.append(body)
         self._num_agent_turns += 1
+        if self._review_policy and self._last_route_time is not None:
+            self._review_policy.record_turn(body.source, time.perf_counter() - self._last_route_time)
 
+        route = await self.select_route(body)
+        self._last_route_time = time.perf_counter()
+        return route
+
+    async def select_route(self, body: UserMessage) -> Route:
         if self._num_agent_turns > MAX_AGENT_TURNS:
-            print(f"Too many agent invocations!")
-            return
-
-        if message.body.source == REVIEWER_TOPIC_TYPE:
-            await self.handle_reviewer_message(message)
-        elif message.body.source == RESEARCHER_TOPIC_TYPE:
-            await self.handle_researcher_message(message)
-        elif message.body.source == "User" or message.body.source == "system":
-            await self.handle_user_message(message)
+            print("Too many agent invocations!")
+            return Route([], None)
+
+        if body.source == REVIEWER_TOPIC_TYPE:
+            return await self.handle_reviewer_message(body)
+        elif body.source == RESEARCHER_TOPIC_TYPE:
+            return await self.handle_researcher_message(body)
+        elif body.source == "User" or body.source == "system":
+            return await self.handle_user_message(body)
         else:
-            await self.handle_tagger_message(message)
+            return await self.handle_tagger_message(body)
 
-    async def handle_reviewer_message(self, message: GroupChatMessage):
-        print(f"Handling reviewer message. Content: {message.body.content}")
+    async def handle_reviewer_message(self, body: UserMessage) -> Route:
+        print(f"Handling reviewer message. Content: {body.content}")
         selected_topic_type = ""
         # If the message is an approval message from the reviewer, stop the chat.
-        assert isinstance(message.body.content, str)
-        if "<search>" in message.body.content:
-            selected_topic_type = RESEARCHER_TOPIC_TYPE
-            await self.publish_message(
-                RequestToSpeak(), DefaultTopicId(type=selected_topic_type)
-            )
+        assert isinstance(body.content, str)
+        if "<search>" in body.content:
             self._previous_participant_topic_type = REVIEWER_TOPIC_TYPE
-            return
-        if "<feedback>" in message.body.content:
+            return Route([], RESEARCHER_TOPIC_TYPE)
+        if "<feedback>" in body.content:
             selected_topic_type = TAGGER_TOPIC_TYPE
             self._chat_history.append(
                 UserMessage(
@@ -85,20 +112,17 @@ class ChatSupervisor(RoutedAgent):
                     content=self._metadata.get("query", ""),
                 )
             )
-        elif "APPROVED!" in message.body.content:
+        elif "APPROVED!" in body.content:
             if not self._grounding_engine:
-                print(f"No grounding engine provided so ending the conversation")
-                return
-            await self.ground_output(self._metadata["last_tagger_output"])
-            return
+                print("No grounding engine provided so ending the conversation")
+                self._metadata["approved"] = True
+                return Route([], None)
+            return await self.ground_output(self._metadata["last_tagger_output"])
 
-        await self.publish_message(
-            RequestToSpeak(), DefaultTopicId(type=selected_topic_type)
-        )
         self._previous_participant_topic_type = selected_topic_type
+        return Route([], selected_topic_type or None)
 
-    async def ground_output(self, llm_output: str):
-        self._output_grounded = True
+    def get_iob2_labels(self, llm_output: str) -> List[str]:
         tokens = self._metadata.get("tokens", [])
         entity_types = self._metadata.get("entity_types", [])
         genia_converter = self._metadata.get(
@@ -107,61 +131,62 @@ class ChatSupervisor(RoutedAgent):
 
         copy_tokens = deepcopy(tokens)
         _, genia_labels = genia_converter(llm_output, copy_tokens, entity_types)  # type: ignore
-        iob2_labels = Converter.convert_genia_to_iob2(genia_labels, tokens)
+        return Converter.convert_genia_to_iob2(genia_labels, tokens)
 
+    async def ground_output(self, llm_output: str) -> Route:
+        tokens = self._metadata.get("tokens", [])
+        iob2_labels = self.get_iob2_labels(llm_output)
         grounding_feedback = self._grounding_engine.verify(tokens, iob2_labels).get_text_feedback()  # type: ignore
+        return self.send_grounding_feedback(grounding_feedback)
+
+    def send_grounding_feedback(self, grounding_feedback: str) -> Route:
+        self._output_grounded = True
         print(f"Providing grounding feedback to agent: {grounding_feedback}")
-        if grounding_feedback.strip():
-            print(f"Requesting tagger to speak after grounding")
-            self._chat_history.append(
-                UserMessage(
-                    source="User",
-                    content=f"\nPlease consider the following feedback from grounding engine as well:\n\n<grounding_feedback>\n{grounding_feedback}\n</grounding_feedback>",
-                )
-            )
-            self._previous_participant_topic_type = TAGGER_TOPIC_TYPE
-            await self.publish_message(
-                GroupChatMessage(body=self._chat_history[-1]),
-                DefaultTopicId(type=TAGGER_TOPIC_TYPE),
-            )
-            await self.publish_message(
-                RequestToSpeak(), DefaultTopicId(type=TAGGER_TOPIC_TYPE)
+        # approved by the reviewer and consistent with the knowledge base
+        self._metadata["approved"] = not grounding_feedback.strip()
+        if not grounding_feedback.strip():
+            return Route([], None)
+
+        print("Requesting tagger to speak after grounding")
+        self._chat_history.append(
+            UserMessage(
+                source="User",
+                content=f"\nPlease consider the following feedback from grounding engine as well:\n\n<grounding_feedback>\n{grounding_feedback}\n</grounding_feedback>",
             )
+        )
+        self._previous_participant_topic_type = TAGGER_TOPIC_TYPE
+        return Route([self._chat_history[-1]], TAGGER_TOPIC_TYPE)
 
-    async def handle_researcher_message(self, message: GroupChatMessage):
+    async def handle_researcher_message(self, body: UserMessage) -> Route:
         print(
             f"Handling researcher response. Requesting {self._previous_participant_topic_type} to speak"
         )
-        await self.publish_message(
-            RequestToSpeak(),
-            DefaultTopicId(type=self._previous_participant_topic_type or ""),
-        )
+        return Route([], self._previous_participant_topic_type or None)
 
-    async def handle_user_message(self, message: GroupChatMessage):
+    async def handle_user_message(self, body: UserMessage) -> Route:
         self._previous_participant_topic_type = TAGGER_TOPIC_TYPE
-        await self.publish_message(
-            RequestToSpeak(), DefaultTopicId(type=TAGGER_TOPIC_TYPE)
-        )
+        return Route([], TAGGER_TOPIC_TYPE)
 
-    async def handle_tagger_message(self, message: GroupChatMessage):
+    async def handle_tagger_message(self, body: UserMessage) -> Route:
         selected_topic_type = ""
-        print(f"Handling tagger message. Content: {message.body.content}")
-
-        if "<output>" in message.body.content and self._output_grounded:
-            print(f"Tagger agent updated output based on grounding")
-            self._metadata["last_tagger_output"] = message.body.content  # type: ignore
-            return
-        if "<output>" in message.body.content or "<objection>" in message.body.content:
+        tagger_messages = list()
+        print(f"Handling tagger message. Content: {body.content}")
+
+        if "<output>" in body.content and self._output_grounded:
+            print("Tagger agent updated output based on grounding")
+            self._metadata["last_tagger_output"] = body.content  # type: ignore
+            return Route([], None)
+        if "<output>" in body.content or "<objection>" in body.content:
             selected_topic_type = REVIEWER_TOPIC_TYPE
-            print(f"Updating tagger output: {message.body.content}")
-            self._metadata["last_tagger_output"] = message.body.content  # type: ignore
-        elif "<search>" in message.body.content:
-            selected_topic_type = RESEARCHER_TOPIC_TYPE
-            await self.publish_message(
-                RequestToSpeak(), DefaultTopicId(type=RESEARCHER_TOPIC_TYPE)
-            )
+            print(f"Updating tagger output: {body.content}")
+            self._metadata["last_tagger_output"] = body.content  # type: ignore
+            if self._review_policy and "<output>" in body.content:
+                route = self.apply_review_policy(body.content)  # type: ignore
+                if route is not None:
+                    return route
+        elif "<search>" in body.content:
             self._previous_participant_topic_type = TAGGER_TOPIC_TYPE
-            return
+            return Route([], RESEARCHER_TOPIC_TYPE)
         else:
             selected_topic_type = TAGGER_TOPIC_TYPE
             self._chat_history.append(
@@ -170,16 +195,40 @@ class ChatSupervisor(RoutedAgent):
                     content="You should put your final output inside <output> tags!",
                 )
             )
-            await self.publish_message(
-                GroupChatMessage(body=self._chat_history[-1]),
-                DefaultTopicId(type=TAGGER_TOPIC_TYPE),
-            )
+            tagger_messages.append(self._chat_history[-1])
 
         if self._output_grounded:
-            return
+            return Route(tagger_messages, None)
 
         self._previous_participant_topic_type = selected_topic_type
-
-        await self.publish_message(
-            RequestToSpeak(), DefaultTopicId(type=selected_topic_type)
+        return Route(tagger_messages, selected_topic_type)
+
+    def apply_review_policy(self, llm_output: str) -> Optional[Route]:
+        # the route that replaces the review of this output, None if the
+        # reviewer is still needed
+        policy = self._review_policy
+        assert policy is not None
+        checks = policy.check(
+            llm_output,
+            self._metadata.get("tokens", []),
+            self.get_iob2_labels(llm_output),
+            self._metadata.get("entity_types", []),
+            self._grounding_engine,
         )
+        print(f"Review policy checks: {checks}")
+        if not (checks.fidelity and checks.ontology):
+            return None
+
+        if checks.grounded and policy.skip_grounded:
+            print("Output is grounded, skipping the review")
+            policy.record_skip("skip_grounded", [REVIEWER_TOPIC_TYPE])
+            # not marked approved, online grounding only learns from
+            # outputs a reviewer approved
+            self._output_grounded = True
+            return Route([], None)
+        if checks.grounding_feedback.strip() and policy.ground_first:
+            print("Grounding disagrees with the output, skipping the review")
+            policy.record_skip("ground_first", [REVIEWER_TOPIC_TYPE])
+            return self.send_grounding_feedback(checks.grounding_feedback)
+
+        return None
@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from autogen_core.base import AgentId, AgentInstantiationContext, CancellationToken, TopicId
+from autogen_core.components.models import ChatCompletionClient, UserMessage
+
+from ner.agents.agent_config import AgentConfig
+from ner.agents.base_agent import BaseGroupChatAgent
+from ner.agents.chat_supervisor import ChatSupervisor
+from ner.agents.history_budget import HistoryBudget
+from ner.agents.review_policy import ReviewPolicy
+from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE, ResearchAgent
+from ner.agents.research_service import ResearchService
+from ner.agents.reviewer_agent import REVIEWER_TOPIC_TYPE, ReviewerAgent
+from ner.agents.tagger_agent import TAGGER_TOPIC_TYPE, TaggerAgent
+from ner.agents.tools.local_search import LocalSearchIndex
+from ner.grounding import GroundingEngine
+
+
+class DirectRuntime:
+    # the part of the AgentRuntime interface the agents use outside their
+    # message handlers. DirectExecutor calls the agents itself and hands each
+    # answer on, so what they publish is only kept, one runtime per session
+    def __init__(self) -> None:
+        self.published: List[Tuple[Any, TopicId]] = list()
+
+    async def publish_message(
+        self,
+        message: Any,
+        topic_id: TopicId,
+        *,
+        sender: AgentId | None = None,
+        cancellation_token: CancellationToken | None = None,
+    ) -> None:
+        self.published.append((message, topic_id))
+
+    async def send_message(
+        self,
+        message: Any,
+        recipient: AgentId,
+        *,
+        sender: AgentId | None = None,
+        cancellation_token: CancellationToken | None = None,
+    ) -> Any:
+        raise NotImplementedError("Agents run by DirectExecutor have no recipients to message directly")
+
+
+@dataclass
+class DirectExecutor:
+    # runs the tagger/reviewer/researcher protocol of ChatSupervisor as a
+    # loop of direct calls: the supervisor routes each message, the next
+    # speaker answers, and the answer is handed to the other participants the
+    # way the runtime would have delivered it. Same agents, prompts and
+    # transcripts as the runtime, without envelopes, topics or tasks.
+    agent_config: AgentConfig
+    llm_client: ChatCompletionClient
+    grounding_engine: Optional[GroundingEngine] = None
+    internet_access: bool = True
+    researcher: bool = True
+    group_chat_topic_type: str = "GroupChat"
+    history_budget: Optional[HistoryBudget] = None
+    review_policy: Optional[ReviewPolicy] = None
+    local_search: Optional[LocalSearchIndex] = None
+    single_call_research: bool = False
+    research_service: Optional[ResearchService] = None
+
+    def _create(self, runtime: DirectRuntime, agent_type: str, session_id: str, factory: Any) -> Any:
+        with AgentInstantiationContext.populate_context(
+            (runtime, AgentId(type=agent_type, key=session_id))  # type: ignore
+        ):
+            return factory()
+
+    def create_session(
+        self, session_id: str, metadata: Dict[str, Any]
+    ) -> Tuple[Dict[str, BaseGroupChatAgent], ChatSupervisor]:
+        runtime = DirectRuntime()
+        participants: Dict[str, BaseGroupChatAgent] = {
+            TAGGER_TOPIC_TYPE: self._create(
+                runtime,
+                TAGGER_TOPIC_TYPE,
+                session_id,
+                lambda: TaggerAgent(
+                    description=self.agent_config.tagger_description,
+                    group_chat_topic_type=self.group_chat_topic_type,
+                    model_client=self.llm_client,
+                    system_prompt=self.agent_config.tagger_system_prompt,
+                    history_budget=self.history_budget,
+                ),
+            ),
+            REVIEWER_TOPIC_TYPE: self._create(
+                runtime,
+                REVIEWER_TOPIC_TYPE,
+                session_id,
+                lambda: ReviewerAgent(
+                    description=self.agent_config.reviewer_description,
+                    group_chat_topic_type=self.group_chat_topic_type,
+                    model_client=self.llm_client,
+                    system_prompt=self.agent_config.reviewer_system_prompt,
+                    history_budget=self.history_budget,
+                ),
+            ),
+            RESEARCHER_TOPIC_TYPE: self._create(
+                runtime,
+                RESEARCHER_TOPIC_TYPE,
+                session_id,
+                lambda: ResearchAgent(
+                    description=self.agent_config.researcher_description,
+                    group_chat_topic_type=self.group_chat_topic_type,
+                    model_client=self.llm_client,
+                    system_prompt=self.agent_config.researcher_system_prompt,
+                    internet_access=self.internet_access,
+                    enabled=self.researcher,
+                    history_budget=self.history_budget,
+                    search_tool=self.local_search.as_tool() if self.local_search else None,
+                    single_call=self.single_call_research,
+                    research_service=self.research_service,
+                ),
+            ),
+        }
+        supervisor = self._create(
+            runtime,
+            "group_chat_manager",
+            session_id,
+            lambda: ChatSupervisor(
+                participant_topic_types=list(participants),
+                model_client=self.llm_client,
+                participant_descriptions=[
+                    self.agent_config.tagger_description,
+                    self.agent_config.reviewer_description,
+                    self.agent_config.researcher_description,
+                ],
+                metadata=metadata,
+                grounding_engine=self.grounding_engine,
+                review_policy=self.review_policy,
+            ),
+        )
+        return participants, supervisor
+
+    async def run(self, query: str, session_id: str, metadata: Dict[str, Any]) -> None:
+        participants, supervisor = self.create_session(session_id, metadata)
+
+        message: Optional[UserMessage] = UserMessage(content=query, source="User")
+        while message is not None:
+            # a group chat message reaches everyone but its sender
+            for topic_type, participant in participants.items():
+                if topic_type != message.source:
+                    participant.receive(message)
+
+            route = await supervisor.route(message)
+            for tagger_message in route.tagger_messages:
+                participants[TAGGER_TOPIC_TYPE].receive(tagger_message)
+            if route.next_speaker not in participants:
+                break
+
+            content = await participants[route.next_speaker].speak()
+            message = UserMessage(content=content, source=route.next_speaker)
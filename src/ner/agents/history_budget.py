@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from autogen_core.components.models import LLMMessage
+
+from ner.prompt_budget import estimate_tokens
+
+
+TRANSFER_PREFIX = "Transferred to "
+
+
+def _get_cost(messages: List[LLMMessage]) -> int:
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+
+def _group_turns(history: List[LLMMessage]) -> List[List[LLMMessage]]:
+    # a broadcast message and the "Transferred to" marker before it are one turn
+    turns: List[List[LLMMessage]] = list()
+    pending: List[LLMMessage] = list()
+    for message in history:
+        pending.append(message)
+        is_marker = message.source == "system" and str(message.content).startswith(TRANSFER_PREFIX)  # type: ignore
+        if not is_marker:
+            turns.append(pending)
+            pending = list()
+    if pending:
+        turns.append(pending)
+
+    return turns
+
+
+@dataclass(frozen=True)
+class HistoryPolicy:
+    # the latest message with anchor_tag (sent by anchor_source) is what an
+    # agent role works from. Turns before it were settled by it and are
+    # dropped, the turns after it are still open: feedback, answers and
+    # reminders the role has to act on
+    anchor_tag: str
+    anchor_source: Optional[str] = None
+    # settled turns worth keeping while the budget allows, e.g. research
+    # answers that still hold for later outputs
+    keep_tags: Tuple[str, ...] = ()
+
+    def is_anchor(self, message: LLMMessage) -> bool:
+        return self.anchor_tag in str(message.content) and (
+            self.anchor_source is None or message.source == self.anchor_source  # type: ignore
+        )
+
+    def compact(self, history: List[LLMMessage], max_tokens: int) -> List[LLMMessage]:
+        # keeps the task (first turn) and the anchor whatever they cost, then
+        # the open turns and the settled turns with keep_tags, newest first
+        # while they fit into max_tokens
+        turns = _group_turns(history)
+        if len(turns) <= 1:
+            return history
+
+        anchor = next(
+            (i for i in range(len(turns) - 1, 0, -1) if any(self.is_anchor(m) for m in turns[i])),
+            0,
+        )
+        budget = max_tokens - _get_cost(turns[0]) - (_get_cost(turns[anchor]) if anchor else 0)
+
+        open_turns: List[List[LLMMessage]] = list()
+        for turn in reversed(turns[anchor + 1 :]):
+            cost = _get_cost(turn)
+            # the latest turn is what the agent is asked to respond to
+            if cost > budget and open_turns:
+                break
+            open_turns.append(turn)
+            budget -= cost
+
+        settled_turns: List[List[LLMMessage]] = list()
+        for turn in reversed(turns[1:anchor]):
+            if not any(tag in str(message.content) for message in turn for tag in self.keep_tags):
+                continue
+            cost = _get_cost(turn)
+            if cost > budget:
+                break
+            settled_turns.append(turn)
+            budget -= cost
+
+        kept = list(turns[0])
+        for turn in reversed(settled_turns):
+            kept += turn
+        if anchor:
+            kept += turns[anchor]
+        for turn in reversed(open_turns):
+            kept += turn
+        return kept
+
+
+@dataclass
+class HistoryBudget:
+    # token budget of the chat history each agent sends to the model, per
+    # role with max_tokens as the default
+    max_tokens: int = 2000
+    role_max_tokens: Dict[str, int] = field(default_factory=dict)
+    # tokens left out of model calls in open sessions, by session id
+    tokens_saved: Dict[str, int] = field(default_factory=dict)
+    # tokens saved by each closed session
+    session_tokens_saved: List[int] = field(default_factory=list)
+
+    def compact(
+        self,
+        role: str,
+        session_id: str,
+        policy: HistoryPolicy,
+        history: List[LLMMessage],
+    ) -> List[LLMMessage]:
+        kept = policy.compact(history, self.role_max_tokens.get(role, self.max_tokens))
+        if len(kept) < len(history):
+            saved = _get_cost(history) - _get_cost(kept)
+            self.tokens_saved[session_id] = self.tokens_saved.get(session_id, 0) + saved
+
+        return kept
+
+    def close_session(self, session_id: str) -> int:
+        saved = self.tokens_saved.pop(session_id, 0)
+        self.session_tokens_saved.append(saved)
+        return saved
+
+    def report(self) -> str:
+        sessions = len(self.session_tokens_saved)
+        total = sum(self.session_tokens_saved)
+        average = total / sessions if sessions else 0
+
+        return f"History budget of {self.max_tokens} tokens: saved {total} input tokens over {sessions} sessions ({average:.1f} per session)"
@@ -4,10 +4,9 @@ from dataclasses import dataclass, field
 from typing import List, Optional, Tuple, Any, Dict
 import uuid
 
-from autogen_core.base import TopicId
+from autogen_core.base import AgentInstantiationContext, TopicId
 from autogen_core.components.models import ChatCompletionClient, UserMessage
 
-from autogen_core.application import SingleThreadedAgentRuntime
 from autogen_core.components import TypeSubscription
 import nltk
 
@@ -16,10 +15,20 @@ from ner.agents.tagger_agent import TAGGER_TOPIC_TYPE, TaggerAgent
 from ner.agents.reviewer_agent import REVIEWER_TOPIC_TYPE, ReviewerAgent
 from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE, ResearchAgent
 from ner.agents.chat_supervisor import ChatSupervisor
+from ner.agents.history_budget import HistoryBudget
+from ner.agents.review_policy import ReviewPolicy
+from ner.agents.research_service import ResearchService
+from ner.agents.direct_executor import DirectExecutor
+from ner.agents.session_runtime import SessionRuntime
+from ner.agents.tools.local_search import LocalSearchIndex
+from ner.agents.tools.search import close_http_client
 from ner.agents.agent_config import AgentConfig
 from ner.converter import Converter
+from ner.eval.dataset import NERDatasetEntry
 from ner.grounding import GroundingEngine
+from ner.grounding_online import OnlineGroundingEngine
 from ner.helper import extract_tag
+from ner.prompt_budget import PromptBudget
 from ner.tagger import Tagger
 
 
@@ -31,10 +40,36 @@ class MultiAgentTagger(Tagger):
     internet_access: bool = True
     researcher: bool = True
     metadata: Dict[str, Any] = field(default_factory=dict)
+    prompt_budget: Optional[PromptBudget] = None
+    grounding_hints: bool = False
+    history_budget: Optional[HistoryBudget] = None
+    # deterministic checks that let outputs skip the reviewer
+    review_policy: Optional[ReviewPolicy] = None
+    # searched by the researcher instead of the web
+    local_search: Optional[LocalSearchIndex] = None
+    # the researcher searches the questions of <search> tags without a tool call
+    single_call_research: bool = False
+    # one researcher answers the requests of all concurrent sessions in batches
+    shared_research: bool = False
+    # run sessions through DirectExecutor instead of the agent runtime
+    direct_execution: bool = False
     group_chat_topic_type = "GroupChat"
 
-    async def initialize_agents(self) -> SingleThreadedAgentRuntime:
-        self.runtime = SingleThreadedAgentRuntime()
+    # the runtime and agent registrations are created once per tagger. Each
+    # sentence is a session: its messages are published under its own topic
+    # source, so it gets fresh agent instances keyed by that source and many
+    # sessions can run in the same runtime at once
+    runtime: Optional[SessionRuntime] = field(default=None, init=False, repr=False)
+    sessions: Dict[str, Dict[str, Any]] = field(default_factory=dict, init=False, repr=False)
+    _loop: Optional[asyncio.AbstractEventLoop] = field(default=None, init=False, repr=False)
+    _executor: Optional[DirectExecutor] = field(default=None, init=False, repr=False)
+    research_service: Optional[ResearchService] = field(default=None, init=False, repr=False)
+
+    async def initialize_agents(self) -> SessionRuntime:
+        if self.runtime is not None:
+            return self.runtime
+
+        self.runtime = SessionRuntime()
 
         research_topic_type = RESEARCHER_TOPIC_TYPE
         tagger_topic_type = TAGGER_TOPIC_TYPE
@@ -48,6 +83,7 @@ class MultiAgentTagger(Tagger):
                 group_chat_topic_type=self.group_chat_topic_type,
                 model_client=self.llm_client,
                 system_prompt=self.agent_config.tagger_system_prompt,
+                history_budget=self.history_budget,
             ),
         )
         await self.runtime.add_subscription(
@@ -69,6 +105,7 @@ class MultiAgentTagger(Tagger):
                 group_chat_topic_type=self.group_chat_topic_type,
                 model_client=self.llm_client,
                 system_prompt=self.agent_config.reviewer_system_prompt,
+                history_budget=self.history_budget,
             ),
         )
         await self.runtime.add_subscription(
@@ -93,6 +130,10 @@ class MultiAgentTagger(Tagger):
                 system_prompt=self.agent_config.researcher_system_prompt,
                 internet_access=self.internet_access,
                 enabled=self.researcher,
+                history_budget=self.history_budget,
+                search_tool=self.local_search.as_tool() if self.local_search else None,
+                single_call=self.single_call_research,
+                research_service=self.get_research_service(),
             ),
         )
 
@@ -108,7 +149,6 @@ class MultiAgentTagger(Tagger):
             )
         )
 
-        self.metadata = {}
         chat_supervisor_type = await ChatSupervisor.register(
             self.runtime,
             "group_chat_manager",
@@ -124,8 +164,9 @@ class MultiAgentTagger(Tagger):
                     self.agent_config.reviewer_description,
                     self.agent_config.researcher_description,
                 ],
-                metadata=self.metadata,
+                metadata=self.sessions[AgentInstantiationContext.current_agent_id().key],
                 grounding_engine=self.grounding_engine,
+                review_policy=self.review_policy,
             ),
         )
 
@@ -136,47 +177,132 @@ class MultiAgentTagger(Tagger):
             )
         )
 
+        # keeps processing messages until the tagger is closed
+        self.runtime.start()
         return self.runtime
 
+    async def close_async(self) -> None:
+        if self.runtime is not None:
+            await self.runtime.stop()
+            self.runtime = None
+        if self.local_search:
+            self.local_search.close()
+        await close_http_client()
+
+    def open_session(self) -> Tuple[str, Dict[str, Any]]:
+        session_id = str(uuid.uuid4())
+        self.sessions[session_id] = {}
+        research_service = self.get_research_service()
+        if research_service:
+            research_service.open_session()
+        return session_id, self.sessions[session_id]
+
+    def close_session(self, session_id: str) -> None:
+        # drops the agent instances of the session with their chat histories
+        if self.sessions.pop(session_id, None) is not None and self.research_service:
+            self.research_service.close_session()
+        if self.history_budget:
+            self.history_budget.close_session(session_id)
+        if self.runtime is not None:
+            self.runtime.close_session(session_id)
+
+    def get_executor(self) -> DirectExecutor:
+        if self._executor is None:
+            self._executor = DirectExecutor(
+                agent_config=self.agent_config,
+                llm_client=self.llm_client,
+                grounding_engine=self.grounding_engine,
+                internet_access=self.internet_access,
+                researcher=self.researcher,
+                group_chat_topic_type=self.group_chat_topic_type,
+                history_budget=self.history_budget,
+                review_policy=self.review_policy,
+                local_search=self.local_search,
+                single_call_research=self.single_call_research,
+                research_service=self.get_research_service(),
+            )
+
+        return self._executor
+
+    def get_research_service(self) -> Optional[ResearchService]:
+        if self.shared_research and self.research_service is None:
+            self.research_service = ResearchService(
+                model_client=self.llm_client,
+                system_prompt=self.agent_config.researcher_system_prompt,
+                search_tool=self.local_search.as_tool() if self.local_search else None,
+                internet_access=self.internet_access,
+            )
+
+        return self.research_service
+
     async def recognize_async(
         self, tokens: List[str], left_context: str = "", right_context: str = ""
     ):
-        await self.initialize_agents()
+        if not self.direct_execution:
+            await self.initialize_agents()
+        session_id, session = self.open_session()
+        try:
+            return await self._recognize_in_session(
+                session_id, session, tokens, left_context, right_context
+            )
+        finally:
+            self.close_session(session_id)
+
+    async def _recognize_in_session(
+        self,
+        session_id: str,
+        session: Dict[str, Any],
+        tokens: List[str],
+        left_context: str,
+        right_context: str,
+    ):
         self.metadata["distances"] = self.metadata.get("distances", [[], []])
+        if self.prompt_budget:
+            left_context, right_context = self.prompt_budget.fit_context(
+                tokens, left_context, right_context
+            )
         query_template = "{}\n\n<text_to_tag>{}</text_to_tag>\n\n{}\n\nOnly tag this text: <text_to_tag>{}</text_to_tag>"
         query = query_template.format(
             left_context, " ".join(tokens), right_context, " ".join(tokens)
         )
-        self.metadata["query"] = (
+        if self.grounding_hints and self.grounding_engine:
+            hints = self.grounding_engine.get_text_hints(tokens)
+            if hints:
+                query += f"\n\nThe following mentions in the text are known from previously tagged data:\n<grounding_hints>\n{hints}</grounding_hints>"
+        session["query"] = (
             f"Remember, you need to tag the following:\n <text_to_tag>{' '.join(tokens)}</text_to_tag>"
         )
-        self.metadata["tokens"] = tokens
-        self.metadata["entity_types"] = self.entity_types
-        self.metadata["convert_to_genia_labels"] = (
+        session["tokens"] = tokens
+        session["entity_types"] = self.entity_types
+        session["convert_to_genia_labels"] = (
             MultiAgentTagger.convert_to_genia_labels
         )
 
         print(f"Starting the chat with following query: {query}")
-        self.runtime.start()
-        session_id = str(uuid.uuid4())
-        await self.runtime.publish_message(
-            GroupChatMessage(
-                body=UserMessage(
-                    content=query,
-                    source="User",
-                )
-            ),
-            TopicId(type=self.group_chat_topic_type, source=session_id),
-        )
-        await self.runtime.stop_when_idle()
+        if self.direct_execution:
+            await self.get_executor().run(query, session_id, session)
+        else:
+            assert self.runtime is not None
+            await self.runtime.publish_message(
+                GroupChatMessage(
+                    body=UserMessage(
+                        content=query,
+                        source="User",
+                    )
+                ),
+                TopicId(type=self.group_chat_topic_type, source=session_id),
+            )
+            await self.runtime.wait_for_session(session_id)
+        if self.history_budget:
+            print(f"History budget saved {self.history_budget.tokens_saved.get(session_id, 0)} input tokens in this session")
 
         tokens_copy = deepcopy(tokens)
         tagged_string, genia_labels = MultiAgentTagger.convert_to_genia_labels(
-            self.metadata.get("last_tagger_output", ""), tokens, self.entity_types  # type: ignore
+            session.get("last_tagger_output", ""), tokens, self.entity_types  # type: ignore
         )
         print(f"Predicted entities: {genia_labels}")
         raw_tagged_string = (
-            extract_tag(self.metadata.get("last_tagger_output", ""), "output")
+            extract_tag(session.get("last_tagger_output", ""), "output")
             .replace("\\n", "")
             .strip()
         )
@@ -194,15 +320,61 @@ class MultiAgentTagger(Tagger):
         self.metadata["distances"][0].append(len(input_sentence))
         self.metadata["distances"][1].append(distance)
 
-        return tagged_string, Converter.convert_genia_to_iob2(genia_labels, tokens)
+        iob2_labels = Converter.convert_genia_to_iob2(genia_labels, tokens)
+        if isinstance(self.grounding_engine, OnlineGroundingEngine) and session.get("approved"):
+            self.grounding_engine.accept(tokens, iob2_labels)
+
+        return tagged_string, iob2_labels
 
     def recognize(
         self, tokens: List[str], left_context: str = "", right_context: str = ""
     ) -> Tuple[str, List[str]]:
-        response = asyncio.run(
+        # one event loop for the tagger, the runtime and the model client are
+        # reused across sentences
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        response = self._loop.run_until_complete(
             self.recognize_async(tokens, left_context, right_context)
         )
         return response  # type: ignore
 
+    async def recognize_many_async(
+        self, entries: List[NERDatasetEntry], max_concurrency: int = 8
+    ) -> List[Optional[Tuple[str, List[str]]]]:
+        # up to max_concurrency conversations at once, results in input order.
+        # A failed session has no result, None, and its error is kept in
+        # metadata["errors"], the others go on
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def recognize_entry(entry: NERDatasetEntry) -> Optional[Tuple[str, List[str]]]:
+            async with semaphore:
+                try:
+                    return await self.recognize_async(
+                        entry.tokens, entry.left_context, entry.right_context
+                    )
+                except Exception as err:
+                    print(f"Session failed to tag '{' '.join(entry.tokens)}': {str(err)}")
+                    self.metadata.setdefault("errors", []).append(str(err))
+                    return None
+
+        if not self.direct_execution:
+            await self.initialize_agents()
+        return list(await asyncio.gather(*(recognize_entry(entry) for entry in entries)))
+
+    def recognize_many(
+        self, entries: List[NERDatasetEntry], max_concurrency: int = 8
+    ) -> List[Optional[Tuple[str, List[str]]]]:
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(
+            self.recognize_many_async(entries, max_concurrency)
+        )
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.run_until_complete(self.close_async())
+            self._loop.close()
+            self._loop = None
+
     def recognize_with_feedback(self, tokens: List[str]) -> Tuple[str, List[str]]:
         pass
@@ -1,21 +1,48 @@
 import copy
 import json
+import re
+from typing import List, Optional
 
-from autogen_core.base import MessageContext
-from autogen_core.components import DefaultTopicId, FunctionCall, message_handler
+from autogen_core.base import CancellationToken
+from autogen_core.components import FunctionCall
 from autogen_core.components.models import ChatCompletionClient, UserMessage
 from autogen_core.components.tools import FunctionTool
 from rich.console import Console
 from rich.markdown import Markdown
 
-from ner.agents.base_agent import BaseGroupChatAgent, GroupChatMessage, RequestToSpeak
+from ner.agents.base_agent import BaseGroupChatAgent
+from ner.agents.history_budget import HistoryBudget, HistoryPolicy
+from ner.agents.research_service import ResearchService
 from ner.agents.tools.search import search_with_tavily
+from ner.helper import extract_tag
 
 
 RESEARCHER_TOPIC_TYPE = "Researcher"
 
+SEARCH_PATTERN = re.compile(r"<search>(.*?)</search>", re.DOTALL)
+# numbering or bullets in front of a question
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+MAX_SEARCH_QUERIES = 5
+
+
+def parse_search_queries(content: str) -> List[str]:
+    # the questions inside <search> tags, one query per line
+    queries: List[str] = list()
+    for block in SEARCH_PATTERN.findall(content):
+        for line in block.splitlines():
+            # questions on one line often build on each other, e.g. "What
+            # is IL-2? Is it a protein?", so they stay one query
+            query = LIST_MARKER_PATTERN.sub("", line).strip()
+            if query:
+                queries.append(query)
+
+    return list(dict.fromkeys(queries))[:MAX_SEARCH_QUERIES]
+
 
 class ResearchAgent(BaseGroupChatAgent):
+    # only answers the latest search request
+    history_policy = HistoryPolicy("<search>")
+
     def __init__(
         self,
         description: str,
@@ -24,59 +51,63 @@ class ResearchAgent(BaseGroupChatAgent):
         system_prompt: str,
         internet_access: bool = True,
         enabled: bool = True,
+        history_budget: Optional[HistoryBudget] = None,
+        search_tool: Optional[FunctionTool] = None,
+        single_call: bool = False,
+        research_service: Optional[ResearchService] = None,
     ) -> None:
         super().__init__(
             description=description,
             group_chat_topic_type=group_chat_topic_type,
             model_client=model_client,
             system_message=system_prompt,
+            history_budget=history_budget,
         )
 
-        self._search_tool = FunctionTool(
+        # a given tool, e.g. a local index, needs no internet access
+        self._can_search = internet_access or search_tool is not None
+        # web search unless another tool is given
+        self._search_tool = search_tool or FunctionTool(
             search_with_tavily,
             name="search",
             description="Use this tool to search anything",
         )
 
-        self._internet_access = internet_access
         self._enabled = enabled
+        # search the questions of the <search> tags directly instead of
+        # asking the model for the tool call first
+        self._single_call = single_call
+        # answers the requests of all sessions together when given
+        self._research_service = research_service
 
-    @message_handler
-    async def handle_request_to_speak(self, message: RequestToSpeak, ctx: MessageContext) -> None:  # type: ignore
+    async def speak(self, cancellation_token: CancellationToken | None = None) -> str:
         Console().print(Markdown(f"### {self.id.type}: "))
 
         if not self._enabled:
             print(f"The researcher is not available")
-            await self.publish_message(
-                GroupChatMessage(
-                    body=UserMessage(content="Sorry. The researcher is not available. Complete the task using your own internal knowledge.", source=self.id.type)  # type: ignore
-                ),
-                DefaultTopicId(self._group_chat_topic_type),
-            )
-            return
-        elif self._internet_access:
+            return "Sorry. The researcher is not available. Complete the task using your own internal knowledge."
+
+        if self._research_service is not None:
+            queries = parse_search_queries(self.get_search_request())
+            answer = await self._research_service.ask(queries, self.get_text_to_tag()) if queries else None
+            if answer is not None:
+                print(f"Researcher response: {answer}")
+                return f"<answer>{answer}</answer>"
+
+        if self._can_search:
             self._chat_history.append(
                 UserMessage(
                     content=f"You are requested to answer the questions inside <search> tags in previous message. If you have received a response from 'search' tool already answer the questions using the response from 'search' tool. Don't respond to anything outside <search> tags, it is not your job.",
                     source="system",
                 )
             )
-            completion = await self._model_client.create(
-                [self._system_message] + self._chat_history,
-                tools=[self._search_tool],
-                extra_create_args={"tool_choice": "required", "temperature": 0},
-                cancellation_token=ctx.cancellation_token,
-            )
-
             search_tool_response = ""
-            for item in completion.content:
-                if isinstance(item, FunctionCall):
-                    arguments = json.loads(item.arguments)
-                    Console().print(arguments)
-                    result = await self._search_tool.run_json(
-                        arguments, ctx.cancellation_token
-                    )
-                    search_tool_response += result + "\n"
+            for arguments in await self.get_search_arguments(cancellation_token):
+                Console().print(arguments)
+                result = await self._search_tool.run_json(
+                    arguments, cancellation_token or CancellationToken()
+                )
+                search_tool_response += result + "\n"
 
             search_tool_response = "SEARCH_TOOL_RESPONSE: \n" + search_tool_response
 
@@ -103,10 +134,42 @@ class ResearchAgent(BaseGroupChatAgent):
                 [self._system_message] + chat_history_copy,
                 extra_create_args={"temperature": 0},
             )
-        await self.publish_message(
-            GroupChatMessage(
-                body=UserMessage(content=f"<answer>{completion.content}</answer>", source=self.id.type)  # type: ignore
-            ),
-            DefaultTopicId(self._group_chat_topic_type),
-        )
         print(f"Researcher response: {completion.content}")
+        return f"<answer>{completion.content}</answer>"
+
+    def get_search_request(self) -> str:
+        # the latest message with questions, the instruction mentions <search>
+        # too so only closed tags count
+        return next(
+            (str(message.content) for message in reversed(self._chat_history) if SEARCH_PATTERN.search(str(message.content))),
+            "",
+        )
+
+    def get_text_to_tag(self) -> str:
+        # the text of the session, the questions are about its mentions
+        return next(
+            (extract_tag(str(message.content), "text_to_tag").strip() for message in self._chat_history if "<text_to_tag>" in str(message.content)),
+            "",
+        )
+
+    async def get_search_arguments(
+        self, cancellation_token: CancellationToken | None = None
+    ) -> List[dict]:
+        # arguments of each search tool call for the latest search request
+        if self._single_call:
+            queries = parse_search_queries(self.get_search_request())
+            if queries:
+                return [{"queries": queries}]
+            print(f"No questions found inside <search> tags, asking the model for the search")
+
+        completion = await self._model_client.create(
+            [self._system_message] + self.get_history(),
+            tools=[self._search_tool],
+            extra_create_args={"tool_choice": "required", "temperature": 0},
+            cancellation_token=cancellation_token,
+        )
+        return [
+            json.loads(item.arguments)
+            for item in completion.content
+            if isinstance(item, FunctionCall)
+        ]
@@ -0,0 +1,187 @@
+import asyncio
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from autogen_core.base import CancellationToken
+from autogen_core.components.models import ChatCompletionClient, SystemMessage, UserMessage
+from autogen_core.components.tools import FunctionTool
+
+from ner.agents.tools.search import search_with_tavily
+from ner.agents.tools.search_cache import normalize_query
+
+
+ANSWER_PATTERN = re.compile(r"<answer_(\d+)>(.*?)</answer_\1>", re.DOTALL)
+
+BATCH_PROMPT = """You are requested to answer the numbered questions below. They were asked while tagging different texts, the text each question came from is given below it, so answer each question on its own. Write the answer to question N inside <answer_N> tags, e.g. <answer_1>...</answer_1>, and don't respond to anything else.
+
+{questions}"""
+
+# characters of the text a question came from kept in the batch prompt
+MAX_CONTEXT_CHARACTERS = 200
+
+SEARCH_PROMPT = """
+
+Answer the questions using the response from 'search' tool:
+SEARCH_TOOL_RESPONSE:
+{search_tool_response}"""
+
+
+def format_question(number: int, question: str, context: str) -> str:
+    if len(context) > MAX_CONTEXT_CHARACTERS:
+        context = context[:MAX_CONTEXT_CHARACTERS].rsplit(" ", 1)[0] + " ..."
+    return f"{number}. {question}\n   Text: {context}" if context else f"{number}. {question}"
+
+
+def parse_batch_answers(content: str, questions: int) -> List[Optional[str]]:
+    # the answer to each question, None where the model skipped one
+    answers: List[Optional[str]] = [None] * questions
+    for number, answer in ANSWER_PATTERN.findall(content):
+        if 1 <= int(number) <= questions and answer.strip():
+            answers[int(number) - 1] = answer.strip()
+    return answers
+
+
+@dataclass
+class ResearchService:
+    # one researcher for all sessions of a tagger. The questions of the
+    # research requests arriving within window_seconds are deduplicated and
+    # answered together with one search and one model call, each request
+    # gets the answers to its own questions back. Questions already in a
+    # running batch wait for it instead of being asked again. The window
+    # closes at once when every open session of the tagger already waits
+    # for answers, since no other request can join the batch then
+    model_client: ChatCompletionClient
+    system_prompt: str
+    search_tool: Optional[FunctionTool] = None
+    internet_access: bool = True
+    window_seconds: float = 0.2
+    # a full batch starts without waiting for the window to end
+    max_batch_questions: int = 20
+    # sessions of the tagger that can ask, 0 when they are not counted
+    sessions: int = 0
+    requests: int = 0
+    questions: int = 0
+    batches: int = 0
+    batched_questions: int = 0
+
+    # normalized question -> (question, context, answer) of the collecting batch
+    _pending: Dict[str, Tuple[str, str, asyncio.Future]] = field(default_factory=dict, init=False, repr=False)
+    # the same for the batches being answered
+    _in_flight: Dict[str, asyncio.Future] = field(default_factory=dict, init=False, repr=False)
+    _window: Optional[asyncio.TimerHandle] = field(default=None, init=False, repr=False)
+    _tasks: set = field(default_factory=set, init=False, repr=False)
+    # requests waiting for their answers
+    _waiting: int = field(default=0, init=False, repr=False)
+    _can_search: bool = field(default=False, init=False, repr=False)
+
+    def __post_init__(self):
+        # a given tool, e.g. a local index, needs no internet access
+        self._can_search = self.internet_access or self.search_tool is not None
+        if self.search_tool is None:
+            self.search_tool = FunctionTool(
+                search_with_tavily,
+                name="search",
+                description="Use this tool to search anything",
+            )
+
+    def open_session(self) -> None:
+        self.sessions += 1
+
+    def close_session(self) -> None:
+        self.sessions -= 1
+        if self._pending and self._is_batch_complete():
+            self._start_batch()
+
+    def _is_batch_complete(self) -> bool:
+        # no open session is left that could still ask
+        return 0 < self.sessions <= self._waiting
+
+    async def ask(self, queries: List[str], context: str = "") -> Optional[str]:
+        # the answers to the questions of one research request, None when
+        # the batch failed so the researcher can answer the request itself.
+        # context is the text the questions came from
+        self.requests += 1
+        self.questions += len(queries)
+        loop = asyncio.get_running_loop()
+        answers: List[asyncio.Future] = list()
+        for query in queries:
+            key = normalize_query(query)
+            answer = self._in_flight.get(key)
+            if answer is None and key in self._pending:
+                answer = self._pending[key][2]
+            if answer is None:
+                answer = loop.create_future()
+                # failures nobody waits for anymore are not reported as unhandled
+                answer.add_done_callback(lambda answer: answer.cancelled() or answer.exception())
+                self._pending[key] = (query, context, answer)
+            answers.append(answer)
+
+        self._waiting += 1
+        if len(self._pending) >= self.max_batch_questions or self._is_batch_complete():
+            self._start_batch()
+        elif self._pending and self._window is None:
+            self._window = loop.call_later(self.window_seconds, self._start_batch)
+
+        try:
+            # a cancelled session leaves the batch answering the others
+            results = await asyncio.gather(*(asyncio.shield(answer) for answer in answers))
+        except Exception as err:
+            print(f"Error while answering the research batch: {str(err)}")
+            return None
+        finally:
+            self._waiting -= 1
+
+        if any(result is None for result in results):
+            return None
+        return "\n".join(f"{query}\n{result}" for query, result in zip(queries, results))
+
+    def _start_batch(self) -> None:
+        if self._window is not None:
+            self._window.cancel()
+            self._window = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, dict()
+        for key, (_, _, answer) in batch.items():
+            self._in_flight[key] = answer
+        task = asyncio.ensure_future(self._answer_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _answer_batch(self, batch: Dict[str, Tuple[str, str, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.batched_questions += len(batch)
+        questions = [question for question, _, _ in batch.values()]
+        try:
+            prompt = BATCH_PROMPT.format(
+                questions="\n".join(
+                    format_question(number, question, context)
+                    for number, (question, context, _) in enumerate(batch.values(), 1)
+                )
+            )
+            if self._can_search:
+                assert self.search_tool is not None
+                search_tool_response = await self.search_tool.run_json(
+                    {"queries": questions}, CancellationToken()
+                )
+                prompt += SEARCH_PROMPT.format(search_tool_response=search_tool_response)
+
+            print(f"Answering {len(questions)} research questions of {self.requests} requests together")
+            completion = await self.model_client.create(
+                [SystemMessage(self.system_prompt), UserMessage(content=prompt, source="system")],
+                extra_create_args={"temperature": 0},
+            )
+            for (_, _, answer), result in zip(batch.values(), parse_batch_answers(str(completion.content), len(questions))):
+                answer.set_result(result)
+        except Exception as err:
+            for _, _, answer in batch.values():
+                if not answer.done():
+                    answer.set_exception(err)
+        finally:
+            for key in batch:
+                self._in_flight.pop(key, None)
+
+    def report(self) -> str:
+        return f"Research service: {self.requests} requests with {self.questions} questions answered in {self.batches} batches of {self.batched_questions} unique questions"
@@ -0,0 +1,100 @@
+import re
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ner.grounding import GroundingEngine
+from ner.helper import extract_tag
+from ner.spans import extract_spans
+from ner.tagger import Tagger
+
+
+TAG_PATTERN = re.compile(r"</?([^<>/\s]+)>")
+
+OutputChecks = namedtuple(
+    "OutputChecks", ["fidelity", "ontology", "grounded", "grounding_feedback"]
+)
+
+
+@dataclass
+class PolicyStats:
+    applied: int = 0
+    turns_saved: int = 0
+    # estimated from the observed duration of the skipped turns
+    seconds_saved: float = 0
+
+
+@dataclass
+class ReviewPolicy:
+    # deterministic checks of a tagger output that run before the reviewer,
+    # so outputs the reviewer and grounding would pass anyway skip them
+    # end the chat when the text, the tags and the grounding all check out
+    skip_grounded: bool = True
+    # send grounding feedback to the tagger at once instead of after the
+    # reviewer approved, the revised output then ends the chat as before
+    ground_first: bool = True
+    checked: int = 0
+    stats: Dict[str, PolicyStats] = field(default_factory=dict)
+    # observed turn durations by role
+    turn_seconds: Dict[str, float] = field(default_factory=dict)
+    turns: Dict[str, int] = field(default_factory=dict)
+
+    def check(
+        self,
+        llm_output: str,
+        tokens: List[str],
+        iob2_labels: List[str],
+        entity_types: List[str],
+        grounding_engine: Optional[GroundingEngine],
+    ) -> OutputChecks:
+        self.checked += 1
+        tagged_string = extract_tag(llm_output, "output").replace("\\n", "").strip()
+
+        # the output is the input text with tags added and nothing else changed
+        tagless = Tagger._remove_all_tags(tagged_string, entity_types)
+        fidelity = tagless.split() == tokens
+        ontology = all(tag in entity_types for tag in TAG_PATTERN.findall(tagged_string))
+
+        if grounding_engine is None or not (fidelity and ontology):
+            return OutputChecks(fidelity, ontology, False, "")
+
+        grounding_feedback = grounding_engine.verify(tokens, iob2_labels)
+        text_feedback = grounding_feedback.get_text_feedback()
+        # there are tagged entities, each is known with its tag, and every
+        # mention the knowledge base is sure about is tagged. Outputs without
+        # entities have nothing grounding could vouch for
+        predicted = set(extract_spans(iob2_labels))
+        to_knowledge_key = grounding_engine.knowledge_base.to_knowledge_key
+        grounded = (
+            bool(predicted)
+            and not text_feedback.strip()
+            and all(
+                tag in grounding_feedback.correct.get(to_knowledge_key(tokens[start:end]), [])
+                for start, end, tag in predicted
+            )
+            and set(extract_spans(grounding_engine.pre_annotate(tokens))) <= predicted
+        )
+        return OutputChecks(fidelity, ontology, grounded, text_feedback)
+
+    def record_turn(self, role: str, seconds: float) -> None:
+        self.turn_seconds[role] = self.turn_seconds.get(role, 0) + seconds
+        self.turns[role] = self.turns.get(role, 0) + 1
+
+    def record_skip(self, policy: str, roles: List[str]) -> None:
+        stats = self.stats.setdefault(policy, PolicyStats())
+        stats.applied += 1
+        stats.turns_saved += len(roles)
+        stats.seconds_saved += sum(self.get_turn_seconds(role) for role in roles)
+
+    def get_turn_seconds(self, role: str) -> float:
+        # average turn of the role, or of any role while it was never observed
+        if self.turns.get(role):
+            return self.turn_seconds[role] / self.turns[role]
+        turns = sum(self.turns.values())
+        return sum(self.turn_seconds.values()) / turns if turns else 0
+
+    def report(self) -> str:
+        report = f"Review policy: checked {self.checked} tagger outputs"
+        for policy, stats in self.stats.items():
+            report += f", {policy} applied {stats.applied} times saving {stats.turns_saved} turns and {stats.seconds_saved:.1f}s"
+        return report
@@ -0,0 +1,95 @@
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict
+
+from autogen_core.application import SingleThreadedAgentRuntime
+from autogen_core.base import Agent, AgentId, AgentType, CancellationToken, MessageContext, TopicId
+
+
+class SessionRuntime(SingleThreadedAgentRuntime):
+    # counts the published messages in flight per topic source, so one
+    # conversation can wait until it settles while others keep running in
+    # the same runtime. Agents publish with DefaultTopicId, which reuses the
+    # source of the message they are handling, so a session never leaks into
+    # another one. Relies on runtime internals of the pinned autogen-core
+    # version (_process_publish, _instantiated_agents).
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._pending_by_session: Dict[str, int] = dict()
+        self._idle_by_session: Dict[str, asyncio.Event] = dict()
+        # the first handler error of each session, the runtime only logs them
+        self._error_by_session: Dict[str, Exception] = dict()
+
+    async def register_factory(
+        self,
+        *,
+        type: AgentType,
+        agent_factory: Callable[[], Agent | Awaitable[Agent]],
+        expected_class: type,
+    ) -> AgentType:
+        async def factory() -> Agent:
+            agent = agent_factory()
+            if inspect.isawaitable(agent):
+                agent = await agent
+            self._record_errors(agent)
+            return agent
+
+        return await super().register_factory(
+            type=type, agent_factory=factory, expected_class=expected_class
+        )
+
+    def _record_errors(self, agent: Agent) -> None:
+        on_message = agent.on_message
+
+        async def on_message_recording_errors(message: Any, ctx: MessageContext) -> Any:
+            try:
+                return await on_message(message, ctx)
+            except Exception as err:
+                if ctx.topic_id is not None:
+                    self._error_by_session.setdefault(ctx.topic_id.source, err)
+                raise
+
+        agent.on_message = on_message_recording_errors  # type: ignore
+
+    async def publish_message(
+        self,
+        message: Any,
+        topic_id: TopicId,
+        *,
+        sender: AgentId | None = None,
+        cancellation_token: CancellationToken | None = None,
+    ) -> None:
+        # counted before the handler that publishes returns, so the count
+        # can only reach zero once nothing in the session is left to do
+        self._pending_by_session[topic_id.source] = (
+            self._pending_by_session.get(topic_id.source, 0) + 1
+        )
+        await super().publish_message(
+            message, topic_id, sender=sender, cancellation_token=cancellation_token
+        )
+
+    async def _process_publish(self, message_envelope: Any) -> None:
+        try:
+            await super()._process_publish(message_envelope)
+        finally:
+            session_id = message_envelope.topic_id.source
+            self._pending_by_session[session_id] -= 1
+            if not self._pending_by_session[session_id]:
+                del self._pending_by_session[session_id]
+                if session_id in self._idle_by_session:
+                    self._idle_by_session.pop(session_id).set()
+
+    async def wait_for_session(self, session_id: str) -> None:
+        # raises the first error a handler of the session failed with
+        if session_id in self._pending_by_session:
+            await self._idle_by_session.setdefault(session_id, asyncio.Event()).wait()
+        error = self._error_by_session.pop(session_id, None)
+        if error is not None:
+            raise error
+
+    def close_session(self, session_id: str) -> None:
+        # drops the agent instances of the session with their chat histories,
+        # agents are keyed by the topic source they were created for
+        self._error_by_session.pop(session_id, None)
+        for agent_id in [agent_id for agent_id in self._instantiated_agents if agent_id.key == session_id]:
+            del self._instantiated_agents[agent_id]
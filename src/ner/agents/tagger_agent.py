@@ -1,22 +1,30 @@
+from typing import Optional
+
 from autogen_core.components.models import ChatCompletionClient
 
 from ner.agents.base_agent import BaseGroupChatAgent
+from ner.agents.history_budget import HistoryBudget, HistoryPolicy
 
 
 TAGGER_TOPIC_TYPE = "Tagger"
 
 
 class TaggerAgent(BaseGroupChatAgent):
+    # works from its latest output and the feedback or answers that followed
+    history_policy = HistoryPolicy("<output>", TAGGER_TOPIC_TYPE, keep_tags=("<answer>",))
+
     def __init__(
         self,
         description: str,
         group_chat_topic_type: str,
         model_client: ChatCompletionClient,
         system_prompt: str,
+        history_budget: Optional[HistoryBudget] = None,
     ) -> None:
         super().__init__(
             description=description,
             group_chat_topic_type=group_chat_topic_type,
             model_client=model_client,
             system_message=system_prompt,
+            history_budget=history_budget,
         )
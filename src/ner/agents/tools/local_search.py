@@ -0,0 +1,379 @@
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+import numpy as np
+from autogen_core.components.tools import FunctionTool
+
+from ner.eval.dataset import NERDataset
+from ner.grounding_lexicon import LEXICON_FORMATS, LexiconSource
+from ner.spans import extract_spans
+
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+# question words and function words have huge postings and say nothing
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it of on or that the this to was what when where which who why with".split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+MANIFEST_FILE = "index.json"
+# example sentences kept per entity of a training split
+MAX_EXAMPLES = 3
+
+# (title, text) of a searchable document
+Document = Tuple[str, str]
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class Segment:
+    # the index of one source, written once and memory-mapped. A term maps
+    # to a slice of the postings (document ids, ascending) and frequencies,
+    # documents are read from a JSON lines file by byte offset
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "terms.json"), "r", encoding="utf-8") as file:
+            self.terms: Dict[str, Tuple[int, int]] = json.load(file)
+        self.postings = np.load(os.path.join(directory, "postings.npy"), mmap_mode="r")
+        self.frequencies = np.load(os.path.join(directory, "frequencies.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(directory, "lengths.npy"))
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"))
+        self._documents = open(os.path.join(directory, "documents.jsonl"), "rb")
+
+    @staticmethod
+    def write(directory: str, documents: Iterable[Document]) -> Tuple[int, int]:
+        # returns the number of documents and their total length in terms
+        os.makedirs(directory)
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths: List[int] = list()
+        offsets: List[int] = list()
+        with open(os.path.join(directory, "documents.jsonl"), "wb") as file:
+            for document_id, (title, text) in enumerate(documents):
+                offsets.append(file.tell())
+                file.write(json.dumps([title, text]).encode("utf-8") + b"\n")
+                terms = Counter(tokenize(f"{title} {text}"))
+                for term, frequency in terms.items():
+                    postings[term].append((document_id, frequency))
+                lengths.append(sum(terms.values()))
+
+        terms: Dict[str, Tuple[int, int]] = dict()
+        document_ids = np.empty(sum(len(entries) for entries in postings.values()), dtype=np.int32)
+        frequencies = np.empty(len(document_ids), dtype=np.int32)
+        position = 0
+        for term, entries in postings.items():
+            terms[term] = (position, len(entries))
+            document_ids[position : position + len(entries)] = [entry[0] for entry in entries]
+            frequencies[position : position + len(entries)] = [entry[1] for entry in entries]
+            position += len(entries)
+
+        with open(os.path.join(directory, "terms.json"), "w", encoding="utf-8") as file:
+            json.dump(terms, file)
+        np.save(os.path.join(directory, "postings.npy"), document_ids)
+        np.save(os.path.join(directory, "frequencies.npy"), frequencies)
+        np.save(os.path.join(directory, "lengths.npy"), np.array(lengths, dtype=np.int32))
+        np.save(os.path.join(directory, "offsets.npy"), np.array(offsets, dtype=np.int64))
+
+        return len(lengths), sum(lengths)
+
+    def get_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        start, count = self.terms.get(term, (0, 0))
+        return self.postings[start : start + count], self.frequencies[start : start + count]
+
+    def get_document(self, document_id: int) -> Document:
+        self._documents.seek(int(self.offsets[document_id]))
+        title, text = json.loads(self._documents.readline())
+        return title, text
+
+    def close(self) -> None:
+        self._documents.close()
+
+
+@dataclass
+class LocalSearchIndex:
+    # BM25 search over local corpora for machines without internet access.
+    # Every source (a training split, an ontology, a glossary) is indexed
+    # into its own segment, so adding or changing one source only rebuilds
+    # that segment; scores use the statistics of all segments together.
+    directory: str
+    top_k: int = 5
+    # source name -> fingerprint, segment directory, documents and total length
+    manifest: Dict[str, Dict[str, Any]] = field(default_factory=dict, init=False)
+    _segments: Dict[str, Segment] = field(default_factory=dict, init=False, repr=False)
+    _tool: Optional[FunctionTool] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        for name, entry in self.manifest.items():
+            self._segments[name] = Segment(os.path.join(self.directory, entry["segment"]))
+
+    def add_source(
+        self, name: str, fingerprint: str, documents: Callable[[], Iterable[Document]]
+    ) -> bool:
+        # indexes the source unless it was indexed with the same fingerprint,
+        # returns whether it was (re)indexed
+        if self.manifest.get(name, {}).get("fingerprint") == fingerprint:
+            return False
+
+        segment = f"segment-{uuid.uuid4().hex}"
+        count, length = Segment.write(os.path.join(self.directory, segment), documents())
+        previous = self.manifest.get(name)
+        self.manifest[name] = {
+            "fingerprint": fingerprint,
+            "segment": segment,
+            "documents": count,
+            "length": length,
+        }
+        self._write_manifest()
+
+        if previous is not None:
+            self._segments.pop(name).close()
+            shutil.rmtree(os.path.join(self.directory, previous["segment"]), ignore_errors=True)
+        self._segments[name] = Segment(os.path.join(self.directory, segment))
+        return True
+
+    def remove_source(self, name: str) -> None:
+        previous = self.manifest.pop(name, None)
+        if previous is None:
+            return
+        self._write_manifest()
+        self._segments.pop(name).close()
+        shutil.rmtree(os.path.join(self.directory, previous["segment"]), ignore_errors=True)
+
+    def _write_manifest(self) -> None:
+        # the manifest is replaced in one step, a crash leaves the previous
+        # segments in use and at worst an unreferenced segment directory
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[Tuple[float, Document]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        documents = sum(entry["documents"] for entry in self.manifest.values())
+        if not terms or not documents:
+            return []
+        average_length = sum(entry["length"] for entry in self.manifest.values()) / documents
+
+        postings = {
+            name: [segment.get_postings(term) for term in terms]
+            for name, segment in self._segments.items()
+        }
+        document_frequencies = [
+            sum(len(postings[name][i][0]) for name in postings) for i in range(len(terms))
+        ]
+        idfs = [
+            math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            for frequency in document_frequencies
+        ]
+
+        candidates: List[Tuple[float, str, int]] = list()
+        for name, segment in self._segments.items():
+            document_ids = np.concatenate([ids for ids, _ in postings[name]])
+            if not len(document_ids):
+                continue
+            frequencies = np.concatenate([frequencies for _, frequencies in postings[name]]).astype(np.float64)
+            weights = np.concatenate(
+                [np.full(len(ids), idf) for (ids, _), idf in zip(postings[name], idfs)]
+            )
+            normalized_lengths = segment.lengths[document_ids] / average_length
+            scores = weights * frequencies * (BM25_K1 + 1) / (
+                frequencies + BM25_K1 * (1 - BM25_B + BM25_B * normalized_lengths)
+            )
+
+            unique_ids, inverse = np.unique(document_ids, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+            best = np.argsort(-totals)[: top_k or self.top_k]
+            candidates.extend((float(totals[i]), name, int(unique_ids[i])) for i in best)
+
+        return [
+            (score, self._segments[name].get_document(document_id))
+            for score, name, document_id in heapq.nlargest(top_k or self.top_k, candidates)
+        ]
+
+    async def search_queries(self, queries: List[str]) -> str:
+        answer = ""
+        for query in queries:
+            context = ""
+            for _, (title, text) in self.search(query):
+                context += f"--\n{title}: {text}\n"
+            answer += f"Search results for '{query}':\n{context or 'No results'}\n-----\n"
+
+        return answer
+
+    def as_tool(self) -> FunctionTool:
+        # the same interface as the web search tools
+        if self._tool is None:
+            self._tool = FunctionTool(
+                self.search_queries,
+                name="search",
+                description="Use this tool to search anything",
+            )
+        return self._tool
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+
+
+def dataset_documents(dataset: NERDataset) -> Iterator[Document]:
+    # one document per annotated entity with how it was tagged and where
+    mentions: Dict[str, Tuple[str, Counter, List[str]]] = dict()
+    for entry in dataset.entries:
+        for start, end, entity_type in extract_spans(entry.labels):
+            mention = " ".join(entry.tokens[start:end])
+            _, counts, examples = mentions.setdefault(mention.lower(), (mention, Counter(), list()))
+            counts[entity_type] += 1
+            if len(examples) < MAX_EXAMPLES and entry.text not in examples:
+                examples.append(entry.text)
+
+    for mention, counts, examples in mentions.values():
+        tags = ", ".join(
+            f"{entity_type} {count} time{'s' if count > 1 else ''}" for entity_type, count in counts.most_common()
+        )
+        yield mention, f"Annotated as {tags}. Examples: {' | '.join(examples)}"
+
+
+def ontology_documents(ontology: Dict[str, Any]) -> Iterator[Document]:
+    for entity_type, description in ontology.items():
+        yield entity_type, str(description)
+
+
+def glossary_documents(source: LexiconSource) -> Iterator[Document]:
+    # the type field of the source holds the definition of each term
+    for term, definition in source.records():
+        if term and definition:
+            yield term, definition
+
+
+def get_file_fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@click.command()
+@click.option("--index", "index_directory", required=True, help="Directory of the index, created if missing")
+@click.option("--genia-split", multiple=True, help="Genia split to index, can be repeated")
+@click.option("--astroner", multiple=True, help="Path of an AstroNER split to index, can be repeated")
+@click.option("--ontology", multiple=True, type=click.Choice(["genia", "buster", "music", "astro"]), help="Ontology whose descriptions are indexed")
+@click.option("--glossary", multiple=True, help="TSV, JSON or JSON lines glossary to index, can be repeated")
+@click.option("--glossary-format", type=click.Choice(LEXICON_FORMATS), default="tsv")
+@click.option("--term-field", default="0", help="Glossary term column name, or index for TSV files without a header")
+@click.option("--text-field", default="1", help="Glossary definition column name or index")
+def main(
+    index_directory: str,
+    genia_split: Tuple[str, ...],
+    astroner: Tuple[str, ...],
+    ontology: Tuple[str, ...],
+    glossary: Tuple[str, ...],
+    glossary_format: str,
+    term_field: str,
+    text_field: str,
+):
+    """Build or update the local search index of the researcher.
+
+    Sources already indexed are skipped unless their file changed.
+
+    Example:
+        python local_search.py --index index/genia --genia-split train --ontology genia --glossary glossary.tsv
+    """
+    from ner.ontology import (
+        get_astroner_ontology,
+        get_buster_ontology,
+        get_genia_ontology,
+        get_musicner_ontology,
+    )
+
+    ontologies = {
+        "genia": get_genia_ontology,
+        "buster": get_buster_ontology,
+        "music": get_musicner_ontology,
+        "astro": get_astroner_ontology,
+    }
+
+    def to_field(value: str) -> Any:
+        return int(value) if value.isdigit() else value
+
+    index = LocalSearchIndex(index_directory)
+    start = time.perf_counter()
+    for split in genia_split:
+        added = index.add_source(
+            f"genia:{split}", split, lambda: dataset_documents(NERDataset.from_genia(split))
+        )
+        click.echo(f"{'Indexed' if added else 'Kept'} Genia {split} split")
+    for path in astroner:
+        added = index.add_source(
+            f"astroner:{path}", get_file_fingerprint(path), lambda: dataset_documents(NERDataset.from_astroner(path))
+        )
+        click.echo(f"{'Indexed' if added else 'Kept'} {path}")
+    for name in ontology:
+        descriptions = ontologies[name]()
+        added = index.add_source(
+            f"ontology:{name}", json.dumps(descriptions, sort_keys=True), lambda: ontology_documents(descriptions)
+        )
+        click.echo(f"{'Indexed' if added else 'Kept'} {name} ontology")
+    for path in glossary:
+        source = LexiconSource(
+            path=path, format=glossary_format, term_field=to_field(term_field), type_field=to_field(text_field)
+        )
+        added = index.add_source(
+            f"glossary:{path}", get_file_fingerprint(path), lambda: glossary_documents(source)
+        )
+        click.echo(f"{'Indexed' if added else 'Kept'} {path}")
+
+    documents = sum(entry["documents"] for entry in index.manifest.values())
+    click.echo(f"Index of {documents} documents from {len(index.manifest)} sources, updated in {time.perf_counter() - start:.2f}s")
+    index.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main()
+        sys.exit()
+
+    import asyncio
+    import tempfile
+
+    from ner.ontology import get_astroner_ontology
+
+    print("Benchmarking the local search index on AstroNER")
+    with tempfile.TemporaryDirectory() as directory:
+        index = LocalSearchIndex(directory)
+        # only the training split, the test mentions are what is searched for
+        path = "data/astro_ner/train.json"
+        start = time.perf_counter()
+        index.add_source(path, get_file_fingerprint(path), lambda: dataset_documents(NERDataset.from_astroner(path, max_workers=1)))
+        print(f"Indexed {path} in {time.perf_counter() - start:.2f}s")
+        index.add_source("ontology:astro", "v1", lambda: ontology_documents(get_astroner_ontology()))
+
+        # an unchanged source is not indexed again
+        start = time.perf_counter()
+        reopened = LocalSearchIndex(directory)
+        added = reopened.add_source("data/astro_ner/train.json", get_file_fingerprint("data/astro_ner/train.json"), lambda: [])
+        print(f"Reopened the index and checked a source in {(time.perf_counter() - start) * 1000:.1f}ms, reindexed: {added}")
+
+        queries = [f"What is {title}?" for title, _ in dataset_documents(NERDataset.from_astroner("data/astro_ner/test.json", max_workers=1))][:500]
+        start = time.perf_counter()
+        for query in queries:
+            reopened.search(query)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        documents = sum(entry["documents"] for entry in reopened.manifest.values())
+        print(f"{len(queries)} queries over {documents} documents: {elapsed * 1000:.2f}ms per query")
+        print(asyncio.run(reopened.search_queries(["What is a black hole?", "What kind of entity is AstroPortion?"])))
+        index.close()
+        reopened.close()
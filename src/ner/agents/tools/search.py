@@ -1,62 +1,199 @@
+import asyncio
+import logging
 import os
-from typing import List
+import time
+import weakref
+from typing import Awaitable, Callable, List, Optional
 
-from langchain_community.document_loaders import BraveSearchLoader
-from tavily import TavilyClient
+import httpx
 
+from ner.agents.tools.search_cache import SearchCache
+from ner.agents.tools.search_store import QueryResult, SearchResultStore
 
-def search_with_brave(queries: List[str]) -> str:
-    api_key = os.environ.get("BRAVE_API_KEY") or ""
 
-    answer = ""
-    for query in queries:
-        try:
-            loader = BraveSearchLoader(
-                query=query, api_key=api_key, search_kwargs={"count": 5}
-            )
-            docs = loader.load()
-        except Exception as err:
-            print(f"Error while calling search API: {str(err)}")
-            return (
-                "Sorry, there is an issue while using the search tool with given input"
-            )
+BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
 
-        context = ""
-        for doc in docs:
-            context += f"--\n{doc.page_content}\n"
+logger = logging.getLogger(__name__)
 
-        answer += f"Search results for '{query}':\n{context}\n-----\n"
+# all queries of one tool call share this deadline, queries still running
+# then are reported as unanswered and keep warming the cache
+SEARCH_DEADLINE_SECONDS = float(os.environ.get("SEARCH_DEADLINE_SECONDS", 10))
 
-    with open("results.txt", "w") as file:
-        file.write(answer)
+# shared by every researcher of the process and created on the first
+# search, so importing the tools never touches the working directory
+_search_cache: Optional[SearchCache] = None
+_search_store: Optional[SearchResultStore] = None
+
+# one connection pool per event loop, httpx clients can't move between loops
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
 
-    return answer
 
+def get_search_cache() -> SearchCache:
+    # set SEARCH_CACHE_PATH to an empty string to keep it in memory only
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchCache(
+            path=os.environ.get("SEARCH_CACHE_PATH", "cache/search_cache.jsonl") or None
+        )
+    return _search_cache
 
-def search_with_tavily(queries: List[str]) -> str:
-    api_key = os.environ.get("TAVILY_API_KEY") or ""
-    tavily_client = TavilyClient(api_key=api_key)
 
-    answer = ""
-    for query in queries:
-        try:
-            response = tavily_client.search(query=query, include_answer=True)
-        except Exception as err:
-            print(f"Error while calling search API: {str(err)}")
-            return (
-                "Sorry, there is an issue while using the search tool with given input"
-            )
+def get_search_store() -> SearchResultStore:
+    global _search_store
+    if _search_store is None:
+        _search_store = SearchResultStore(
+            path=os.environ.get("SEARCH_RESULTS_PATH", "cache/search_results.jsonl")
+        )
+    return _search_store
+
 
-        answer += (
-            f"Search results for '{query}':\n{response.get('answer', '')}\n-----\n"
+def get_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = _http_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(SEARCH_DEADLINE_SECONDS),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
         )
+    return client
+
+
+async def close_http_client() -> None:
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def search_all(
+    backend: str,
+    queries: List[str],
+    search: Callable[[str], Awaitable[str]],
+    deadline_seconds: Optional[float] = None,
+    search_cache: Optional[SearchCache] = None,
+    search_store: Optional[SearchResultStore] = None,
+) -> List[QueryResult]:
+    # runs the queries at once through the cache, each answered within the
+    # deadline or reported as timed out, a failure only affects its query.
+    # The cache and store shared by the process are used unless given
+    deadline_seconds = deadline_seconds if deadline_seconds is not None else SEARCH_DEADLINE_SECONDS
+    search_cache = search_cache if search_cache is not None else get_search_cache()
+    search_store = search_store if search_store is not None else get_search_store()
+    start = time.perf_counter()
+    tasks = {
+        query: asyncio.ensure_future(search_cache.get_or_search_async(backend, query, search))
+        for query in dict.fromkeys(queries)
+    }
+    _, pending = await asyncio.wait(tasks.values(), timeout=deadline_seconds)
+    for task in pending:
+        task.cancel()
+
+    results = list()
+    for query, task in tasks.items():
+        if task in pending:
+            logger.warning("Search for '%s' did not finish within %ss", query, deadline_seconds)
+            results.append(QueryResult(query, "timeout", ""))
+        elif task.exception() is not None:
+            logger.warning("Error while calling the %s search API for '%s': %s", backend, query, task.exception())
+            results.append(QueryResult(query, "error", ""))
+        else:
+            results.append(QueryResult(query, "ok", task.result()))
+
+    search_store.add(backend, results, time.perf_counter() - start)
+    return results
+
+
+def format_results(results: List[QueryResult]) -> str:
+    if not any(result.status == "ok" for result in results):
+        return "Sorry, there is an issue while using the search tool with given input"
+
+    answer = ""
+    for result in results:
+        if result.status == "ok":
+            answer += f"Search results for '{result.query}':\n{result.result}\n-----\n"
+        elif result.status == "timeout":
+            answer += f"Search results for '{result.query}':\nNo results within the time limit\n-----\n"
+        else:
+            answer += f"Search results for '{result.query}':\nSorry, there is an issue while searching for this query\n-----\n"
 
     return answer
 
 
+async def search_brave(query: str) -> str:
+    response = await get_http_client().get(
+        BRAVE_SEARCH_URL,
+        params={"q": query, "count": 5, "extra_snippets": True},
+        headers={
+            "X-Subscription-Token": os.environ.get("BRAVE_API_KEY") or "",
+            "Accept": "application/json",
+        },
+    )
+    response.raise_for_status()
+
+    context = ""
+    for item in response.json().get("web", {}).get("results", []):
+        snippets = [item.get("description"), *item.get("extra_snippets", [])]
+        context += f"--\n{' '.join(filter(None, snippets))}\n"
+    return context
+
+
+async def search_tavily(query: str) -> str:
+    response = await get_http_client().post(
+        TAVILY_SEARCH_URL,
+        json={"query": query, "include_answer": True},
+        headers={"Authorization": f"Bearer {os.environ.get('TAVILY_API_KEY') or ''}"},
+    )
+    response.raise_for_status()
+    return response.json().get("answer") or ""
+
+
+async def search_with_brave(queries: List[str]) -> str:
+    return format_results(await search_all("brave", queries, search_brave))
+
+
+async def search_with_tavily(queries: List[str]) -> str:
+    return format_results(await search_all("tavily", queries, search_tavily))
+
+
 if __name__ == "__main__":
-    print(
-        search_with_tavily(
-            queries=["What is BRCA1?", "What kind of car is Porsche 911 GT?"]
+    import random
+    import tempfile
+
+    # queries with 100-400ms latency, one failing and one hanging
+    async def simulated_search(query: str) -> str:
+        if "failing" in query:
+            raise httpx.ConnectError("connection refused")
+        await asyncio.sleep(30 if "hanging" in query else random.uniform(0.1, 0.4))
+        return f"{query} is a thing"
+
+    async def run_simulation(search_cache: SearchCache, search_store: SearchResultStore) -> None:
+        queries = [f"What is entity-{i}?" for i in range(8)]
+
+        start = time.perf_counter()
+        for query in queries:
+            await simulated_search(query)
+        print(f"Sequential: {len(queries)} queries in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        results = await search_all(
+            "simulated", queries + ["failing query", "hanging query"], simulated_search,
+            deadline_seconds=1, search_cache=search_cache, search_store=search_store,
+        )
+        statuses = [result.status for result in results]
+        print(f"Fan-out with a 1s deadline: {statuses.count('ok')} answered, {statuses.count('error')} failed, {statuses.count('timeout')} timed out in {time.perf_counter() - start:.2f}s")
+
+    random.seed(47)
+    with tempfile.TemporaryDirectory() as directory:
+        # a cache and store of their own, the ones of the process stay untouched
+        search_store = SearchResultStore(path=os.path.join(directory, "search_results.jsonl"))
+        asyncio.run(run_simulation(SearchCache(), search_store))
+        print(f"Stored {len(list(search_store.records()))} searches")
+
+    if os.environ.get("TAVILY_API_KEY"):
+        print(
+            asyncio.run(
+                search_with_tavily(
+                    queries=["What is BRCA1?", "What kind of car is Porsche 911 GT?"]
+                )
+            )
         )
-    )
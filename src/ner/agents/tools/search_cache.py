@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+# log lines per live entry before the log is rewritten with live entries only
+COMPACTION_RATIO = 2
+
+
+def normalize_query(query: str) -> str:
+    # "What is NF-kappa B?" and "what is  NF-kappa B" are the same question
+    return " ".join(query.lower().split()).rstrip("?.! ")
+
+
+@dataclass
+class SearchCache:
+    # search results by backend and normalized query, shared by all sessions
+    # of the process. Entries expire after ttl_seconds, the least recently
+    # used ones are evicted beyond max_entries and new entries are appended
+    # to a JSON lines log at path, so a restarted process starts warm.
+    path: Optional[str] = None
+    ttl_seconds: float = 7 * 24 * 3600
+    max_entries: int = 10_000
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+
+    # (backend, normalized query) -> (timestamp, result), least recent first
+    _entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    # lookups in progress, later callers wait for the first one
+    _in_flight_tasks: Dict[Tuple[str, str], asyncio.Task] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _log_lines: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.path and os.path.exists(self.path):
+            self._load()
+
+    async def get_or_search_async(
+        self, backend: str, query: str, search: Callable[[str], Awaitable[str]]
+    ) -> str:
+        # search(query) runs at most once per key at a time, its errors are
+        # raised to every waiting caller and never cached. A caller that is
+        # cancelled, e.g. by a deadline, leaves the search running so its
+        # result still reaches the other callers and the cache
+        key = (backend, normalize_query(query))
+        with self._lock:
+            result = self._get(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            task = self._in_flight_tasks.get(key)
+            if task is None:
+                self.misses += 1
+                task = self._in_flight_tasks[key] = asyncio.ensure_future(
+                    self._search_async(key, query, search)
+                )
+                # errors nobody waits for anymore are not reported as unhandled
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            else:
+                self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    async def _search_async(
+        self, key: Tuple[str, str], query: str, search: Callable[[str], Awaitable[str]]
+    ) -> str:
+        try:
+            result = await search(query)
+        finally:
+            with self._lock:
+                del self._in_flight_tasks[key]
+
+        with self._lock:
+            self._put(key, time.time(), result)
+        return result
+
+    def _get(self, key: Tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key: Tuple[str, str], timestamp: float, result: str) -> None:
+        self._entries[key] = (timestamp, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        if not self.path:
+            return
+        if self._log_lines >= COMPACTION_RATIO * max(len(self._entries), self.max_entries // 10):
+            self._compact()
+        else:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps([key[0], key[1], timestamp, result]) + "\n")
+            self._log_lines += 1
+
+    def _load(self) -> None:
+        # later lines win, expired entries are skipped
+        assert self.path is not None
+        now = time.time()
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    backend, query, timestamp, result = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                self._log_lines += 1
+                if now - timestamp <= self.ttl_seconds:
+                    self._entries[(backend, query)] = (timestamp, result)
+                    self._entries.move_to_end((backend, query))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _compact(self) -> None:
+        # written next to the log and renamed, a crash keeps the old log
+        assert self.path is not None
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            for (backend, query), (timestamp, result) in self._entries.items():
+                file.write(json.dumps([backend, query, timestamp, result]) + "\n")
+        os.replace(temporary_path, self.path)
+        self._log_lines = len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+            self._log_lines = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses + self.coalesced
+        hit_rate = (self.hits + self.coalesced) / lookups if lookups else 0
+        return f"Search cache: {self.hits} hits, {self.coalesced} coalesced, {self.misses} searches ({hit_rate:.1%} saved), {len(self._entries)} entries"
+
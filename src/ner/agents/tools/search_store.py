@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+
+# status of one query of a search: "ok", "timeout" or "error"
+QueryResult = namedtuple("QueryResult", ["query", "status", "result"])
+
+
+@dataclass
+class SearchResultStore:
+    # every search the researcher ran, one JSON object per line at path,
+    # appended so concurrent sessions never overwrite each other
+    path: str
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def add(self, backend: str, results: List[QueryResult], seconds: float, session_id: Optional[str] = None) -> None:
+        record = {
+            "timestamp": time.time(),
+            "backend": backend,
+            "session_id": session_id,
+            "seconds": round(seconds, 3),
+            "results": [result._asdict() for result in results],
+        }
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+
+    def records(self, backend: Optional[str] = None) -> Iterator[dict]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if backend is None or record["backend"] == backend:
+                    yield record
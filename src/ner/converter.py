@@ -3,6 +3,8 @@ import copy
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
+from ner.spans import extract_spans
+
 
 @dataclass
 class Converter:
@@ -41,30 +43,9 @@ class Converter:
     @staticmethod
     def convert_iob2_to_example(labels: List[str], tokens: List[str]) -> str:
         tokens_ = copy.deepcopy(tokens)
-        entity_stack = []
-
-        for i in range(len(tokens)):
-            label = labels[i]
-
-            # Close entities that are no longer active
-            while (
-                entity_stack
-                and not label.startswith(f"I-{entity_stack[-1]}")
-                and not label.startswith(f"B-{entity_stack[-1]}")
-            ):
-                tokens_[i - 1] += f"</{entity_stack.pop()}>"
-
-            # Start a new entity
-            if label.startswith("B-"):
-                current_entity = label[2:]
-                tokens_[i] = (
-                    f"{''.join(f'<{e}>' for e in entity_stack)}<{current_entity}>{tokens[i]}"
-                )
-                entity_stack.append(current_entity)
-
-        # Close remaining entities at the end
-        while entity_stack:
-            tokens_[-1] += f"</{entity_stack.pop()}>"
+        for start, end, entity_type in extract_spans(labels):
+            tokens_[start] = f"<{entity_type}>{tokens_[start]}"
+            tokens_[end - 1] = f"{tokens_[end - 1]}</{entity_type}>"
 
         return " ".join(tokens_)
 
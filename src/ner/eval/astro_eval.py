@@ -1,5 +1,7 @@
 # https://arxiv.org/abs/2405.02602 - dataset source
 
+from typing import Any
+
 from ner.ablation.prompts import (
     get_agent_config_no_internet,
     get_agent_config_no_researcher,
@@ -7,22 +9,26 @@ from ner.ablation.prompts import (
 from ner.agents.multi_agent_tagger import MultiAgentTagger
 from ner.clients.claude_client import AnthropicClient, ClaudeFamily
 from ner.clients.claude_oai_compatible_client import create_chat_completions_client
-from ner.grounding import GroundingEngine
 from ner.eval.dataset import NERDataset
-from ner.eval.eval import run_eval
+from ner.eval.eval import (
+    configure_few_shot_tagger,
+    configure_multi_agent_tagger,
+    get_grounding_engine,
+    run_eval,
+)
 from ner.ontology import get_astroner_ontology
 from ner.prompts import get_agent_config, get_ner_prompt
 from ner.tagger_few_shot import FewShotTagger
 
 
-dataset = NERDataset.from_astroner(path="data/astro_ner/test.json").sample(500)
-dev_dataset = NERDataset.from_astroner(path="data/astro_ner/train.json")
 ontology = get_astroner_ontology()
 domain = "Astronomy, astronomy research"
 
 
-def run_few_shot_eval(sonnet: bool = False):
+def run_few_shot_eval(sonnet: bool = False, sample_size=500, **tagger_options: Any):
     print("Running few shot NER eval")
+    dataset = NERDataset.from_astroner(path="data/astro_ner/test.json").sample(sample_size)
+    dev_dataset = NERDataset.from_astroner(path="data/astro_ner/train.json")
     output_file = "astro_ner_few_shot_eval"
 
     system_prompt = get_ner_prompt(
@@ -40,6 +46,7 @@ def run_few_shot_eval(sonnet: bool = False):
         entity_types=dataset.entity_types,
         system_prompt=system_prompt,
     )
+    configure_few_shot_tagger(tagger, dev_dataset, **tagger_options)
 
     run_eval(tagger, dataset, output_file)
 
@@ -90,8 +97,16 @@ def run_multi_agent_eval(
     sonnet: bool = False,
     internet_access: bool = True,
     researcher: bool = True,
+    max_concurrency: int = 1,
+    grounding_kb: str | None = None,
+    fuzzy_max_distance: int | None = None,
+    online_grounding: str | None = None,
+    sample_size=500,
+    **tagger_options: Any,
 ):
     print("Running multi-agent NER eval")
+    dataset = NERDataset.from_astroner(path="data/astro_ner/test.json").sample(sample_size)
+    dev_dataset = NERDataset.from_astroner(path="data/astro_ner/train.json")
     output_file = "astro_ner_multi_agent_eval"
 
     if not researcher:
@@ -111,7 +126,7 @@ def run_multi_agent_eval(
         llm_client = create_chat_completions_client(ClaudeFamily.HAIKU_35.value)
 
     if enable_grounding:
-        grounding_engine = GroundingEngine.from_ner_dataset(dev_dataset)
+        grounding_engine = get_grounding_engine(dev_dataset, grounding_kb, fuzzy_max_distance, online_grounding)
         tagger = MultiAgentTagger(
             dataset.entity_types,
             agent_config,
@@ -130,7 +145,8 @@ def run_multi_agent_eval(
             researcher,
         )
 
-    run_eval(tagger, dataset, output_file)
+    configure_multi_agent_tagger(tagger, **tagger_options)
+    run_eval(tagger, dataset, output_file, max_concurrency=max_concurrency)
 
     # Eval result with grounding, Haiku 3.5:
     #                   precision    recall  f1-score   support
@@ -1,27 +1,57 @@
+import bisect
 import copy
 import json
+import logging
 import random
 import numpy as np
 
-from typing import List, Any, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Any, Dict, Optional, Set, Tuple
 from datasets import Dataset, load_dataset
 from nltk import word_tokenize
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 
 
 from ner.converter import Converter
-from ner.tagger import Tagger
+from ner.spans import get_entity_types
 
 
+logger = logging.getLogger(__name__)
+
 SAMPLING_SEED = 43
+ASTRONER_CHUNK_SIZE = 64
+# titles converted in a process pool only from this many on, for the AstroNER
+# splits (a few thousand titles) starting the pool costs more than it saves
+ASTRONER_POOL_MIN_ENTRIES = 50_000
+CONTEXT_UNITS = ["sentences", "tokens"]
+EXAMPLE_CANDIDATES = 32
 
 
 class NERDatasetEntry(BaseModel):
-    left_context: str
-    right_context: str
+    # the context is either given as strings or sliced on access out of a
+    # document shared by all entries of that document
+    model_config = ConfigDict(populate_by_name=True)
+
+    given_left_context: str = Field(default="", alias="left_context")
+    given_right_context: str = Field(default="", alias="right_context")
     text: str
     tokens: List[str]
     labels: List[str]
+    document: Optional[str] = Field(default=None, repr=False)
+    # character offsets of the left and right context in document
+    context_offsets: Optional[Tuple[int, int, int, int]] = None
+
+    @property
+    def left_context(self) -> str:
+        if self.document is None or self.context_offsets is None:
+            return self.given_left_context
+        return self.document[self.context_offsets[0] : self.context_offsets[1]]
+
+    @property
+    def right_context(self) -> str:
+        if self.document is None or self.context_offsets is None:
+            return self.given_right_context
+        return self.document[self.context_offsets[2] : self.context_offsets[3]]
 
 
 class Example(BaseModel):
@@ -36,38 +66,79 @@ class NERDataset(BaseModel):
     entries: List[NERDatasetEntry] = Field(default_factory=list)
     references: List[List[str]]
 
-    def get_examples(self, n: int = 3) -> List[Example]:
-        examples = list()
-        all_entities_present_in_examples = False
-        while not all_entities_present_in_examples:
-            examples = list()
-            sample = self.sample(n, fix_seed=False).entries
-            labels_set = list()
-            for entry in sample:
-                labels_set.append(entry.labels)
-                tagged_text = Converter.convert_iob2_to_example(
-                    entry.labels, entry.tokens
-                )
-                examples.append(
-                    Example(
-                        left_context=entry.left_context,
-                        right_context=entry.right_context,
-                        text_to_tag=entry.text,
-                        tagged_text=tagged_text,
-                    )
-                )
+    _entry_entity_types: List[Set[str]] = PrivateAttr(default_factory=list)
+    _entries_by_entity_type: Dict[str, List[int]] = PrivateAttr(default_factory=dict)
+    _examples_cache: Dict[Tuple[int, int], List[Example]] = PrivateAttr(
+        default_factory=dict
+    )
+
+    def get_examples(self, n: int = 3, seed: int = SAMPLING_SEED) -> List[Example]:
+        cache_key = (n, seed)
+        if cache_key not in self._examples_cache:
+            self._examples_cache[cache_key] = [
+                self._to_example(self.entries[i])
+                for i in self._select_covering_entries(n, seed)
+            ]
+
+        return list(self._examples_cache[cache_key])
+
+    def _select_covering_entries(self, n: int, seed: int) -> List[int]:
+        entry_entity_types, entries_by_entity_type = self._get_entity_type_index()
+        rng = random.Random(seed)
+
+        # greedy set cover: the rarest uncovered entity type picks the candidate
+        # entry that covers the most uncovered types
+        selected: List[int] = []
+        uncovered = set(self.entity_types)
+        while uncovered and len(selected) < n:
+            entity_type = min(
+                uncovered, key=lambda t: (len(entries_by_entity_type.get(t, [])), t)
+            )
+            # entries already selected never hold an uncovered type
+            candidates = entries_by_entity_type.get(entity_type, [])
+            if not candidates:
+                uncovered.discard(entity_type)
+                continue
+
+            candidates = rng.sample(
+                candidates, min(len(candidates), EXAMPLE_CANDIDATES)
+            )
+
+            best = max(candidates, key=lambda i: len(entry_entity_types[i] & uncovered))
+            selected.append(best)
+            uncovered -= entry_entity_types[best]
+
+        if uncovered:
+            logger.warning("Examples do not cover entity types: %s", sorted(uncovered))
+
+        # fill the rest of the examples randomly
+        while len(selected) < min(n, len(self.entries)):
+            i = rng.randrange(len(self.entries))
+            if i not in selected:
+                selected.append(i)
 
-            # make sure all entity types are covered in the examples
-            covered_entities = set()
-            for labels in labels_set:
-                for label in labels:
-                    if label.startswith("B") or label.startswith("I"):
-                        covered_entities.add(label[2:])
+        return selected
 
-            if len(covered_entities) == len(self.entity_types):
-                all_entities_present_in_examples = True
+    def _get_entity_type_index(self) -> Tuple[List[Set[str]], Dict[str, List[int]]]:
+        if len(self._entry_entity_types) != len(self.entries):
+            self._entry_entity_types = list()
+            self._entries_by_entity_type = dict()
+            for i, entry in enumerate(self.entries):
+                entity_types = get_entity_types([entry.labels])
+                self._entry_entity_types.append(entity_types)
+                for entity_type in entity_types:
+                    self._entries_by_entity_type.setdefault(entity_type, []).append(i)
 
-        return examples
+        return self._entry_entity_types, self._entries_by_entity_type
+
+    @staticmethod
+    def _to_example(entry: NERDatasetEntry) -> Example:
+        return Example(
+            left_context=entry.left_context,
+            right_context=entry.right_context,
+            text_to_tag=entry.text,
+            tagged_text=Converter.convert_iob2_to_example(entry.labels, entry.tokens),
+        )
 
     def sample(self, n: int, fix_seed: bool = True) -> "NERDataset":
         if fix_seed:
@@ -84,25 +155,27 @@ class NERDataset(BaseModel):
 
     @staticmethod
     def from_buster(
-        fold: str, sample_size: int = -1, contextify: bool = True
+        fold: str,
+        sample_size: int = -1,
+        contextify: bool = True,
+        context_window: int = -1,
+        context_unit: str = "sentences",
     ) -> "NERDataset":
         dataset: Dataset = load_dataset("expertai/BUSTER")[fold]  # type: ignore
 
-        entities = set()
         entries = list()
         as_list = dataset.data.to_pylist()[:sample_size]
 
         for raw_entry in as_list:
-            batch = NERDataset._from_buster_to_ner_entry(raw_entry, contextify)
+            batch = NERDataset._from_buster_to_ner_entry(
+                raw_entry, contextify, context_window, context_unit
+            )
             entries.extend(batch)
 
         references = list()
         for entry in entries:
-            for label in entry.labels:
-                if label != "O":
-                    entities.add(label[2:])
-
             references.append(entry.labels)
+        entities = get_entity_types(references)
 
         # shuffle the data
         np.random.seed(SAMPLING_SEED)
@@ -133,14 +206,10 @@ class NERDataset(BaseModel):
             for raw_entry in as_list
         ]
 
-        entities = set()
         references = list()
         for entry in entries:
-            for label in entry.labels:
-                if label != "O":
-                    entities.add(label[2:])
-
             references.append(entry.labels)
+        entities = get_entity_types(references)
 
         # shuffle the data
         np.random.seed(SAMPLING_SEED)
@@ -153,52 +222,40 @@ class NERDataset(BaseModel):
         )
 
     @staticmethod
-    def from_astroner(path: str) -> "NERDataset":
-        all_tokens = []
-        all_labels = []
-
+    def from_astroner(path: str, max_workers: Optional[int] = 1) -> "NERDataset":
         with open(path, "r") as file:
             data = json.loads(file.read())
 
         entities = set()
         for raw_entry in data:
-            title = raw_entry["title"]
-            tokens = word_tokenize(title)
             for annotation in raw_entry["annotations"]:
                 entities.add(annotation["label"])
 
-        for raw_entry in data:
-            title = raw_entry["title"]
-            tokens = word_tokenize(title)
-            for annotation in raw_entry["annotations"]:
-                label = annotation["label"]
-                part_of_text = annotation["text"]
-
-                part_of_text_with_label = f"<{label}>{part_of_text}</{label}>"
-                title = title.replace(part_of_text, part_of_text_with_label)
-
-            copy_tokens = copy.deepcopy(tokens)
-            _, genia_labels = Tagger.convert_to_genia_labels(
-                f"<output>{title}</output>", copy_tokens, list(entities)
-            )
-
-            iob2_labels = Converter.convert_genia_to_iob2(genia_labels, tokens)
-            all_labels.append(iob2_labels)
-            all_tokens.append(tokens)
+        if max_workers == 1 or len(data) < ASTRONER_POOL_MIN_ENTRIES:
+            converted = list(map(NERDataset._from_astroner_to_iob2, data))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                converted = list(
+                    executor.map(
+                        NERDataset._from_astroner_to_iob2,
+                        data,
+                        chunksize=ASTRONER_CHUNK_SIZE,
+                    )
+                )
 
         entries = []
-        for i, tokens in enumerate(all_tokens):
+        for tokens, labels in converted:
             entries.append(
                 NERDatasetEntry(
                     left_context="",
                     right_context="",
                     tokens=tokens,
-                    labels=all_labels[i],
+                    labels=labels,
                     text=" ".join(tokens),
                 )
             )
 
-        references = copy.deepcopy(all_labels)
+        references = [copy.deepcopy(labels) for _, labels in converted]
 
         # shuffle the data
         np.random.seed(SAMPLING_SEED)
@@ -210,6 +267,66 @@ class NERDataset(BaseModel):
             entries=entries, entity_types=list(entities), references=references
         )
 
+    @staticmethod
+    def _from_astroner_to_iob2(raw_entry: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+        title = raw_entry["title"]
+        tokens = word_tokenize(title)
+        token_offsets = NERDataset._get_token_offsets(title, tokens)
+        token_starts = [start for start, _ in token_offsets]
+        token_ends = [end for _, end in token_offsets]
+
+        genia_labels = list()
+        for annotation in raw_entry["annotations"]:
+            start_char, end_char = NERDataset._get_annotation_offsets(title, annotation)
+            if start_char == -1:
+                continue
+
+            # tokens overlapping [start_char, end_char) belong to the entity
+            start = bisect.bisect_right(token_ends, start_char)
+            end = bisect.bisect_left(token_starts, end_char)
+            if start < end:
+                genia_labels.append(
+                    {"start": start, "end": end, "type": annotation["label"]}
+                )
+
+        return tokens, Converter.convert_genia_to_iob2(genia_labels, tokens)
+
+    @staticmethod
+    def _get_annotation_offsets(text: str, annotation: Dict[str, Any]) -> Tuple[int, int]:
+        part_of_text = annotation["text"]
+        start = annotation.get("start", -1)
+        end = annotation.get("end", -1)
+        if start != -1 and text[start:end] == part_of_text:
+            return start, end
+
+        start = text.find(part_of_text)
+        if start == -1:
+            return -1, -1
+
+        return start, start + len(part_of_text)
+
+    @staticmethod
+    def _get_token_offsets(text: str, tokens: List[str]) -> List[Tuple[int, int]]:
+        offsets = list()
+        cursor = 0
+        for token in tokens:
+            # word_tokenize rewrites double quotes as `` and ''
+            candidates = ['"', token] if token in ("``", "''") else [token]
+
+            start, length = -1, 0
+            for candidate in candidates:
+                position = text.find(candidate, cursor)
+                if position != -1 and (start == -1 or position < start):
+                    start, length = position, len(candidate)
+
+            if start == -1:
+                start = cursor
+
+            offsets.append((start, start + length))
+            cursor = start + length
+
+        return offsets
+
     @staticmethod
     def from_musicner(path: str) -> "NERDataset":
         all_tokens = []
@@ -241,11 +358,7 @@ class NERDataset(BaseModel):
                 )
             )
 
-        entities = set()
-        for entry in entries:
-            for label in entry.labels:
-                if label != "O":
-                    entities.add(label[2:])
+        entities = get_entity_types(all_labels)
 
         references = copy.deepcopy(all_labels)
 
@@ -261,7 +374,10 @@ class NERDataset(BaseModel):
 
     @staticmethod
     def _from_buster_to_ner_entry(
-        raw_entry: Dict[str, Any], contextify: bool
+        raw_entry: Dict[str, Any],
+        contextify: bool,
+        context_window: int = -1,
+        context_unit: str = "sentences",
     ) -> List[NERDatasetEntry]:
         tokens = raw_entry["tokens"]
 
@@ -301,9 +417,13 @@ class NERDataset(BaseModel):
                 )
             ]
 
-        batch = list()
-        left = list()
-        right = list()
+        if context_unit not in CONTEXT_UNITS:
+            raise ValueError(
+                f"Unknown context unit '{context_unit}'. Expected one of {CONTEXT_UNITS}"
+            )
+
+        # sentence i spans tokens[start:end], tokens[end] is the closing dot
+        sentences = list()
         previous_dot_index = -1
         for i in range(len(tokens)):
             if (
@@ -312,35 +432,57 @@ class NERDataset(BaseModel):
                 and i != 0
                 and tokens[i - 1] != "Inc"
             ) or i == len(tokens) - 1:
-                if previous_dot_index != -1:
-                    left = tokens[: previous_dot_index + 1]
-                if i < len(tokens) - 1:
-                    right = tokens[i + 1 :]
-
-                text = " ".join(tokens[previous_dot_index + 1 : i])
-
-                labels_copy = copy.deepcopy(labels[previous_dot_index + 1 : i])
-                tokens_copy = copy.deepcopy(tokens[previous_dot_index + 1 : i])
-
-                left_context = " ".join(left)
-                right_context = " ".join(right)
-
-                for label in labels_copy:
-                    # filter the batch and only keep the ones with tags
-                    if label.startswith("I") or label.startswith("B"):
-                        batch.append(
-                            NERDatasetEntry(
-                                text=text,
-                                left_context=left_context,
-                                right_context=right_context,
-                                labels=labels_copy,
-                                tokens=tokens_copy,
-                            )
-                        )
-                        break
-
+                sentences.append((previous_dot_index + 1, i))
                 previous_dot_index = i
 
+        # the whole document is joined once and shared by its entries
+        document = " ".join(tokens)
+        offsets = list()
+        offset = 0
+        for token in tokens:
+            offsets.append(offset)
+            offset += len(token) + 1
+        offsets.append(offset)
+
+        def get_offsets(start: int, end: int) -> Tuple[int, int]:
+            # characters of tokens[start:end] in document
+            if start >= end:
+                return 0, 0
+            return offsets[start], offsets[end] - 1
+
+        batch = list()
+        for sentence_index, (start, end) in enumerate(sentences):
+            labels_copy = copy.deepcopy(labels[start:end])
+
+            # filter the batch and only keep the ones with tags
+            if all(label == "O" for label in labels_copy):
+                continue
+
+            if context_window < 0:
+                left_start, right_end = 0, len(tokens)
+            elif context_unit == "sentences":
+                left_start = sentences[max(0, sentence_index - context_window)][0]
+                right_end = (
+                    sentences[min(len(sentences) - 1, sentence_index + context_window)][1]
+                    + 1
+                )
+            else:
+                left_start = max(0, start - context_window)
+                right_end = min(len(tokens), end + 1 + context_window)
+
+            text_start, text_end = get_offsets(start, end)
+            batch.append(
+                NERDatasetEntry(
+                    text=document[text_start:text_end],
+                    labels=labels_copy,
+                    tokens=copy.deepcopy(tokens[start:end]),
+                    # the entries only keep offsets, so the contexts of a
+                    # document take no memory beyond the document itself
+                    document=document,
+                    context_offsets=get_offsets(left_start, start) + get_offsets(end + 1, right_end),
+                )
+            )
+
         return batch
 
 
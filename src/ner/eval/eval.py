@@ -1,19 +1,111 @@
 import json
+import os
 from time import sleep
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import numpy as np
 from seqeval.metrics.v1 import precision_recall_fscore_support
 from tqdm import tqdm
 from seqeval.metrics import classification_report, f1_score
 from seqeval.scheme import IOB2
 
-from ner.eval.dataset import NERDataset
+from ner.agents.history_budget import HistoryBudget
+from ner.agents.multi_agent_tagger import MultiAgentTagger
+from ner.agents.review_policy import ReviewPolicy
+from ner.agents.tools.local_search import LocalSearchIndex
+from ner.eval.dataset import NERDataset, NERDatasetEntry
+from ner.grounding import GroundingEngine
+from ner.grounding_online import OnlineGroundingEngine
+from ner.grounding_store import load_grounding_engine, load_knowledge_base
+from ner.prompt_budget import PromptBudget
+from ner.retrieval import ExampleIndex
+from ner.spans import extract_spans_batch
 from ner.tagger import Tagger
+from ner.tagger_few_shot import FewShotTagger
 
 
-def get_predictions(tagger: Tagger, test_data: NERDataset) -> List[List[str]]:
+def get_grounding_engine(
+    dev_dataset: NERDataset,
+    grounding_kb: str | None = None,
+    fuzzy_max_distance: int | None = None,
+    online_grounding: str | None = None,
+) -> GroundingEngine:
+    if online_grounding:
+        return get_online_grounding_engine(dev_dataset, online_grounding, grounding_kb, fuzzy_max_distance)
+    # a knowledge base stored by grounding_builder.py opens in milliseconds,
+    # otherwise it is built from the dev split on every run
+    if grounding_kb:
+        return load_grounding_engine(grounding_kb, fuzzy_max_distance)
+    grounding_engine = GroundingEngine.from_ner_dataset(dev_dataset)
+    grounding_engine.fuzzy_max_distance = fuzzy_max_distance
+    return grounding_engine
+
+
+def get_online_grounding_engine(
+    dev_dataset: NERDataset,
+    snapshot_path: str,
+    grounding_kb: str | None = None,
+    fuzzy_max_distance: int | None = None,
+) -> OnlineGroundingEngine:
+    # a run resumes from the snapshot of the previous one, the first run
+    # starts from an in-memory copy of the stored or dev split knowledge base
+    if os.path.exists(snapshot_path):
+        return OnlineGroundingEngine.from_snapshot(snapshot_path, fuzzy_max_distance=fuzzy_max_distance)
+    if grounding_kb:
+        knowledge_base = load_knowledge_base(grounding_kb)
+    else:
+        knowledge_base = GroundingEngine.from_ner_dataset(dev_dataset).knowledge_base
+    return OnlineGroundingEngine(
+        knowledge_base=knowledge_base,
+        snapshot_path=snapshot_path,
+        fuzzy_max_distance=fuzzy_max_distance,
+    )
+
+
+def configure_few_shot_tagger(
+    tagger: FewShotTagger,
+    dev_dataset: NERDataset,
+    dynamic_examples: int = 0,
+    prompt_budget: int | None = None,
+) -> None:
+    # the optional features of run.py, all off by default
+    if dynamic_examples:
+        tagger.example_index = ExampleIndex.from_ner_dataset(dev_dataset)
+        tagger.dynamic_examples = dynamic_examples
+    if prompt_budget:
+        tagger.prompt_budget = PromptBudget(prompt_budget)
+
+
+def configure_multi_agent_tagger(
+    tagger: MultiAgentTagger,
+    prompt_budget: int | None = None,
+    grounding_hints: bool = False,
+    history_budget: int | None = None,
+    review_policy: bool = False,
+    direct_execution: bool = False,
+    local_search_index: str | None = None,
+    single_call_research: bool = False,
+    shared_research: bool = False,
+) -> None:
+    if prompt_budget:
+        tagger.prompt_budget = PromptBudget(prompt_budget)
+    tagger.grounding_hints = grounding_hints
+    if history_budget:
+        tagger.history_budget = HistoryBudget(max_tokens=history_budget)
+    if review_policy:
+        tagger.review_policy = ReviewPolicy()
+    tagger.direct_execution = direct_execution
+    tagger.single_call_research = single_call_research
+    tagger.shared_research = shared_research
+    if local_search_index:
+        tagger.local_search = LocalSearchIndex(local_search_index)
+
+
+def get_predictions(tagger: Tagger, test_data: NERDataset, max_concurrency: int = 1) -> List[Optional[List[str]]]:
     print(f"Length of test data: {len(test_data.references)}.")
+    if max_concurrency > 1 and hasattr(tagger, "recognize_many"):
+        return get_predictions_concurrently(tagger, test_data, max_concurrency)
+
     predictions = []
     try:
         for entry in tqdm(test_data.entries):
@@ -33,36 +125,138 @@ def get_predictions(tagger: Tagger, test_data: NERDataset) -> List[List[str]]:
     return predictions
 
 
+def get_predictions_concurrently(tagger: Tagger, test_data: NERDataset, max_concurrency: int) -> List[Optional[List[str]]]:
+    # chunks of a few batches keep the progress bar moving and the
+    # predictions of finished chunks when a later one fails
+    chunk_size = 4 * max_concurrency
+    predictions: List[Optional[List[str]]] = []
+    try:
+        for start in tqdm(range(0, len(test_data.entries), chunk_size)):
+            entries = test_data.entries[start : start + chunk_size]
+            results = tagger.recognize_many(entries, max_concurrency)  # type: ignore
+            for entry, result in zip(entries, results):
+                print(f"\n\nTo tag: {' '.join(entry.tokens)}")
+                if result is None:
+                    # the session failed, the sentence is left out of the scores
+                    print("Tagged    : failed")
+                    predictions.append(None)
+                    continue
+                tagged_string, iob2_tags = result
+                print(f"Tagged    : {tagged_string}")
+                predictions.append(iob2_tags)
+    except Exception as err:
+        print(
+            f"Something wrong happened: {str(err)}. Returning predictions gathered so far."
+        )
+
+    return predictions
+
+
 def run_eval(
     tagger: Tagger,
     dataset: NERDataset,
     output_file: str,
     return_scores=False,
+    max_concurrency: int = 1,
 ):
     print(f"Test dataset size: {len(dataset.references)}")
 
-    predictions = get_predictions(tagger, dataset)
+    try:
+        predictions = get_predictions(tagger, dataset, max_concurrency)
+    finally:
+        tagger.close()
     print(f"Loaded predictions. Sample prediction: {predictions[0]}")
 
+    # sentences whose session failed have no prediction and are not scored
+    scored = [i for i, prediction in enumerate(predictions) if prediction is not None]
+    references = [dataset.references[i] for i in scored]
+    scored_predictions: List[List[str]] = [predictions[i] for i in scored]  # type: ignore
+
     print("\n\nEval result:")
+    print(classification_report(references, scored_predictions, scheme=IOB2))
+
+    precision, recall, f1 = get_span_scores(references, scored_predictions)
     print(
-        classification_report(
-            dataset.references[: len(predictions)], predictions, scheme=IOB2
-        )
+        f"Span-level micro scores: precision {precision:.2f}, recall {recall:.2f}, f1 {f1:.2f}"
     )
 
+    prompt_budget = getattr(tagger, "prompt_budget", None)
+    if prompt_budget:
+        print(prompt_budget.report())
+
+    history_budget = getattr(tagger, "history_budget", None)
+    if history_budget:
+        print(history_budget.report())
+
+    review_policy = getattr(tagger, "review_policy", None)
+    if review_policy:
+        print(review_policy.report())
+
+    research_service = getattr(tagger, "research_service", None)
+    if research_service:
+        print(research_service.report())
+
+    errors = getattr(tagger, "metadata", {}).get("errors")
+    if errors:
+        print(f"{len(errors)} of {len(predictions)} sentences failed and were left out of the scores")
+
+    grounding_engine = getattr(tagger, "grounding_engine", None)
+    if grounding_engine:
+        print(get_grounding_report(grounding_engine, [dataset.entries[i] for i in scored], scored_predictions))
+    if isinstance(grounding_engine, OnlineGroundingEngine):
+        print(grounding_engine.report())
+        if grounding_engine.snapshot_path:
+            # what was learned since the last snapshot is kept for the next run
+            grounding_engine.snapshot()
+
     with open(f"pred/{output_file}-{datetime.now().isoformat()}.json", "w") as file:
         file.write(json.dumps(predictions))
 
     if return_scores:
         return precision_recall_fscore_support(
-            dataset.references[: len(predictions)],
-            predictions,
+            references,
+            scored_predictions,
             scheme=IOB2,
             average="micro",
         )
 
 
+def get_grounding_report(
+    grounding_engine: GroundingEngine, entries: List[NERDatasetEntry], predictions: List[List[str]]
+) -> str:
+    # the final predictions graded against the knowledge base in one batch
+    results = grounding_engine.verify_many([entry.tokens for entry in entries], predictions)
+    sentences = len({result.index for result in results})
+    return f"Grounding: {len(results)} predicted spans in {sentences} of {len(predictions)} sentences disagree with the knowledge base"
+
+
+def get_span_scores(
+    references: List[List[str]], predictions: List[List[str]]
+) -> Tuple[float, float, float]:
+    # exact-match micro precision, recall and f1 over IOB2 spans
+    def to_span_set(labels_batch: List[List[str]]):
+        spans = extract_spans_batch(labels_batch)
+        return {
+            (sentence_id, start, end, spans.types[type_id])
+            for sentence_id, start, end, type_id in zip(
+                spans.sentence_ids.tolist(),
+                spans.starts.tolist(),
+                spans.ends.tolist(),
+                spans.type_ids.tolist(),
+            )
+        }
+
+    reference_spans = to_span_set(references)
+    predicted_spans = to_span_set(predictions)
+    true_positives = len(reference_spans & predicted_spans)
+
+    precision = true_positives / len(predicted_spans) if predicted_spans else 0.0
+    recall = true_positives / len(reference_spans) if reference_spans else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return precision, recall, f1
+
+
 def calculate_std_dev(scores: List[Tuple[float, float, float, float]]):
     precision_scores = np.array([score[0] for score in scores])
     recall_scores = np.array([score[1] for score in scores])
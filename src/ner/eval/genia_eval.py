@@ -6,15 +6,20 @@ from ner.ablation.prompts import (
 from ner.agents.multi_agent_tagger import MultiAgentTagger
 from ner.clients.claude_client import AnthropicClient, ClaudeFamily
 from ner.clients.claude_oai_compatible_client import create_chat_completions_client
-from ner.grounding import GroundingEngine
 from ner.ontology import get_genia_ontology
 from ner.eval.dataset import NERDataset
-from ner.eval.eval import calculate_std_dev, run_eval
+from ner.eval.eval import (
+    calculate_std_dev,
+    configure_few_shot_tagger,
+    configure_multi_agent_tagger,
+    get_grounding_engine,
+    run_eval,
+)
 from ner.prompts import get_agent_config, get_ner_prompt
 from ner.tagger_few_shot import FewShotTagger
 
 
-def run_few_shot_eval(sonnet: bool = False, sample_size=500) -> Any:
+def run_few_shot_eval(sonnet: bool = False, sample_size=500, **tagger_options: Any) -> Any:
     print("Running few shot NER eval")
     dataset = NERDataset.from_genia("test").sample(sample_size)
     dev_dataset = NERDataset.from_genia("train")
@@ -37,6 +42,7 @@ def run_few_shot_eval(sonnet: bool = False, sample_size=500) -> Any:
         entity_types=dataset.entity_types,
         system_prompt=system_prompt,
     )
+    configure_few_shot_tagger(tagger, dev_dataset, **tagger_options)
 
     return run_eval(tagger, dataset, output_file, return_scores=True)
 
@@ -72,7 +78,12 @@ def run_multi_agent_eval(
     sonnet: bool = False,
     internet_access: bool = True,
     researcher: bool = True,
+    max_concurrency: int = 1,
+    grounding_kb: str | None = None,
+    fuzzy_max_distance: int | None = None,
+    online_grounding: str | None = None,
     sample_size=500,
+    **tagger_options: Any,
 ):
     print("Running multi-agent NER eval")
     dataset = NERDataset.from_genia("test").sample(sample_size)
@@ -95,7 +106,7 @@ def run_multi_agent_eval(
         llm_client = create_chat_completions_client(ClaudeFamily.HAIKU_35.value)
 
     if enable_grounding:
-        grounding_engine = GroundingEngine.from_ner_dataset(dev_dataset)
+        grounding_engine = get_grounding_engine(dev_dataset, grounding_kb, fuzzy_max_distance, online_grounding)
         tagger = MultiAgentTagger(
             dataset.entity_types,
             agent_config,
@@ -114,7 +125,8 @@ def run_multi_agent_eval(
             researcher,
         )
 
-    run_eval(tagger, dataset, output_file)
+    configure_multi_agent_tagger(tagger, **tagger_options)
+    run_eval(tagger, dataset, output_file, max_concurrency=max_concurrency)
 
     # Eval result without grounding, Haiku 3.5:
     #               precision    recall  f1-score   support
@@ -1,5 +1,7 @@
 # eval for: https://github.com/deezer/music-ner-eacl2023/tree/mai://github.com/deezer/music-ner-eacl2023/tree/main
 
+from typing import Any
+
 from ner.ablation.prompts import (
     get_agent_config_no_internet,
     get_agent_config_no_researcher,
@@ -7,9 +9,13 @@ from ner.ablation.prompts import (
 from ner.agents.multi_agent_tagger import MultiAgentTagger
 from ner.clients.claude_client import AnthropicClient, ClaudeFamily
 from ner.clients.claude_oai_compatible_client import create_chat_completions_client
-from ner.grounding import GroundingEngine
 from ner.eval.dataset import NERDataset
-from ner.eval.eval import run_eval
+from ner.eval.eval import (
+    configure_few_shot_tagger,
+    configure_multi_agent_tagger,
+    get_grounding_engine,
+    run_eval,
+)
 from ner.ontology import get_musicner_ontology
 from ner.prompts import get_agent_config, get_ner_prompt
 from ner.tagger_few_shot import FewShotTagger
@@ -21,7 +27,7 @@ ontology = get_musicner_ontology()
 domain = "Music industry, entertainment"
 
 
-def run_few_shot_eval(sonnet: bool = False):
+def run_few_shot_eval(sonnet: bool = False, **tagger_options: Any):
     print("Running few shot NER eval")
     output_file = "music_ner_few_shot_eval"
 
@@ -40,6 +46,7 @@ def run_few_shot_eval(sonnet: bool = False):
         entity_types=dataset.entity_types,
         system_prompt=system_prompt,
     )
+    configure_few_shot_tagger(tagger, dev_dataset, **tagger_options)
 
     run_eval(tagger, dataset, output_file)
 
@@ -69,6 +76,11 @@ def run_multi_agent_eval(
     sonnet: bool = False,
     internet_access: bool = True,
     researcher: bool = True,
+    max_concurrency: int = 1,
+    grounding_kb: str | None = None,
+    fuzzy_max_distance: int | None = None,
+    online_grounding: str | None = None,
+    **tagger_options: Any,
 ):
     print("Running multi-agent NER eval")
     output_file = "music_ner_multi_agent_eval"
@@ -90,7 +102,7 @@ def run_multi_agent_eval(
         llm_client = create_chat_completions_client(ClaudeFamily.HAIKU_35.value)
 
     if enable_grounding:
-        grounding_engine = GroundingEngine.from_ner_dataset(dev_dataset)
+        grounding_engine = get_grounding_engine(dev_dataset, grounding_kb, fuzzy_max_distance, online_grounding)
         tagger = MultiAgentTagger(
             dataset.entity_types,
             agent_config,
@@ -109,7 +121,8 @@ def run_multi_agent_eval(
             researcher,
         )
 
-    run_eval(tagger, dataset, output_file)
+    configure_multi_agent_tagger(tagger, **tagger_options)
+    run_eval(tagger, dataset, output_file, max_concurrency=max_concurrency)
 
     # Eval result, with grounding. Haiku 3.5. Second run, double checked:
     #               precision    recall  f1-score   support
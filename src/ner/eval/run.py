@@ -1,6 +1,7 @@
 import click
-from typing import Tuple, Callable
+from typing import Any, Callable, Dict, Tuple
 
+from ner.eval.dataset import CONTEXT_UNITS
 from ner.eval.genia_eval import run_few_shot_eval as run_genia_few_shot
 from ner.eval.genia_eval import run_multi_agent_eval as run_genia_multi_agent
 from ner.eval.music_eval import run_few_shot_eval as run_music_few_shot
@@ -32,6 +33,14 @@ def get_benchmark_runners(benchmark: str) -> Tuple[Callable, Callable]:
     return runners[benchmark]
 
 
+def get_given_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: value for name, value in options.items() if value}
+
+
+def get_option_names(options: Dict[str, Any]) -> str:
+    return ", ".join(f"--{name.replace('_', '-')}" for name in options)
+
+
 @click.command()
 @click.option(
     "--benchmark",
@@ -57,12 +66,128 @@ def get_benchmark_runners(benchmark: str) -> Tuple[Callable, Callable]:
     default=500,
     help="Number of samples to evaluate (default: 500)",
 )
-def run(benchmark: str, variant: str, llm: str, sample_size: int):
+@click.option(
+    "--max-concurrency",
+    type=int,
+    default=1,
+    help="Sentences tagged at once by the multi-agent variants (default: 1)",
+)
+@click.option(
+    "--context-window",
+    type=int,
+    default=None,
+    help="Sentences or tokens of context kept on each side of a BUSTER sentence (default: the whole document)",
+)
+@click.option(
+    "--context-unit",
+    type=click.Choice(CONTEXT_UNITS),
+    default=None,
+    help="Unit of --context-window (default: sentences)",
+)
+@click.option(
+    "--dynamic-examples",
+    type=int,
+    default=0,
+    help="Similar training examples retrieved for each sentence by the few-shot variant (default: 0)",
+)
+@click.option(
+    "--prompt-budget",
+    type=int,
+    default=None,
+    help="Token budget of each tagger query, the surrounding context is trimmed to fit",
+)
+@click.option(
+    "--grounding-kb",
+    default=None,
+    help="Knowledge base file written by grounding_builder.py, used instead of building one from the dev split",
+)
+@click.option(
+    "--fuzzy-max-distance",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Edit distance at which a mention missing from the grounding knowledge base is checked against similar known ones",
+)
+@click.option(
+    "--online-grounding",
+    default=None,
+    help="Snapshot file of a grounding knowledge base that learns from approved predictions, resumed when it exists",
+)
+@click.option(
+    "--grounding-hints",
+    is_flag=True,
+    help="Tell the tagger which mentions the grounding knowledge base already knows",
+)
+@click.option(
+    "--history-budget",
+    type=int,
+    default=None,
+    help="Token budget of the chat history each agent sends to the model",
+)
+@click.option(
+    "--review-policy",
+    is_flag=True,
+    help="Let tagger outputs that pass the deterministic and grounding checks skip the reviewer",
+)
+@click.option(
+    "--direct-execution",
+    is_flag=True,
+    help="Run the multi-agent conversations as direct calls instead of through the agent runtime",
+)
+@click.option(
+    "--local-search-index",
+    default=None,
+    help="Directory of a local search index the researcher searches instead of the web, also without internet access",
+)
+@click.option(
+    "--single-call-research",
+    is_flag=True,
+    help="Search the questions of the researcher requests directly instead of asking the model for the search first",
+)
+@click.option(
+    "--shared-research",
+    is_flag=True,
+    help="Answer the researcher requests of concurrent sessions together in batches",
+)
+def run(
+    benchmark: str,
+    variant: str,
+    llm: str,
+    sample_size: int,
+    max_concurrency: int,
+    context_window: int | None,
+    context_unit: str | None,
+    dynamic_examples: int,
+    prompt_budget: int | None,
+    grounding_kb: str | None,
+    fuzzy_max_distance: int | None,
+    online_grounding: str | None,
+    grounding_hints: bool,
+    history_budget: int | None,
+    review_policy: bool,
+    direct_execution: bool,
+    local_search_index: str | None,
+    single_call_research: bool,
+    shared_research: bool,
+):
     """Run NER evaluation for specified benchmark and variant.
 
     Examples:
         python run.py --benchmark genia --variant few-shot --llm haiku
         python run.py --benchmark music --variant agentic-ner-grounding --llm sonnet --sample-size 100
+        python run.py --benchmark buster --variant agentic-ner-grounding --context-window 2
+        python run.py --benchmark genia --variant few-shot --dynamic-examples 3
+        python run.py --benchmark buster --variant few-shot --prompt-budget 1500
+        python run.py --benchmark genia --variant agentic-ner-grounding --max-concurrency 8
+        python run.py --benchmark genia --variant agentic-ner-grounding --grounding-kb kb/genia.kb
+        python run.py --benchmark genia --variant agentic-ner-grounding --fuzzy-max-distance 1
+        python run.py --benchmark genia --variant agentic-ner-grounding --online-grounding kb/genia-online.kb
+        python run.py --benchmark genia --variant agentic-ner-grounding --grounding-hints
+        python run.py --benchmark genia --variant agentic-ner-grounding --history-budget 2000
+        python run.py --benchmark genia --variant agentic-ner-grounding --review-policy
+        python run.py --benchmark genia --variant agentic-ner-grounding --direct-execution
+        python run.py --benchmark genia --variant agentic-ner-grounding-no-internet --local-search-index index/genia
+        python run.py --benchmark genia --variant agentic-ner-grounding --single-call-research
+        python run.py --benchmark genia --variant agentic-ner-grounding --max-concurrency 8 --shared-research
     """
     use_sonnet = llm == "sonnet"
     click.echo(f"Running {variant} evaluation on {benchmark} benchmark")
@@ -70,17 +195,76 @@ def run(benchmark: str, variant: str, llm: str, sample_size: int):
 
     few_shot_runner, multi_agent_runner = get_benchmark_runners(benchmark)
 
+    # options left at their defaults are not passed, so a runner only gets
+    # the ones its tagger supports
+    options = get_given_options({"prompt_budget": prompt_budget})
+    if context_unit is not None and context_window is None:
+        raise click.UsageError("--context-unit needs --context-window")
+    if context_window is not None:
+        # a window of 0 keeps the sentence alone, so it is passed as given
+        if benchmark != "buster":
+            raise click.UsageError("--context-window only applies to the buster benchmark")
+        options["context_window"] = context_window
+        options["context_unit"] = context_unit or "sentences"
+    few_shot_options = get_given_options({"dynamic_examples": dynamic_examples})
+    multi_agent_options = get_given_options(
+        {
+            "grounding_kb": grounding_kb,
+            "online_grounding": online_grounding,
+            "grounding_hints": grounding_hints,
+            "history_budget": history_budget,
+            "review_policy": review_policy,
+            "direct_execution": direct_execution,
+            "local_search_index": local_search_index,
+            "single_call_research": single_call_research,
+            "shared_research": shared_research,
+        }
+    )
+    if fuzzy_max_distance is not None:
+        # a distance of 0 still matches spelling variants like 'IkB-alpha' and 'ikb alpha'
+        multi_agent_options["fuzzy_max_distance"] = fuzzy_max_distance
+
     if variant == "few-shot":
-        few_shot_runner(sonnet=use_sonnet, sample_size=sample_size)
+        if multi_agent_options:
+            raise click.UsageError(
+                f"{get_option_names(multi_agent_options)} only apply to the agentic-ner variants"
+            )
+        few_shot_runner(
+            sonnet=use_sonnet,
+            sample_size=sample_size,
+            **few_shot_options,
+            **options,
+        )
+        return
+
+    if few_shot_options:
+        raise click.UsageError(
+            f"{get_option_names(few_shot_options)} only apply to the few-shot variant"
+        )
+    if variant == "agentic-ner-no-grounding" and (
+        grounding_kb or fuzzy_max_distance is not None or online_grounding or grounding_hints
+    ):
+        raise click.UsageError(
+            "--grounding-kb, --fuzzy-max-distance, --online-grounding and --grounding-hints need a variant with grounding"
+        )
+    multi_agent_options.update(options)
 
-    elif variant == "agentic-ner-no-grounding":
+    if variant == "agentic-ner-no-grounding":
         multi_agent_runner(
-            enable_grounding=False, sonnet=use_sonnet, sample_size=sample_size
+            enable_grounding=False,
+            sonnet=use_sonnet,
+            sample_size=sample_size,
+            max_concurrency=max_concurrency,
+            **multi_agent_options,
         )
 
     elif variant == "agentic-ner-grounding":
         multi_agent_runner(
-            enable_grounding=True, sonnet=use_sonnet, sample_size=sample_size
+            enable_grounding=True,
+            sonnet=use_sonnet,
+            sample_size=sample_size,
+            max_concurrency=max_concurrency,
+            **multi_agent_options,
         )
 
     elif variant == "agentic-ner-grounding-no-internet":
@@ -89,6 +273,8 @@ def run(benchmark: str, variant: str, llm: str, sample_size: int):
             internet_access=False,
             sonnet=use_sonnet,
             sample_size=sample_size,
+            max_concurrency=max_concurrency,
+            **multi_agent_options,
         )
 
     elif variant == "agentic-ner-grounding-no-researcher":
@@ -97,6 +283,8 @@ def run(benchmark: str, variant: str, llm: str, sample_size: int):
             researcher=False,
             sonnet=use_sonnet,
             sample_size=sample_size,
+            max_concurrency=max_concurrency,
+            **multi_agent_options,
         )
 
 
@@ -1,27 +1,159 @@
-from typing import Dict, List, Set
+import logging
+import sys
+import time
+import tracemalloc
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from collections import namedtuple
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 
 from ner.eval.dataset import NERDataset
+from ner.grounding_automaton import GroundingAutomaton
+from ner.grounding_fuzzy import FuzzyIndex
+from ner.spans import extract_spans, extract_spans_batch
+
+
+logger = logging.getLogger(__name__)
+
+GROUNDING_CONFIDENCE_THRESHOLD = 0.8
 
 
 class GroundingKnowledgeBase(BaseModel):
-    data: Dict[str, Set[str]] = Field(default_factory=dict)
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # the row of each key in `counts`
+    rows: Dict[str, int] = Field(default_factory=dict)
+    # how often each key was seen with each label, one row of row_width
+    # counters per key in a single flat array, column i stands for labels[i]
+    counts: array = Field(default_factory=lambda: array("I"))
+    row_width: int = 0
+    # rows of removed keys, reused by the next new keys
+    free_rows: List[int] = Field(default_factory=list)
+    labels: List[str] = Field(default_factory=list)
+    # when a key was last added online, keys built offline have no timestamp
+    last_seen: Dict[str, float] = Field(default_factory=dict)
     token_separator: str = "___"
 
     def to_knowledge_key(self, tokens: List[str]) -> str:
         return self.token_separator.join([token.lower() for token in tokens])
 
+    def _widen(self, row_width: int) -> None:
+        # new labels are rare, so the rows are copied once per new label
+        n_rows = len(self.counts) // self.row_width if self.row_width else 0
+        counts = array("I", [0] * (n_rows * row_width))
+        for row in range(n_rows):
+            start = row * self.row_width
+            counts[row * row_width : row * row_width + self.row_width] = self.counts[start : start + self.row_width]
+        self.counts = counts
+        self.row_width = row_width
+
+    def add(self, knowledge_key: str, label: str, count: int = 1, timestamp: Optional[float] = None) -> None:
+        if label not in self.labels:
+            self.labels.append(label)
+        label_id = self.labels.index(label)
+        if label_id >= self.row_width:
+            self._widen(len(self.labels))
+        # the same key object is shared by rows and last_seen
+        knowledge_key = sys.intern(knowledge_key)
+
+        row = self.rows.get(knowledge_key)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = len(self.counts) // self.row_width
+                self.counts.extend([0] * self.row_width)
+            self.rows[knowledge_key] = row
+        self.counts[row * self.row_width + label_id] += count
+
+        if timestamp is not None:
+            self.last_seen[knowledge_key] = timestamp
+
+    def remove(self, knowledge_key: str) -> None:
+        row = self.rows.pop(knowledge_key, None)
+        if row is not None:
+            start = row * self.row_width
+            self.counts[start : start + self.row_width] = array("I", [0] * self.row_width)
+            self.free_rows.append(row)
+        self.last_seen.pop(knowledge_key, None)
+
+    def get_label_bit(self, label: str) -> int:
+        # 0 for labels the knowledge base has never seen
+        return 1 << self.labels.index(label) if label in self.labels else 0
+
+    def to_mask(self, labels: Iterable[str]) -> int:
+        mask = 0
+        for label in labels:
+            mask |= self.get_label_bit(label)
+        return mask
+
+    def to_labels(self, mask: int) -> Set[str]:
+        return {label for i, label in enumerate(self.labels) if mask >> i & 1}
+
+    def get_mask(self, knowledge_key: str) -> int:
+        # the labels of a key as a bitmask, bit i stands for labels[i]
+        row = self.rows.get(knowledge_key)
+        if row is None:
+            return 0
+
+        mask = 0
+        start = row * self.row_width
+        for i in range(self.row_width):
+            if self.counts[start + i]:
+                mask |= 1 << i
+        return mask
+
+    def get(self, knowledge_key: str) -> Optional[Set[str]]:
+        mask = self.get_mask(knowledge_key)
+        return self.to_labels(mask) if mask else None
+
+    def get_counts_many(self, knowledge_keys: List[str]) -> List[Dict[str, int]]:
+        return [self.get_counts(knowledge_key) for knowledge_key in knowledge_keys]
+
+    def get_counts(self, knowledge_key: str) -> Dict[str, int]:
+        row = self.rows.get(knowledge_key)
+        if row is None:
+            return dict()
+
+        start = row * self.row_width
+        return {
+            self.labels[i]: count
+            for i, count in enumerate(self.counts[start : start + self.row_width])
+            if count
+        }
+
+    def get_distribution(self, knowledge_key: str) -> Dict[str, float]:
+        counts = self.get_counts(knowledge_key)
+        total = sum(counts.values())
+        return {label: count / total for label, count in counts.items()}
+
+    def get_last_seen(self, knowledge_key: str) -> Optional[float]:
+        return self.last_seen.get(knowledge_key)
+
+    def keys(self) -> Iterable[str]:
+        return self.rows.keys()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
 
 WrongPrediction = namedtuple("WrongPrediction", ["predicted_tags", "grounded_tags"])
+FuzzyPrediction = namedtuple(
+    "FuzzyPrediction", ["predicted_tags", "grounded_tags", "matched_entity", "distance"]
+)
+GroundingResult = namedtuple(
+    "GroundingResult", ["index", "start", "end", "entity", "predicted", "grounded"]
+)
+CandidateSpan = namedtuple("CandidateSpan", ["start", "end", "entity", "grounded_tags"])
 
 
 class GroundingFeedback(BaseModel):
     correct: Dict[str, List[str]] = Field(default_factory=dict)
     wrong: Dict[str, WrongPrediction] = Field(default_factory=dict)
+    # wrong predictions found through a similar, not identical, known entity
+    fuzzy: Dict[str, FuzzyPrediction] = Field(default_factory=dict)
 
-
-    def get_text_feedback(self, token_separator: str = "___", include_correct: bool = False) -> str:
+    def get_text_feedback(self, token_separator: str = "___", include_correct: bool = False, include_fuzzy: bool = True) -> str:
         feedback = ""
 
         if include_correct:
@@ -34,69 +166,266 @@ class GroundingFeedback(BaseModel):
             for tag in wrong_prediction.predicted_tags:
                 feedback += f"- '{wrong_entity.replace(token_separator, " ")}' is tagged as '{tag}'. It should likely be {' or '.join(wrong_prediction.grounded_tags)} instead.\n"
 
+        if include_fuzzy:
+            for fuzzy_entity, fuzzy_prediction in self.fuzzy.items():
+                for tag in fuzzy_prediction.predicted_tags:
+                    feedback += f"- '{fuzzy_entity.replace(token_separator, " ")}' is tagged as '{tag}'. The similar entity '{fuzzy_prediction.matched_entity.replace(token_separator, " ")}' is usually {' or '.join(fuzzy_prediction.grounded_tags)}, so it should likely be {' or '.join(fuzzy_prediction.grounded_tags)} instead.\n"
 
         return feedback
 
+    @staticmethod
+    def from_results(results: List[GroundingResult]) -> "GroundingFeedback":
+        grounding_feedback = GroundingFeedback()
+        for result in results:
+            # an entity tagged the same way twice is reported once, like verify does
+            if result.grounded:
+                wrong = grounding_feedback.wrong.get(result.entity)
+                predicted_tags = wrong.predicted_tags if wrong else []
+                if result.predicted not in predicted_tags:
+                    predicted_tags = predicted_tags + [result.predicted]
+                grounding_feedback.wrong[result.entity] = WrongPrediction(
+                    predicted_tags=predicted_tags, grounded_tags=result.grounded
+                )
+            else:
+                correct = grounding_feedback.correct.setdefault(result.entity, [])
+                if result.predicted not in correct:
+                    correct.append(result.predicted)
+
+        return grounding_feedback
+
 class GroundingEngine(BaseModel):
     knowledge_base: GroundingKnowledgeBase = Field(default_factory=GroundingKnowledgeBase)
+    # a predicted tag is only reported as wrong when the knowledge base gives
+    # another label at least this probability
+    confidence_threshold: float = GROUNDING_CONFIDENCE_THRESHOLD
+    # edit distance allowed between normalized keys, None disables fuzzy lookups
+    fuzzy_max_distance: Optional[int] = None
+
+    _automaton: Optional[GroundingAutomaton] = PrivateAttr(default=None)
+    _fuzzy_index: Optional[FuzzyIndex] = PrivateAttr(default=None)
 
     @staticmethod
     def from_ner_dataset(dataset: NERDataset) -> "GroundingEngine":
         engine = GroundingEngine()
         for entry in dataset.entries:
-            engine.knowledge_base.data = GroundingEngine._upadate_grounding_data(
-                engine.knowledge_base, entry.tokens, entry.labels, engine.knowledge_base.data
-            )
-        
+            for knowledge_key, label in GroundingEngine._get_entities(
+                engine.knowledge_base, entry.tokens, entry.labels
+            ):
+                engine.knowledge_base.add(knowledge_key, label)
+
         return engine
 
+    @staticmethod
+    def _get_entities(knowledge_base: GroundingKnowledgeBase, tokens: List[str], labels: List[str]) -> List[Tuple[str, str]]:
+        entities = list()
+        for start, end, entity_type in extract_spans(labels):
+            knowledge_key = knowledge_base.to_knowledge_key(tokens[start:end])
+            if knowledge_key:
+                entities.append((knowledge_key, entity_type))
+
+        return entities
 
     @staticmethod
     def _upadate_grounding_data(knowledge_base: GroundingKnowledgeBase, tokens: List[str], labels: List[str], data: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
-        for i, label in enumerate(labels):
-            if label.startswith("B"):
-                start_idx = i
-                end_idx = len(labels)
-                for j in range(i, len(labels)):
-                    if labels[j] == "O":
-                        end_idx = j
-                        break
-
-                knowledge_key = knowledge_base.to_knowledge_key(
-                    tokens[start_idx:end_idx]
-                )
-                data[knowledge_key] = data.get(
-                    knowledge_key, set()
-                )
-                data[knowledge_key].add(label[2:])
+        for knowledge_key, label in GroundingEngine._get_entities(knowledge_base, tokens, labels):
+            data[knowledge_key] = data.get(knowledge_key, set())
+            data[knowledge_key].add(label)
 
-        if '' in data:
-            del data['']
         return data
 
-
     def verify(self, tokens: List[str], predicted_labels: List[str]) -> GroundingFeedback:
-        print(f"Running grounding engine on predicted labels: {predicted_labels}. Tokens: {tokens}")
         grounding_data = GroundingEngine._upadate_grounding_data(self.knowledge_base, tokens, predicted_labels, dict())
-        print(f"Running grounding engine. Grounding data: {grounding_data}")
+        logger.debug("Grounding predicted entities: %s", grounding_data)
         grounding_feedback = GroundingFeedback()
 
+        knowledge_base = self.knowledge_base
         for entity, predicted_tags in grounding_data.items():
-            grounded_tags = self.knowledge_base.data.get(entity)
-            if grounded_tags:
-                print(f"Grounded tags: {grounded_tags}")
-                diff = list(set(predicted_tags) - set(grounded_tags))
-                grounding_feedback.wrong[entity] = WrongPrediction(predicted_tags=diff, grounded_tags=grounded_tags)
-
+            known_mask = knowledge_base.get_mask(entity)
+            if known_mask:
+                counts = knowledge_base.get_counts(entity)
+                logger.debug("Grounded tag counts of '%s': %s", entity, counts)
+                confident_mask = self._get_confident_mask(counts)
+                wrong = list()
                 correct = list()
                 for tag in predicted_tags:
-                    if tag in grounded_tags:
+                    tag_bit = knowledge_base.get_label_bit(tag)
+                    if confident_mask & ~tag_bit:
+                        wrong.append(tag)
+                        grounding_feedback.wrong[entity] = WrongPrediction(
+                            predicted_tags=wrong,
+                            grounded_tags=self._to_grounded_tags(confident_mask & ~tag_bit, counts),
+                        )
+                    elif known_mask & tag_bit:
                         correct.append(tag)
                         grounding_feedback.correct[entity] = correct
+            elif self.fuzzy_max_distance is not None:
+                self._verify_fuzzy(entity, predicted_tags, grounding_feedback)
 
-        # print(f"Grounding feedback with correct tags included: {grounding_feedback.get_text_feedback()}")
         return grounding_feedback
 
+    def verify_many(self, tokens_batch: List[List[str]], labels_batch: List[List[str]], include_correct: bool = False) -> List[GroundingResult]:
+        # grounding results of every predicted span found in the knowledge base,
+        # grounded is empty for spans whose tag agrees with the knowledge base
+        spans = extract_spans_batch(labels_batch)
+
+        knowledge_base = self.knowledge_base
+        type_bits = [knowledge_base.get_label_bit(tag) for tag in spans.types]
+        span_rows = list(zip(spans.sentence_ids.tolist(), spans.starts.tolist(), spans.ends.tolist(), spans.type_ids.tolist()))
+        entities = [
+            knowledge_base.to_knowledge_key(tokens_batch[sentence_id][start:end])
+            for sentence_id, start, end, _ in span_rows
+        ]
+
+        # every distinct entity is looked up once, all in one batch.
+        # (known mask, confident mask, counts) of each of them
+        distinct_entities = list(dict.fromkeys(entities))
+        grounded: Dict[str, Tuple[int, int, Dict[str, int]]] = {
+            entity: (knowledge_base.to_mask(counts), self._get_confident_mask(counts), counts)
+            for entity, counts in zip(distinct_entities, knowledge_base.get_counts_many(distinct_entities))
+        }
+
+        results = list()
+        for (sentence_id, start, end, type_id), entity in zip(span_rows, entities):
+            known_mask, confident_mask, counts = grounded[entity]
+            if not known_mask:
+                continue
+
+            tag = spans.types[type_id]
+
+            wrong_mask = confident_mask & ~type_bits[type_id]
+            confident_tags = self._to_grounded_tags(wrong_mask, counts) if wrong_mask else []
+            if confident_tags or (include_correct and known_mask & type_bits[type_id]):
+                results.append(
+                    GroundingResult(
+                        index=sentence_id,
+                        start=start,
+                        end=end,
+                        entity=entity,
+                        predicted=tag,
+                        grounded=confident_tags,
+                    )
+                )
+
+        return results
+
+    def _verify_fuzzy(self, entity: str, predicted_tags: Set[str], grounding_feedback: GroundingFeedback) -> None:
+        matches = self.get_fuzzy_index().lookup(entity)
+        if not matches:
+            return
+
+        # the closest known variants vote together
+        matched_entity, distance = matches[0]
+        counts: Dict[str, int] = dict()
+        for key, key_distance in matches:
+            if key_distance == distance:
+                for tag, count in self.knowledge_base.get_counts(key).items():
+                    counts[tag] = counts.get(tag, 0) + count
+
+        total = sum(counts.values())
+        distribution = {tag: count / total for tag, count in counts.items()}
+        for tag in predicted_tags:
+            confident_tags = self._get_confident_tags(distribution, tag)
+            if confident_tags:
+                wrong = grounding_feedback.fuzzy[entity].predicted_tags if entity in grounding_feedback.fuzzy else []
+                grounding_feedback.fuzzy[entity] = FuzzyPrediction(
+                    predicted_tags=wrong + [tag],
+                    grounded_tags=confident_tags,
+                    matched_entity=matched_entity,
+                    distance=distance,
+                )
+
+    def _get_confident_mask(self, counts: Dict[str, int]) -> int:
+        # labels making up at least confidence_threshold of the counts of a key
+        total = sum(counts.values())
+        return self.knowledge_base.to_mask(
+            tag for tag, count in counts.items() if count / total >= self.confidence_threshold
+        )
+
+    def _to_grounded_tags(self, mask: int, counts: Dict[str, int]) -> List[str]:
+        return sorted(self.knowledge_base.to_labels(mask), key=lambda tag: -counts[tag])
+
+    def _get_confident_tags(self, distribution: Dict[str, float], predicted_tag: str) -> List[str]:
+        # labels other than the predicted one that the knowledge base is confident about
+        return sorted(
+            (
+                tag
+                for tag, probability in distribution.items()
+                if tag != predicted_tag and probability >= self.confidence_threshold
+            ),
+            key=lambda tag: -distribution[tag],
+        )
+
+    def reset_indexes(self) -> None:
+        # the mention automaton and the fuzzy index are rebuilt on next use
+        self._automaton = None
+        self._fuzzy_index = None
+
+    def get_automaton(self) -> GroundingAutomaton:
+        if self._automaton is None:
+            self._automaton = GroundingAutomaton.from_keys(
+                key.split(self.knowledge_base.token_separator)
+                for key in self.knowledge_base.keys()
+            )
+
+        return self._automaton
+
+    def get_fuzzy_index(self) -> FuzzyIndex:
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyIndex.from_keys(
+                self.knowledge_base.keys(),
+                self.fuzzy_max_distance or 0,
+                self.knowledge_base.token_separator,
+            )
+
+        return self._fuzzy_index
+
+    def find_mentions(self, tokens: List[str], longest_only: bool = True) -> List[CandidateSpan]:
+        lowercase_tokens = [token.lower() for token in tokens]
+        matches = self.get_automaton().find(lowercase_tokens)
+
+        if longest_only:
+            # leftmost-longest, non-overlapping matches
+            selected = list()
+            end_of_previous = 0
+            for start, end in sorted(matches, key=lambda match: (match[0], -match[1])):
+                if start >= end_of_previous:
+                    selected.append((start, end))
+                    end_of_previous = end
+            matches = selected
+
+        candidates = list()
+        for start, end in sorted(matches):
+            entity = self.knowledge_base.to_knowledge_key(tokens[start:end])
+            candidates.append(
+                CandidateSpan(
+                    start=start,
+                    end=end,
+                    entity=entity,
+                    grounded_tags=sorted(self.knowledge_base.get(entity) or []),
+                )
+            )
+
+        return candidates
+
+    def pre_annotate(self, tokens: List[str]) -> List[str]:
+        # only mentions grounded to a single entity type are annotated
+        labels = ["O"] * len(tokens)
+        for candidate in self.find_mentions(tokens):
+            if len(candidate.grounded_tags) == 1:
+                tag = candidate.grounded_tags[0]
+                labels[candidate.start] = f"B-{tag}"
+                for i in range(candidate.start + 1, candidate.end):
+                    labels[i] = f"I-{tag}"
+
+        return labels
+
+    def get_text_hints(self, tokens: List[str]) -> str:
+        hints = ""
+        for candidate in self.find_mentions(tokens):
+            entity = " ".join(tokens[candidate.start : candidate.end])
+            hints += f"- '{entity}' is known as {' or '.join(candidate.grounded_tags)}\n"
+
+        return hints
 
 
 if __name__ == "__main__":
@@ -106,7 +435,7 @@ if __name__ == "__main__":
     print("Building Grounding Engine from Genia dataset")
     grounding_engine = GroundingEngine.from_ner_dataset(dataset)
 
-    print(grounding_engine.knowledge_base.data)
+    print(f"Labels: {grounding_engine.knowledge_base.labels}, keys: {len(grounding_engine.knowledge_base)}")
 
     print("Testing grounding engine.")
 
@@ -116,3 +445,48 @@ if __name__ == "__main__":
 
     feedback = grounding_engine.verify(tokens, prediction)
     print(f"Feedback: {feedback.get_text_feedback(include_correct=True)}")
+
+    print(f"Mentions found in the sentence: {grounding_engine.find_mentions(tokens)}")
+    print(f"Pre-annotated labels: {grounding_engine.pre_annotate(tokens)}")
+
+    print("Benchmarking fuzzy lookups on the Genia knowledge base")
+    grounding_engine.fuzzy_max_distance = 1
+    start = time.perf_counter()
+    fuzzy_index = grounding_engine.get_fuzzy_index()
+    print(f"Built fuzzy index in {time.perf_counter() - start:.2f}s")
+
+    keys = list(grounding_engine.knowledge_base.keys())
+    queries = ["ikb-alpha", "ikb___alpha", "nf-kappa___b", "il-2___receptors"]
+    queries += [key[:-1] for key in keys[:1000]]
+    start = time.perf_counter()
+    hits = sum(bool(fuzzy_index.lookup(query)) for query in queries)
+    elapsed = (time.perf_counter() - start) / len(queries)
+    print(f"{hits}/{len(queries)} fuzzy lookups hit, {elapsed * 1000:.3f}ms per lookup")
+
+    feedback = grounding_engine.verify(["IkB-alpha", "phosphorylation"], ["B-DNA", "O"])
+    print(f"Fuzzy feedback: {feedback.get_text_feedback()}")
+
+    print("Benchmarking knowledge base memory against per-key label sets")
+    entities = [
+        entity
+        for entry in dataset.entries
+        for entity in GroundingEngine._get_entities(grounding_engine.knowledge_base, entry.tokens, entry.labels)
+    ]
+
+    tracemalloc.start()
+    label_sets: Dict[str, Set[str]] = dict()
+    for knowledge_key, label in entities:
+        label_sets.setdefault(knowledge_key, set()).add(label)
+    label_sets_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del label_sets
+
+    tracemalloc.start()
+    # the structure the engine actually keeps, counts included
+    knowledge_base = GroundingKnowledgeBase()
+    for knowledge_key, label in entities:
+        knowledge_base.add(knowledge_key, label)
+    knowledge_base_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Label sets: {label_sets_memory / 2**20:.2f}MiB, knowledge base with counts: {knowledge_base_memory / 2**20:.2f}MiB")
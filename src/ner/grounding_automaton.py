@@ -0,0 +1,69 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Tuple
+
+
+@dataclass
+class GroundingAutomaton:
+    # token-level Aho-Corasick automaton, state 0 is the root
+    transitions: List[Dict[str, int]] = field(default_factory=lambda: [dict()])
+    failures: List[int] = field(default_factory=lambda: [0])
+    # lengths (in tokens) of the keys ending in each state, including the ones
+    # reachable through failure links
+    outputs: List[List[int]] = field(default_factory=lambda: [list()])
+
+    @staticmethod
+    def from_keys(keys: Iterable[List[str]]) -> "GroundingAutomaton":
+        automaton = GroundingAutomaton()
+        for key in keys:
+            automaton._add(key)
+
+        automaton._build_failures()
+        return automaton
+
+    def _add(self, tokens: List[str]) -> None:
+        if not tokens:
+            return
+
+        state = 0
+        for token in tokens:
+            next_state = self.transitions[state].get(token)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions[state][token] = next_state
+                self.transitions.append(dict())
+                self.failures.append(0)
+                self.outputs.append(list())
+            state = next_state
+
+        if len(tokens) not in self.outputs[state]:
+            self.outputs[state].append(len(tokens))
+
+    def _build_failures(self) -> None:
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self.transitions[state].items():
+                queue.append(next_state)
+
+                failure = self.failures[state]
+                while failure and token not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(token, 0)
+
+                self.failures[next_state] = failure
+                self.outputs[next_state].extend(self.outputs[failure])
+
+    def find(self, tokens: List[str]) -> List[Tuple[int, int]]:
+        # every (start, end) token span of tokens that is a key, in one pass
+        matches = list()
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and token not in self.transitions[state]:
+                state = self.failures[state]
+            state = self.transitions[state].get(token, 0)
+
+            for length in self.outputs[state]:
+                matches.append((i + 1 - length, i + 1))
+
+        return matches
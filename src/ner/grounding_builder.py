@@ -0,0 +1,268 @@
+import heapq
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby, islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import click
+
+from ner.eval.dataset import NERDataset
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+from ner.grounding_store import StoredEntry, load_grounding_engine, load_knowledge_base, write_entries
+
+
+# sentences counted per run, bounds the memory of each worker
+RUN_SIZE = 20_000
+# runs merged at once, more runs are first merged into larger ones
+MERGE_FAN_IN = 64
+
+# a run is a text file of "key<TAB>label<TAB>count" lines sorted by key and
+# label. Keys are lowercased tokens joined by the token separator and never
+# contain tabs or newlines.
+RunRecord = Tuple[str, str, int]
+
+
+def iter_examples(*datasets: NERDataset) -> Iterator[Tuple[List[str], List[str]]]:
+    for dataset in datasets:
+        for entry in dataset.entries:
+            yield entry.tokens, entry.labels
+
+
+def _write_run(records: Iterable[RunRecord], directory: str) -> str:
+    file_descriptor, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+        for key, label, count in records:
+            file.write(f"{key}\t{label}\t{count}\n")
+
+    return path
+
+
+def _read_run(path: str) -> Iterator[RunRecord]:
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            key, label, count = line.rstrip("\n").split("\t")
+            yield key, label, int(count)
+
+
+def _count_run(
+    examples: List[Tuple[List[str], List[str]]], token_separator: str, directory: str
+) -> Tuple[str, List[str]]:
+    # counts one run of sentences, returns the run file and the labels in
+    # the order they were first seen
+    knowledge_base = GroundingKnowledgeBase(token_separator=token_separator)
+    counts: Counter = Counter()
+    labels: List[str] = list()
+    for tokens, iob2_labels in examples:
+        for entity in GroundingEngine._get_entities(knowledge_base, tokens, iob2_labels):
+            if entity[1] not in labels:
+                labels.append(entity[1])
+            counts[entity] += 1
+
+    records = ((key, label, count) for (key, label), count in sorted(counts.items()))
+    return _write_run(records, directory), labels
+
+
+def merge_runs(paths: List[str]) -> Iterator[RunRecord]:
+    # k-way merge of sorted runs, counts of the same key and label are summed
+    merged = heapq.merge(*(_read_run(path) for path in paths))
+    for (key, label), records in groupby(merged, key=lambda record: record[:2]):
+        yield key, label, sum(record[2] for record in records)
+
+
+def _merge_to_fan_in(paths: List[str], directory: str) -> List[str]:
+    # merge passes until at most MERGE_FAN_IN runs are left, so the final
+    # merge never holds more open files than that
+    while len(paths) > MERGE_FAN_IN:
+        merged_paths = list()
+        for i in range(0, len(paths), MERGE_FAN_IN):
+            group = paths[i : i + MERGE_FAN_IN]
+            merged_paths.append(_write_run(merge_runs(group), directory))
+            for path in group:
+                os.remove(path)
+        paths = merged_paths
+
+    return paths
+
+
+def _count_runs(
+    examples: Iterable[Tuple[List[str], List[str]]],
+    token_separator: str,
+    run_size: int,
+    max_workers: Optional[int],
+    run_directory: str,
+) -> Tuple[List[str], List[str]]:
+    # counts the sentences in sorted runs, returns at most MERGE_FAN_IN runs
+    # and the labels in the order they were first seen
+    iterator = iter(examples)
+    runs: List[Tuple[str, List[str]]] = list()
+    if max_workers == 1:
+        while run := list(islice(iterator, run_size)):
+            runs.append(_count_run(run, token_separator, run_directory))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # a few runs per worker in flight keeps the reader ahead of
+            # the workers without buffering the whole corpus
+            max_pending = 2 * (max_workers or os.cpu_count() or 1)
+            pending: List[Future] = list()
+            while run := list(islice(iterator, run_size)):
+                pending.append(
+                    executor.submit(_count_run, run, token_separator, run_directory)
+                )
+                if len(pending) >= max_pending:
+                    runs.append(pending.pop(0).result())
+            runs.extend(future.result() for future in pending)
+
+    # runs are in corpus order, so labels keep their first-seen order
+    labels: List[str] = list()
+    for _, run_labels in runs:
+        for label in run_labels:
+            if label not in labels:
+                labels.append(label)
+
+    return _merge_to_fan_in([path for path, _ in runs], run_directory), labels
+
+
+def build_knowledge_base(
+    examples: Iterable[Tuple[List[str], List[str]]],
+    token_separator: str = "___",
+    run_size: int = RUN_SIZE,
+    max_workers: Optional[int] = None,
+    directory: Optional[str] = None,
+) -> GroundingKnowledgeBase:
+    # same knowledge base as GroundingEngine.from_ner_dataset over the same
+    # sentences, without holding them all in memory. Runs are counted in
+    # worker processes, max_workers=1 counts them in this process.
+    with tempfile.TemporaryDirectory(dir=directory) as run_directory:
+        paths, labels = _count_runs(examples, token_separator, run_size, max_workers, run_directory)
+        knowledge_base = GroundingKnowledgeBase(token_separator=token_separator, labels=labels)
+        for key, label, count in merge_runs(paths):
+            knowledge_base.add(key, label, count)
+
+    return knowledge_base
+
+
+def write_built_knowledge_base(
+    examples: Iterable[Tuple[List[str], List[str]]],
+    path: str,
+    token_separator: str = "___",
+    run_size: int = RUN_SIZE,
+    max_workers: Optional[int] = None,
+    directory: Optional[str] = None,
+) -> int:
+    # like build_knowledge_base, but the merged runs are written straight to
+    # a knowledge base file, so no knowledge base is ever held in memory.
+    # Returns the number of keys written
+    with tempfile.TemporaryDirectory(dir=directory) as run_directory:
+        paths, labels = _count_runs(examples, token_separator, run_size, max_workers, run_directory)
+        written = 0
+
+        def entries() -> Iterator[StoredEntry]:
+            nonlocal written
+            # runs are sorted by code point, the same order as bytewise UTF-8
+            for key, records in groupby(merge_runs(paths), key=lambda record: record[0]):
+                written += 1
+                yield key, {label: count for _, label, count in records}, None
+
+        write_entries(entries(), labels, path, token_separator)
+
+    return written
+
+
+def load_dev_dataset(benchmark: str) -> NERDataset:
+    # same splits the eval runners build their grounding engines from
+    if benchmark == "genia":
+        return NERDataset.from_genia("train")
+    if benchmark == "music":
+        return NERDataset.from_musicner(path="data/music_reco_ner/train.bio")
+    if benchmark == "buster":
+        return NERDataset.from_buster("FOLD_1")
+    return NERDataset.from_astroner(path="data/astro_ner/train.json")
+
+
+@click.command()
+@click.option(
+    "--benchmark",
+    type=click.Choice(["genia", "music", "buster", "astro"]),
+    required=True,
+    help="Benchmark whose dev split the knowledge base is built from",
+)
+@click.option("--output", required=True, help="Path of the knowledge base file")
+@click.option("--run-size", type=int, default=RUN_SIZE, help="Sentences counted per run")
+@click.option("--max-workers", type=int, default=None, help="Processes counting runs, 1 counts in this process")
+def main(benchmark: str, output: str, run_size: int, max_workers: Optional[int]):
+    """Build the grounding knowledge base once and store it on disk.
+
+    Example:
+        python grounding_builder.py --benchmark genia --output kb/genia.kb
+    """
+    dataset = load_dev_dataset(benchmark)
+
+    start = time.perf_counter()
+    written = write_built_knowledge_base(
+        iter_examples(dataset), output, run_size=run_size, max_workers=max_workers
+    )
+    click.echo(f"Wrote {written} keys to {output} in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    mapped = load_grounding_engine(output)
+    click.echo(
+        f"Reopened {len(mapped.knowledge_base)} keys in {(time.perf_counter() - start) * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main()
+        sys.exit()
+
+    import tracemalloc
+
+    print("Loading Genia dataset")
+    dataset = NERDataset.from_genia("train")
+
+    start = time.perf_counter()
+    expected = GroundingEngine.from_ner_dataset(dataset).knowledge_base
+    print(f"In-memory build: {time.perf_counter() - start:.2f}s")
+
+    # a corpus many times larger than the dataset, streamed
+    def corpus(repeats: int) -> Iterator[Tuple[List[str], List[str]]]:
+        for _ in range(repeats):
+            yield from iter_examples(dataset)
+
+    for repeats in [1, 10]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        knowledge_base = build_knowledge_base(corpus(repeats), run_size=5000)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"Streaming build of {repeats * len(dataset.entries)} sentences: {elapsed:.2f}s, peak memory {peak / 2**20:.1f}MiB"
+        )
+
+    assert knowledge_base.labels == expected.labels
+    assert {key: knowledge_base.get_mask(key) for key in knowledge_base.keys()} == {key: expected.get_mask(key) for key in expected.keys()}
+    assert all(
+        {label: 10 * count for label, count in expected.get_counts(key).items()}
+        == knowledge_base.get_counts(key)
+        for key in expected.keys()
+    )
+    print("Streaming build matches the in-memory knowledge base")
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        path = os.path.join(output_directory, "genia.kb")
+        tracemalloc.start()
+        start = time.perf_counter()
+        written = write_built_knowledge_base(corpus(10), path, run_size=5000)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Streaming write of {written} keys: {elapsed:.2f}s, peak memory {peak / 2**20:.1f}MiB")
+
+        stored = load_knowledge_base(path)
+        assert all(stored.get_counts(key) == knowledge_base.get_counts(key) for key in knowledge_base.keys())
+        print("Written file matches the streamed knowledge base")
@@ -0,0 +1,119 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+# variants shorter than this only match when they normalize to the same key,
+# e.g. 'IL-2' and 'IL-4' are one edit apart but different entities
+FUZZY_MIN_LENGTH = 5
+
+
+def normalize_key(knowledge_key: str, token_separator: str = "___") -> str:
+    # 'IkB alpha', 'IkB-alpha' and 'ikbalpha' share the normalized key 'ikbalpha'
+    return "".join(
+        c for c in knowledge_key.replace(token_separator, "").lower() if c.isalnum()
+    )
+
+
+def get_deletes(word: str, max_distance: int) -> Set[str]:
+    deletes = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {
+            candidate[:i] + candidate[i + 1 :]
+            for candidate in frontier
+            for i in range(len(candidate))
+        }
+        deletes |= frontier
+
+    return deletes
+
+
+def get_edit_distance(first: str, second: str, max_distance: int) -> int:
+    # optimal string alignment distance, returns max_distance + 1 when exceeded
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+
+    previous_previous: List[int] = []
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                i > 1
+                and j > 1
+                and first[i - 1] == second[j - 2]
+                and first[i - 2] == second[j - 1]
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+
+    return min(previous[-1], max_distance + 1)
+
+
+@dataclass
+class FuzzyIndex:
+    # SymSpell index: every deletion variant of a normalized key points back to it
+    max_distance: int
+    token_separator: str = "___"
+    keys_by_normalized_key: Dict[str, List[str]] = field(default_factory=dict)
+    normalized_keys_by_delete: Dict[str, List[str]] = field(default_factory=dict)
+
+    @staticmethod
+    def from_keys(
+        keys: Iterable[str], max_distance: int = 1, token_separator: str = "___"
+    ) -> "FuzzyIndex":
+        index = FuzzyIndex(max_distance=max_distance, token_separator=token_separator)
+        for key in keys:
+            normalized_key = normalize_key(key, token_separator)
+            if not normalized_key:
+                continue
+
+            if normalized_key not in index.keys_by_normalized_key:
+                index.keys_by_normalized_key[normalized_key] = list()
+                distance = max_distance if len(normalized_key) >= FUZZY_MIN_LENGTH else 0
+                for delete in get_deletes(normalized_key, distance):
+                    index.normalized_keys_by_delete.setdefault(delete, list()).append(
+                        normalized_key
+                    )
+            index.keys_by_normalized_key[normalized_key].append(key)
+
+        return index
+
+    def lookup(self, knowledge_key: str) -> List[Tuple[str, int]]:
+        # (key, edit distance) of every indexed key within max_distance of the
+        # normalized query, closest first
+        normalized_query = normalize_key(knowledge_key, self.token_separator)
+        if not normalized_query:
+            return list()
+
+        distance = (
+            self.max_distance if len(normalized_query) >= FUZZY_MIN_LENGTH else 0
+        )
+        distances: Dict[str, int] = dict()
+        for delete in get_deletes(normalized_query, distance):
+            for candidate in self.normalized_keys_by_delete.get(delete, []):
+                if candidate in distances:
+                    continue
+                candidate_distance = get_edit_distance(
+                    normalized_query, candidate, distance
+                )
+                if candidate_distance <= distance:
+                    distances[candidate] = candidate_distance
+
+        matches = list()
+        for candidate, candidate_distance in sorted(
+            distances.items(), key=lambda item: (item[1], item[0])
+        ):
+            for key in self.keys_by_normalized_key[candidate]:
+                if key != knowledge_key:
+                    matches.append((key, candidate_distance))
+
+        return matches
+
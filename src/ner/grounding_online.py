@@ -0,0 +1,221 @@
+import hashlib
+import heapq
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+from pydantic import PrivateAttr
+
+from ner.grounding import GroundingEngine
+from ner.grounding_store import (
+    MappedGroundingKnowledgeBase,
+    load_knowledge_base,
+    write_knowledge_base,
+)
+
+
+@dataclass
+class CountMinSketch:
+    # approximate counts of candidate entities in fixed memory, estimates
+    # never undercount and overcount by at most 2 * total / width w.h.p.
+    width: int = 1 << 16
+    depth: int = 4
+    table: np.ndarray = field(init=False)
+    total: int = 0
+
+    def __post_init__(self):
+        # every row takes 8 bytes of one blake2b digest, which has at most 64
+        if not 1 <= self.depth <= 8:
+            raise ValueError(f"The sketch depth must be between 1 and 8, got {self.depth}")
+        self.table = np.zeros((self.depth, self.width), dtype=np.uint32)
+        self._rows = np.arange(self.depth)
+
+    def _columns(self, item: str) -> np.ndarray:
+        # a stable hash, unlike hash() it does not change between processes,
+        # so counts of a resumed run land in the same columns
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=8 * self.depth).digest()
+        return np.frombuffer(digest, dtype="<u8") % self.width
+
+    def add(self, item: str, count: int = 1) -> int:
+        # conservative update: only the cells at the current minimum grow
+        columns = self._columns(item)
+        cells = self.table[self._rows, columns]
+        estimate = int(cells.min()) + count
+        self.table[self._rows, columns] = np.maximum(cells, estimate)
+        self.total += count
+        return estimate
+
+    def estimate(self, item: str) -> int:
+        return int(self.table[self._rows, self._columns(item)].min())
+
+    def decay(self) -> None:
+        # halving every counter lets candidates that stopped recurring fade out
+        self.table >>= 1
+        self.total //= 2
+
+
+class OnlineGroundingEngine(GroundingEngine):
+    # grounding engine that keeps learning from accepted predictions. Entities
+    # already in the knowledge base are updated directly, new ones are counted
+    # in a sketch and only promoted once they were accepted min_support times
+    min_support: int = 3
+    sketch_width: int = 1 << 16
+    sketch_depth: int = 4
+    # sketch counters are halved after this many candidate updates
+    sketch_decay_interval: int = 100_000
+    # bound on the entries learned online, entries built offline are never evicted
+    max_online_entries: int = 50_000
+    # online entries not seen for this long are evicted unless well supported
+    max_age_seconds: float = 7 * 24 * 3600
+    keep_support: int = 10
+    snapshot_path: Optional[str] = None
+    snapshot_interval_seconds: float = 300
+
+    _sketch: Optional[CountMinSketch] = PrivateAttr(default=None)
+    # on the clock of the accepted timestamps, set by the first accept
+    _last_snapshot: Optional[float] = PrivateAttr(default=None)
+    _accepted: int = PrivateAttr(default=0)
+    _updated: int = PrivateAttr(default=0)
+    _promoted: int = PrivateAttr(default=0)
+    _evicted: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context) -> None:
+        if isinstance(self.knowledge_base, MappedGroundingKnowledgeBase):
+            raise TypeError(
+                "Online grounding updates its knowledge base, a mapped one is read-only: use load_knowledge_base for a mutable copy"
+            )
+        self._sketch = CountMinSketch(width=self.sketch_width, depth=self.sketch_depth)
+
+    @staticmethod
+    def from_snapshot(path: str, **kwargs) -> "OnlineGroundingEngine":
+        return OnlineGroundingEngine(
+            knowledge_base=load_knowledge_base(path), snapshot_path=path, **kwargs
+        )
+
+    def accept(self, tokens: List[str], labels: List[str], timestamp: Optional[float] = None) -> None:
+        # labels are IOB2 labels of a prediction that was verified or agreed on.
+        # timestamp is the caller's clock, it also times the snapshots
+        now = timestamp if timestamp is not None else time.time()
+        if self._last_snapshot is None:
+            self._last_snapshot = now
+        knowledge_base = self.knowledge_base
+        new_keys = False
+        self._accepted += 1
+
+        for knowledge_key, label in GroundingEngine._get_entities(knowledge_base, tokens, labels):
+            # keys built offline stay without a timestamp so they are never evicted
+            mask = knowledge_base.get_mask(knowledge_key)
+            offline = mask != 0 and knowledge_base.get_last_seen(knowledge_key) is None
+            if mask & knowledge_base.get_label_bit(label):
+                knowledge_base.add(knowledge_key, label, timestamp=None if offline else now)
+                self._updated += 1
+                continue
+
+            # new keys and new labels of known keys both need min_support
+            support = self._sketch.add(f"{label}\t{knowledge_key}")
+            if self._sketch.total >= self.sketch_decay_interval:
+                self._sketch.decay()
+            if support >= self.min_support:
+                knowledge_base.add(knowledge_key, label, count=support, timestamp=None if offline else now)
+                self._promoted += 1
+                new_keys = new_keys or mask == 0
+
+        if len(knowledge_base.last_seen) > self.max_online_entries:
+            self.evict(now)
+            new_keys = True
+        if new_keys:
+            self.reset_indexes()
+
+        if self.snapshot_path and now - self._last_snapshot >= self.snapshot_interval_seconds:
+            self.evict(now)
+            self.snapshot(now=now)
+
+    def evict(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        knowledge_base = self.knowledge_base
+
+        entries: List[Tuple[int, float, str]] = [
+            (sum(knowledge_base.get_counts(key).values()), last_seen, key)
+            for key, last_seen in knowledge_base.last_seen.items()
+        ]
+        evicted = [
+            key
+            for support, last_seen, key in entries
+            if now - last_seen > self.max_age_seconds and support < self.keep_support
+        ]
+        # over the bound, the least supported and oldest entries go first
+        # until a tenth of the space is free again
+        excess = len(entries) - len(evicted) - int(self.max_online_entries * 0.9)
+        if excess > 0:
+            stale = set(evicted)
+            evicted += [
+                key
+                for _, _, key in heapq.nsmallest(
+                    excess, (entry for entry in entries if entry[2] not in stale)
+                )
+            ]
+
+        for key in evicted:
+            knowledge_base.remove(key)
+        if evicted:
+            self.reset_indexes()
+        self._evicted += len(evicted)
+
+        return len(evicted)
+
+    def snapshot(self, path: Optional[str] = None, now: Optional[float] = None) -> None:
+        # written next to the target and renamed, so readers that mapped the
+        # previous snapshot keep a consistent file
+        path = path or self.snapshot_path
+        if not path:
+            raise ValueError("No snapshot path given")
+
+        temporary_path = f"{path}.tmp"
+        write_knowledge_base(self.knowledge_base, temporary_path)
+        os.replace(temporary_path, path)
+        self._last_snapshot = now if now is not None else time.time()
+
+    def report(self) -> str:
+        return f"Online grounding: accepted {self._accepted} predictions, updated {self._updated} known entities, promoted {self._promoted} new entities, evicted {self._evicted}, {len(self.knowledge_base.last_seen)} online entries"
+
+
+if __name__ == "__main__":
+    from ner.eval.dataset import NERDataset
+
+    print("Loading Genia dataset")
+    train = NERDataset.from_genia("train")
+    test = NERDataset.from_genia("test")
+
+    random.seed(43)
+    entries = random.sample(train.entries, len(train.entries) // 2)
+    engine = OnlineGroundingEngine(snapshot_path="/tmp/online_genia.kb", max_online_entries=5000)
+    for entry in entries[:1000]:
+        for knowledge_key, label in GroundingEngine._get_entities(engine.knowledge_base, entry.tokens, entry.labels):
+            engine.knowledge_base.add(knowledge_key, label)
+    print(f"Offline knowledge base: {len(engine.knowledge_base)} keys")
+
+    def coverage() -> float:
+        found = total = 0
+        for entry in test.entries:
+            for knowledge_key, _ in GroundingEngine._get_entities(engine.knowledge_base, entry.tokens, entry.labels):
+                total += 1
+                found += engine.knowledge_base.get(knowledge_key) is not None
+        return found / total
+
+    print(f"Test entities found in the knowledge base: {coverage():.3f}")
+
+    # the remaining gold sentences stand in for a stream of accepted predictions
+    start = time.perf_counter()
+    for i, entry in enumerate(entries[1000:]):
+        engine.accept(entry.tokens, entry.labels, timestamp=1_000_000 + i)
+    elapsed = time.perf_counter() - start
+    print(f"Accepted {len(entries) - 1000} sentences in {elapsed:.2f}s ({elapsed / (len(entries) - 1000) * 1e6:.0f}us per sentence)")
+    print(engine.report())
+    print(f"Test entities found in the knowledge base: {coverage():.3f}")
+
+    engine.snapshot()
+    resumed = OnlineGroundingEngine.from_snapshot("/tmp/online_genia.kb")
+    print(f"Resumed {len(resumed.knowledge_base)} keys, {len(resumed.knowledge_base.last_seen)} online entries from the snapshot")
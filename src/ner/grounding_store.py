@@ -0,0 +1,267 @@
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pydantic import PrivateAttr
+
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+
+
+# File layout, all integers little-endian:
+#   magic (8 bytes) | header length (uint32) | JSON header | padding to 8 bytes
+#   key offsets (uint64, n_keys + 1) | label masks (uint64, n_keys)
+#   last seen timestamps (float64, n_keys, NaN for keys built offline)
+#   label counts (uint32, n_keys x n_labels) | key blob
+# Keys are UTF-8 encoded and sorted bytewise, so lookups are a binary search.
+MAGIC = b"NERKB\x00\x00\x03"
+ALIGNMENT = 8
+
+
+# keys buffered per write of each section by write_entries
+WRITE_CHUNK = 65_536
+
+# a stored entry: key, counts per label and the timestamp of online entries
+StoredEntry = Tuple[str, Dict[str, int], Optional[float]]
+
+
+def write_knowledge_base(knowledge_base: GroundingKnowledgeBase, path: str) -> None:
+    used_mask = 0
+    for key in knowledge_base.keys():
+        used_mask |= knowledge_base.get_mask(key)
+
+    keys = sorted(knowledge_base.keys(), key=lambda key: key.encode("utf-8"))
+    write_entries(
+        ((key, knowledge_base.get_counts(key), knowledge_base.get_last_seen(key)) for key in keys),
+        knowledge_base.to_labels(used_mask),
+        path,
+        knowledge_base.token_separator,
+    )
+
+
+def write_entries(
+    entries: Iterable[StoredEntry], labels: Iterable[str], path: str, token_separator: str = "___"
+) -> None:
+    # writes entries sorted bytewise by their UTF-8 keys without holding them
+    # in memory. Each section goes to its own temporary file first, as the
+    # header needs the number of keys
+    labels = sorted(labels)
+    if len(labels) > 64:
+        raise ValueError(f"At most 64 entity types can be stored, got {len(labels)}")
+    label_ids = {label: i for i, label in enumerate(labels)}
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as directory:
+        sections = [
+            open(os.path.join(directory, name), "w+b")
+            for name in ["offsets", "masks", "last_seen", "counts", "keys"]
+        ]
+        offsets_file, masks_file, last_seen_file, counts_file, keys_file = sections
+        try:
+            n_keys = 0
+            offset = 0
+            previous_key = None
+            offsets_file.write(np.zeros(1, dtype="<u8").tobytes())
+            iterator = iter(entries)
+            while chunk := list(islice(iterator, WRITE_CHUNK)):
+                offsets = np.zeros(len(chunk), dtype="<u8")
+                masks = np.zeros(len(chunk), dtype="<u8")
+                last_seen = np.full(len(chunk), np.nan, dtype="<f8")
+                counts = np.zeros((len(chunk), len(labels)), dtype="<u4")
+                for i, (key, key_counts, timestamp) in enumerate(chunk):
+                    encoded_key = key.encode("utf-8")
+                    if previous_key is not None and encoded_key <= previous_key:
+                        raise ValueError(f"Entries are not sorted by key: '{key}'")
+                    previous_key = encoded_key
+                    keys_file.write(encoded_key)
+                    offset += len(encoded_key)
+                    offsets[i] = offset
+                    for label, count in key_counts.items():
+                        masks[i] |= 1 << label_ids[label]
+                        counts[i, label_ids[label]] = count
+                    if timestamp is not None:
+                        last_seen[i] = timestamp
+                offsets_file.write(offsets.tobytes())
+                masks_file.write(masks.tobytes())
+                last_seen_file.write(last_seen.tobytes())
+                counts_file.write(counts.tobytes())
+                n_keys += len(chunk)
+
+            header = json.dumps(
+                {
+                    "token_separator": token_separator,
+                    "labels": labels,
+                    "n_keys": n_keys,
+                }
+            ).encode("utf-8")
+            header_end = len(MAGIC) + 4 + len(header)
+            padding = b"\x00" * (-header_end % ALIGNMENT)
+
+            with open(path, "wb") as file:
+                file.write(MAGIC)
+                file.write(struct.pack("<I", len(header)))
+                file.write(header)
+                file.write(padding)
+                for section in sections:
+                    section.seek(0)
+                    shutil.copyfileobj(section, file)
+        finally:
+            for section in sections:
+                section.close()
+
+
+class MappedGroundingKnowledgeBase(GroundingKnowledgeBase):
+    # read-only knowledge base backed by a memory-mapped file, the pages are
+    # shared by every process that opens the same file
+    path: str
+
+    _mmap: Any = PrivateAttr(default=None)
+    _offsets: Any = PrivateAttr(default=None)
+    _masks: Any = PrivateAttr(default=None)
+    _last_seen: Any = PrivateAttr(default=None)
+    _label_counts: Any = PrivateAttr(default=None)
+    _blob_start: int = PrivateAttr(default=0)
+
+    @staticmethod
+    def open(path: str) -> "MappedGroundingKnowledgeBase":
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a grounding knowledge base file")
+        if sys.byteorder != "little":
+            raise ValueError("Mapped knowledge bases are only supported on little-endian hosts")
+
+        (header_length,) = struct.unpack_from("<I", mapped, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(mapped[header_start : header_start + header_length])
+        n_keys = header["n_keys"]
+
+        offsets_start = header_start + header_length
+        offsets_start += -offsets_start % ALIGNMENT
+        masks_start = offsets_start + (n_keys + 1) * 8
+        last_seen_start = masks_start + n_keys * 8
+        counts_start = last_seen_start + n_keys * 8
+        blob_start = counts_start + n_keys * len(header["labels"]) * 4
+
+        knowledge_base = MappedGroundingKnowledgeBase(
+            path=path,
+            labels=header["labels"],
+            token_separator=header["token_separator"],
+        )
+        # memoryviews index to plain ints without copying the mapped pages
+        view = memoryview(mapped)
+        knowledge_base._mmap = mapped
+        knowledge_base._offsets = view[offsets_start:masks_start].cast("Q")
+        knowledge_base._masks = view[masks_start:last_seen_start].cast("Q")
+        knowledge_base._last_seen = view[last_seen_start:counts_start].cast("d")
+        knowledge_base._label_counts = view[counts_start:blob_start].cast("I")
+        knowledge_base._blob_start = blob_start
+
+        return knowledge_base
+
+    def __reduce__(self):
+        # worker processes map the same file instead of copying the data
+        return (MappedGroundingKnowledgeBase.open, (self.path,))
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def _key_at(self, i: int) -> bytes:
+        start = self._blob_start + self._offsets[i]
+        end = self._blob_start + self._offsets[i + 1]
+        return self._mmap[start:end]
+
+    def _search(self, encoded_key: bytes, low: int = 0) -> int:
+        # position of the first key not below encoded_key, from low on
+        mapped, offsets, blob_start = self._mmap, self._offsets, self._blob_start
+        high = len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            key = mapped[blob_start + offsets[middle] : blob_start + offsets[middle + 1]]
+            if key < encoded_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def _find(self, knowledge_key: str) -> int:
+        encoded_key = knowledge_key.encode("utf-8")
+        i = self._search(encoded_key)
+        if i < len(self) and self._key_at(i) == encoded_key:
+            return i
+        return -1
+
+    def _get_counts_at(self, i: int) -> Dict[str, int]:
+        n_labels = len(self.labels)
+        row = self._label_counts[i * n_labels : (i + 1) * n_labels]
+        return {self.labels[j]: count for j, count in enumerate(row) if count}
+
+    def get_mask(self, knowledge_key: str) -> int:
+        i = self._find(knowledge_key)
+        return 0 if i == -1 else self._masks[i]
+
+    def get_counts(self, knowledge_key: str) -> Dict[str, int]:
+        i = self._find(knowledge_key)
+        return dict() if i == -1 else self._get_counts_at(i)
+
+    def get_counts_many(self, knowledge_keys: List[str]) -> List[Dict[str, int]]:
+        # the keys are looked up in sorted order, so every binary search only
+        # covers the part of the file after the previous key
+        encoded_keys = [knowledge_key.encode("utf-8") for knowledge_key in knowledge_keys]
+        counts: List[Dict[str, int]] = [dict() for _ in knowledge_keys]
+        low = 0
+        for i in sorted(range(len(encoded_keys)), key=encoded_keys.__getitem__):
+            low = self._search(encoded_keys[i], low)
+            if low < len(self) and self._key_at(low) == encoded_keys[i]:
+                counts[i] = self._get_counts_at(low)
+
+        return counts
+
+    def get_last_seen(self, knowledge_key: str) -> Optional[float]:
+        i = self._find(knowledge_key)
+        if i == -1 or math.isnan(self._last_seen[i]):
+            return None
+        return self._last_seen[i]
+
+    def add(self, knowledge_key: str, label: str, count: int = 1, timestamp: Optional[float] = None) -> None:
+        raise TypeError("Mapped knowledge bases are read-only, use load_knowledge_base for a mutable copy")
+
+    def remove(self, knowledge_key: str) -> None:
+        raise TypeError("Mapped knowledge bases are read-only, use load_knowledge_base for a mutable copy")
+
+    def keys(self) -> Iterable[str]:
+        for i in range(len(self)):
+            yield self._key_at(i).decode("utf-8")
+
+
+def load_knowledge_base(path: str) -> GroundingKnowledgeBase:
+    # in-memory copy of a stored knowledge base that can be updated again
+    mapped = MappedGroundingKnowledgeBase.open(path)
+    knowledge_base = GroundingKnowledgeBase(token_separator=mapped.token_separator)
+    n_labels = len(mapped.labels)
+    for i in range(len(mapped)):
+        key = mapped._key_at(i).decode("utf-8")
+        row = mapped._label_counts[i * n_labels : (i + 1) * n_labels]
+        timestamp = mapped._last_seen[i]
+        for j, count in enumerate(row):
+            if count:
+                knowledge_base.add(key, mapped.labels[j], count)
+        if not math.isnan(timestamp):
+            knowledge_base.last_seen[key] = timestamp
+
+    return knowledge_base
+
+
+def load_grounding_engine(path: str, fuzzy_max_distance: Optional[int] = None) -> GroundingEngine:
+    return GroundingEngine(
+        knowledge_base=MappedGroundingKnowledgeBase.open(path),
+        fuzzy_max_distance=fuzzy_max_distance,
+    )
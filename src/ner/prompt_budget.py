@@ -0,0 +1,91 @@
+import bisect
+import math
+import re
+from dataclasses import dataclass, field
+from itertools import accumulate
+from typing import List, Tuple
+
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WORD_PATTERN = re.compile(r"\S+")
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    # words longer than a few characters are split into several BPE tokens
+    return sum(
+        max(1, math.ceil(len(piece) / CHARS_PER_TOKEN))
+        for piece in TOKEN_PATTERN.findall(text)
+    )
+
+
+# tags and instructions around the sentence in the tagger query
+QUERY_OVERHEAD_TOKENS = estimate_tokens(
+    "<text_to_tag></text_to_tag> Only tag this text: <text_to_tag></text_to_tag>"
+)
+
+
+@dataclass
+class PromptBudget:
+    max_tokens: int
+    tokens_saved: List[int] = field(default_factory=list)
+
+    def fit_context(
+        self,
+        tokens: List[str],
+        left_context: str,
+        right_context: str,
+        reserved_tokens: int = 0,
+    ) -> Tuple[str, str]:
+        # the sentence is pasted into the query twice, reserved_tokens are
+        # taken by other parts of the query such as retrieved examples
+        available = max(
+            0,
+            self.max_tokens
+            - 2 * estimate_tokens(" ".join(tokens))
+            - QUERY_OVERHEAD_TOKENS
+            - reserved_tokens,
+        )
+
+        left_words = list(WORD_PATTERN.finditer(left_context))[::-1]
+        right_words = list(WORD_PATTERN.finditer(right_context))
+        left_costs = list(accumulate(estimate_tokens(w.group()) for w in left_words))
+        right_costs = list(accumulate(estimate_tokens(w.group()) for w in right_words))
+        left_total = left_costs[-1] if left_costs else 0
+        right_total = right_costs[-1] if right_costs else 0
+
+        # split the budget evenly, a short side hands its leftover to the other one
+        half = available // 2
+        if left_total <= half:
+            left_budget, right_budget = left_total, available - left_total
+        elif right_total <= half:
+            left_budget, right_budget = available - right_total, right_total
+        else:
+            left_budget, right_budget = half, available - half
+
+        # words closest to the sentence are kept first
+        left_kept = bisect.bisect_right(left_costs, left_budget)
+        right_kept = bisect.bisect_right(right_costs, right_budget)
+
+        trimmed_left = (
+            left_context[left_words[left_kept - 1].start() :] if left_kept else ""
+        )
+        trimmed_right = (
+            right_context[: right_words[right_kept - 1].end()] if right_kept else ""
+        )
+
+        saved = left_total + right_total
+        saved -= (left_costs[left_kept - 1] if left_kept else 0) + (
+            right_costs[right_kept - 1] if right_kept else 0
+        )
+        self.tokens_saved.append(saved)
+
+        return trimmed_left, trimmed_right
+
+    def report(self) -> str:
+        runs = len(self.tokens_saved)
+        total = sum(self.tokens_saved)
+        trimmed = sum(1 for saved in self.tokens_saved if saved > 0)
+        average = total / runs if runs else 0
+
+        return f"Prompt budget of {self.max_tokens} tokens: trimmed context in {trimmed}/{runs} runs, saved {total} tokens in total ({average:.1f} per run)"
@@ -0,0 +1,109 @@
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ner.eval.dataset import Example, NERDataset
+
+
+QUERY_CACHE_SIZE = 4096
+
+
+@dataclass
+class ExampleIndex:
+    examples: List[Example]
+    # term -> (entry ids, precomputed BM25 weight of the term in each entry)
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    cache_size: int = QUERY_CACHE_SIZE
+    _cache: "OrderedDict[Tuple[Tuple[str, ...], int], Tuple[int, ...]]" = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+
+    @staticmethod
+    def from_ner_dataset(
+        dataset: NERDataset, k1: float = 1.5, b: float = 0.75
+    ) -> "ExampleIndex":
+        term_frequencies: Dict[str, Dict[int, int]] = dict()
+        lengths = list()
+        for i, entry in enumerate(dataset.entries):
+            terms = ExampleIndex._to_terms(entry.tokens)
+            lengths.append(len(terms))
+            for term in terms:
+                frequencies = term_frequencies.setdefault(term, dict())
+                frequencies[i] = frequencies.get(i, 0) + 1
+
+        doc_lengths = np.array(lengths, dtype=np.float32)
+        average_length = max(float(doc_lengths.mean()) if lengths else 0.0, 1.0)
+        n = len(lengths)
+
+        postings = dict()
+        for term, frequencies in term_frequencies.items():
+            ids = np.fromiter(frequencies.keys(), dtype=np.int32, count=len(frequencies))
+            tf = np.fromiter(
+                frequencies.values(), dtype=np.float32, count=len(frequencies)
+            )
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1 - b + b * doc_lengths[ids] / average_length)
+            postings[term] = (ids, (idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+
+        examples = [NERDataset._to_example(entry) for entry in dataset.entries]
+        return ExampleIndex(examples=examples, postings=postings)
+
+    @staticmethod
+    def _to_terms(tokens: List[str]) -> List[str]:
+        return [token.lower() for token in tokens if any(c.isalnum() for c in token)]
+
+    def search(self, tokens: List[str], k: int = 3) -> List[Example]:
+        return [self.examples[i] for i in self.search_ids(tokens, k)]
+
+    def search_ids(self, tokens: List[str], k: int = 3) -> List[int]:
+        cache_key = (tuple(tokens), k)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            # callers get their own list, the cached ids stay as they were
+            return list(self._cache[cache_key])
+
+        scores = np.zeros(len(self.examples), dtype=np.float32)
+        for term in set(ExampleIndex._to_terms(tokens)):
+            if term in self.postings:
+                ids, weights = self.postings[term]
+                scores[ids] += weights
+
+        k = min(k, len(self.examples))
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+        ids = [int(i) for i in top[np.argsort(-scores[top], kind="stable")] if scores[i] > 0]
+
+        self._cache[cache_key] = tuple(ids)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return ids
+
+
+if __name__ == "__main__":
+    print("Loading Genia dataset")
+    train = NERDataset.from_genia("train")
+    test = NERDataset.from_genia("test").sample(500)
+
+    start = time.perf_counter()
+    index = ExampleIndex.from_ner_dataset(train)
+    print(f"Built index over {len(index.examples)} entries in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    for entry in test.entries:
+        index.search_ids(entry.tokens, 3)
+    elapsed = (time.perf_counter() - start) / len(test.entries)
+    print(f"Average query latency: {elapsed * 1000:.3f}ms")
+
+    start = time.perf_counter()
+    for entry in test.entries:
+        index.search_ids(entry.tokens, 3)
+    elapsed = (time.perf_counter() - start) / len(test.entries)
+    print(f"Average cached query latency: {elapsed * 1000:.4f}ms")
+
+    print(f"Query: {test.entries[0].text}")
+    for example in index.search(test.entries[0].tokens, 3):
+        print(f"Example: {example.tagged_text}")
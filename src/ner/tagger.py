@@ -21,6 +21,10 @@ class Tagger(ABC):
     ) -> Tuple[str, List[str]]:
         pass
 
+    def close(self) -> None:
+        # releases what the tagger keeps open across sentences
+        pass
+
     @staticmethod
     def convert_to_genia_labels(
         llm_output: str,
@@ -1,13 +1,19 @@
 import json
 import copy
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 
 import nltk
 from ner.clients.claude_client import AnthropicClient, ClaudeFamily
 from ner.clients.llm_client import LLMClient
 from ner.converter import Converter
-from ner.prompts import SYSTEM_PROMPT_FOR_XML_OUTPUT, get_system_prompt_with_feedback
+from ner.prompts import (
+    SYSTEM_PROMPT_FOR_XML_OUTPUT,
+    generate_example_part_of_prompt,
+    get_system_prompt_with_feedback,
+)
+from ner.prompt_budget import PromptBudget, estimate_tokens
+from ner.retrieval import ExampleIndex
 from ner.tagger import Tagger
 from ner.helper import extract_tag
 
@@ -16,11 +22,25 @@ class FewShotTagger(Tagger):
     system_prompt: str
     llm_client: LLMClient
     metadata: Dict[str, Any] = field(default_factory=dict)
+    example_index: Optional[ExampleIndex] = None
+    dynamic_examples: int = 3
+    prompt_budget: Optional[PromptBudget] = None
+
     def recognize(self, tokens: List[str], left_context: str = "", right_context: str = "") -> Tuple[str, List[str]]:
         self.metadata["distances"] = self.metadata.get("distances", [[], []])
-        query_template = "{}\n\n<text_to_tag>{}</text_to_tag>\n\n{}\n\nOnly tag this text: <text_to_tag>{}</text_to_tag>"
+        examples_part = ""
+        if self.example_index:
+            # without any word in common the examples of the system prompt are enough
+            similar_examples = self.example_index.search(tokens, self.dynamic_examples)
+            if similar_examples:
+                examples_part = f"Here are examples similar to the text you need to tag:\n{generate_example_part_of_prompt(similar_examples)}\n\n"
+        if self.prompt_budget:
+            left_context, right_context = self.prompt_budget.fit_context(
+                tokens, left_context, right_context, estimate_tokens(examples_part)
+            )
+        query_template = "{}{}\n\n<text_to_tag>{}</text_to_tag>\n\n{}\n\nOnly tag this text: <text_to_tag>{}</text_to_tag>"
         query = query_template.format(
-            left_context, " ".join(tokens), right_context, " ".join(tokens)
+            examples_part, left_context, " ".join(tokens), right_context, " ".join(tokens)
         )
         llm_output = self.llm_client.get_llm_response(
             query, self.system_prompt
@@ -0,0 +1,25 @@
+import pytest
+
+from ner.agents.agent_config import AgentConfig
+from tests.scripted_client import ScriptedClient, ScriptedSearch
+
+
+@pytest.fixture
+def agent_config() -> AgentConfig:
+    # ScriptedClient tells the roles apart by these system prompts
+    return AgentConfig(
+        tagger_system_prompt="tagger",
+        reviewer_system_prompt="reviewer",
+        researcher_system_prompt="researcher",
+    )
+
+
+@pytest.fixture
+def scripted_client():
+    # ScriptedClient, called with its options, e.g. scripted_client(detours=True)
+    return ScriptedClient
+
+
+@pytest.fixture
+def scripted_search() -> ScriptedSearch:
+    return ScriptedSearch()
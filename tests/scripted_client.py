@@ -0,0 +1,125 @@
+import asyncio
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from autogen_core.components import FunctionCall
+from autogen_core.components.models import CreateResult, RequestUsage
+from autogen_core.components.tools import FunctionTool
+
+from ner.agents.research_agent import parse_search_queries
+from ner.prompt_budget import estimate_tokens
+
+
+TEXT_TO_TAG_PATTERN = re.compile(r"<text_to_tag>(.*?)</text_to_tag>")
+# the numbered questions of a research batch
+BATCH_QUESTION_PATTERN = re.compile(r"^(\d+)\. (.*)$", re.MULTILINE)
+
+
+class ScriptedClient:
+    # a chat completion client without a model, so tests and benchmarks only
+    # exercise the agent plumbing. The role is told apart by the system
+    # prompt: the tagger echoes the text to tag, wrapping the tokens in tags,
+    # the reviewer approves and the researcher calls the search tool when it
+    # is offered, answers numbered batches per question, or answers plainly.
+    # With detours the tagger first asks the researcher, the reviewer sends
+    # the first output back with feedback and every reply comes with some
+    # reasoning
+    def __init__(
+        self,
+        latency: float = 0,
+        detours: bool = False,
+        tags: Optional[Dict[str, str]] = None,
+        failing_text: Optional[str] = None,
+    ):
+        self.latency = latency
+        self.detours = detours
+        # tokens the tagger wraps in entity tags
+        self.tags = tags or {}
+        # the tagger fails on this text to tag
+        self.failing_text = failing_text
+        self.calls = 0
+        # the last message of every call
+        self.prompts: List[str] = list()
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    async def create(self, messages, tools=[], extra_create_args={}, cancellation_token=None) -> CreateResult:
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        history = [str(message.content) for message in messages]
+        self.prompts.append(history[-1])
+        self.input_tokens += sum(estimate_tokens(content) for content in history)
+        self.input_tokens += sum(estimate_tokens(json.dumps(tool.schema)) for tool in tools)
+
+        role = messages[0].content
+        content: Any
+        if role == "researcher":
+            content = self.research(history, tools)
+        elif role == "reviewer":
+            output = [content for content in history if "<output>" in content][-1]
+            content = "<feedback>Check IL-2</feedback>" if self.detours and "Revised" not in output else "APPROVED!"
+        else:
+            content = self.tag(history)
+
+        if isinstance(content, str):
+            if self.detours:
+                # models reason before they answer
+                content = "Considering each mention in its context. " * 20 + content
+            self.output_tokens += estimate_tokens(content)
+        else:
+            self.output_tokens += sum(estimate_tokens(call.arguments) for call in content)
+        return CreateResult(
+            finish_reason="stop",
+            content=content,
+            usage=RequestUsage(prompt_tokens=0, completion_tokens=0),
+            cached=False,
+        )
+
+    def research(self, history: List[str], tools: List[Any]) -> Any:
+        if tools:
+            # searches the questions of the latest request
+            queries = next(
+                (queries for queries in map(parse_search_queries, reversed(history)) if queries), []
+            )
+            return [FunctionCall(id="1", arguments=json.dumps({"queries": queries}), name="search")]
+
+        if "<answer_" in history[-1]:
+            return "".join(
+                f"<answer_{number}>{question} is well known</answer_{number}>"
+                for number, question in BATCH_QUESTION_PATTERN.findall(history[-1])
+            )
+        return "IL-2 is a protein"
+
+    def tag(self, history: List[str]) -> str:
+        if self.detours and not any("<answer>" in content for content in history):
+            return "<search>What is IL-2?</search>"
+
+        texts = TEXT_TO_TAG_PATTERN.findall("".join(history))
+        text = texts[-1] if texts else ""
+        if self.failing_text is not None and text == self.failing_text:
+            raise RuntimeError(f"The model failed on '{text}'")
+
+        tagged = [
+            f"<{self.tags[token]}>{token}</{self.tags[token]}>" if token in self.tags else token
+            for token in text.split()
+        ]
+        content = f"<output>{' '.join(tagged)}</output>"
+        if any("<feedback>" in content for content in history):
+            content += " Revised."
+        return content
+
+
+class ScriptedSearch:
+    # a search backend that records the queries it was asked
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.queries: List[str] = list()
+
+    def as_tool(self) -> FunctionTool:
+        return FunctionTool(self.search, name="search", description="Use this tool to search anything")
+
+    async def search(self, queries: List[str]) -> str:
+        await asyncio.sleep(self.latency)
+        self.queries.extend(queries)
+        return "".join(f"Search results for '{query}':\n{query} is well known\n-----\n" for query in queries)
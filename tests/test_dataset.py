@@ -0,0 +1,177 @@
+import json
+import logging
+import re
+from typing import List
+
+import pytest
+
+from ner.eval import dataset as dataset_module
+from ner.eval.dataset import NERDataset, NERDatasetEntry
+from ner.spans import extract_spans
+
+
+def word_tokenize(text: str) -> List[str]:
+    # the parts of nltk's word_tokenize the titles below need, without the
+    # punkt data: words, punctuation and directed double quotes
+    tokens = re.findall(r'\w+(?:[-.]\w+)*|"|[^\w\s]', text)
+    quotes = iter(["``", "''"] * len(tokens))
+    return [next(quotes) if token == '"' else token for token in tokens]
+
+
+@pytest.fixture
+def astroner_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_module, "word_tokenize", word_tokenize)
+    titles = [
+        {
+            # adjacent entities of different types
+            "title": "Gamma-ray bursts in M31 galaxies",
+            "annotations": [
+                {"start": 0, "end": 16, "text": "Gamma-ray bursts", "label": "Process"},
+                {"start": 20, "end": 23, "text": "M31", "label": "AstrObject"},
+                {"start": 24, "end": 32, "text": "galaxies", "label": "Morphology"},
+            ],
+        },
+        {
+            # the offsets pick the second of two equal mentions
+            "title": "Dust and more dust",
+            "annotations": [{"start": 14, "end": 18, "text": "dust", "label": "ChemicalSpecies"}],
+        },
+        {
+            # overlapping annotations, a quoted title and a mention without offsets
+            "title": 'Erratum to: "Dark matter halos of dwarf galaxies"',
+            "annotations": [
+                {"start": 13, "end": 30, "text": "Dark matter halos", "label": "AstroPortion"},
+                {"start": 18, "end": 30, "text": "matter halos", "label": "Morphology"},
+                {"text": "dwarf galaxies", "label": "AstrObject"},
+                {"text": "not in the title", "label": "Method"},
+            ],
+        },
+    ]
+    path = tmp_path / "astroner.json"
+    path.write_text(json.dumps(titles))
+    return str(path)
+
+
+def test_astroner_annotations_convert_to_iob2(astroner_path):
+    dataset = NERDataset.from_astroner(astroner_path)
+    spans = {
+        entry.text: [(" ".join(entry.tokens[start:end]), entity_type) for start, end, entity_type in extract_spans(entry.labels)]
+        for entry in dataset.entries
+    }
+
+    assert spans == {
+        "Gamma-ray bursts in M31 galaxies": [("Gamma-ray bursts", "Process"), ("M31", "AstrObject"), ("galaxies", "Morphology")],
+        "Dust and more dust": [("dust", "ChemicalSpecies")],
+        # the later overlapping annotation takes over from its first token on
+        "Erratum to : `` Dark matter halos of dwarf galaxies ''": [
+            ("Dark", "AstroPortion"), ("matter halos", "Morphology"), ("dwarf galaxies", "AstrObject"),
+        ],
+    }
+    assert dataset.references == [entry.labels for entry in dataset.entries]
+    assert sorted(dataset.entity_types) == ["AstrObject", "AstroPortion", "ChemicalSpecies", "Method", "Morphology", "Process"]
+
+
+BUSTER_DOCUMENT = {
+    "text": "Acme bought Beta. Gamma sold Delta. Omega rose.",
+    "tokens": ["Acme", "bought", "Beta", ".", "Gamma", "sold", "Delta", ".", "Omega", "rose", "."],
+    "labels": [
+        "B-Parties.BUYING_COMPANY", "O", "B-Parties.ACQUIRED_COMPANY", "O",
+        "B-Parties.SELLING_COMPANY", "O", "O", "O",
+        "B-Parties.BUYING_COMPANY", "O", "O",
+    ],
+}
+
+
+@pytest.mark.parametrize(
+    "context_window, context_unit, contexts",
+    [
+        (-1, "sentences", [("", "Gamma sold Delta . Omega rose ."), ("Acme bought Beta .", "Omega rose ."), ("Acme bought Beta . Gamma sold Delta .", "")]),
+        (0, "sentences", [("", ""), ("", ""), ("", "")]),
+        (1, "sentences", [("", "Gamma sold Delta ."), ("Acme bought Beta .", "Omega rose ."), ("Gamma sold Delta .", "")]),
+        (5, "sentences", [("", "Gamma sold Delta . Omega rose ."), ("Acme bought Beta .", "Omega rose ."), ("Acme bought Beta . Gamma sold Delta .", "")]),
+        (2, "tokens", [("", "Gamma sold"), ("Beta .", "Omega rose"), ("Delta .", "")]),
+        (50, "tokens", [("", "Gamma sold Delta . Omega rose ."), ("Acme bought Beta .", "Omega rose ."), ("Acme bought Beta . Gamma sold Delta .", "")]),
+    ],
+)
+def test_buster_context_windows_stop_at_the_document_edges(monkeypatch, context_window, context_unit, contexts):
+    monkeypatch.setattr(dataset_module, "word_tokenize", str.split)
+
+    entries = NERDataset._from_buster_to_ner_entry(BUSTER_DOCUMENT, True, context_window, context_unit)
+
+    assert [entry.text for entry in entries] == ["Acme bought Beta", "Gamma sold Delta", "Omega rose"]
+    assert [(entry.left_context, entry.right_context) for entry in entries] == contexts
+    assert entries[1].labels == ["B-SELLING_COMPANY", "O", "O"]
+    # the entries share one document and only keep offsets into it
+    assert all(entry.document is entries[0].document for entry in entries)
+
+
+def test_buster_rejects_unknown_context_units(monkeypatch):
+    monkeypatch.setattr(dataset_module, "word_tokenize", str.split)
+
+    with pytest.raises(ValueError):
+        NERDataset._from_buster_to_ner_entry(BUSTER_DOCUMENT, True, 1, "paragraphs")
+
+
+def test_given_contexts_are_kept_as_strings():
+    entry = NERDatasetEntry(left_context="before", right_context="after", text="IL-2", tokens=["IL-2"], labels=["O"])
+
+    assert (entry.left_context, entry.right_context) == ("before", "after")
+    assert entry.document is None
+
+
+def create_dataset() -> NERDataset:
+    labels = [["B-DNA", "O"], ["B-DNA", "B-protein"], ["B-RNA", "O"], ["O", "O"], ["B-protein", "O"]]
+    return NERDataset(
+        entries=[
+            NERDatasetEntry(text=f"entry {i}", tokens=["entry", str(i)], labels=entry_labels)
+            for i, entry_labels in enumerate(labels)
+        ],
+        references=labels,
+        entity_types=["DNA", "protein", "RNA", "cell_type"],
+    )
+
+
+def test_examples_cover_the_rarest_entity_types_first(caplog):
+    dataset = create_dataset()
+
+    with caplog.at_level(logging.WARNING, logger="ner.eval.dataset"):
+        selected = [dataset._select_covering_entries(2, seed) for seed in range(5)]
+
+    # RNA only appears in entry 2, entry 1 then covers DNA and protein at
+    # once, cell_type has no entries to cover it
+    assert selected == [[2, 1]] * 5
+    assert caplog.text == ""
+
+
+def test_types_left_uncovered_are_reported(caplog):
+    dataset = create_dataset()
+
+    with caplog.at_level(logging.WARNING, logger="ner.eval.dataset"):
+        assert dataset._select_covering_entries(1, seed=0) == [2]
+
+    assert "Examples do not cover entity types: ['DNA', 'protein']" in caplog.text
+
+
+def test_remaining_examples_are_filled_in_by_the_seed():
+    dataset = create_dataset()
+
+    selected = dataset._select_covering_entries(4, seed=7)
+
+    assert selected[:2] == [2, 1] and len(set(selected)) == 4
+    assert dataset._select_covering_entries(4, seed=7) == selected
+    assert dataset._select_covering_entries(10, seed=7)[:2] == [2, 1]
+    assert len(dataset._select_covering_entries(10, seed=7)) == len(dataset.entries)
+
+
+def test_examples_are_cached_per_count_and_seed():
+    dataset = create_dataset()
+
+    first = dataset.get_examples(2)
+    first.clear()
+    second = dataset.get_examples(2)
+    other_seed = dataset.get_examples(2, seed=1)
+
+    assert [example.text_to_tag for example in second] == ["entry 2", "entry 1"]
+    assert second[0] is dataset.get_examples(2)[0]
+    assert other_seed == second and other_seed[0] is not second[0]
+    assert set(dataset._examples_cache) == {(2, 43), (2, 1)}
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from autogen_core.base import AgentId
+from autogen_core.components import DefaultTopicId
+from autogen_core.components.models import UserMessage
+
+from ner.agents.agent_config import AgentConfig
+from ner.agents.base_agent import GroupChatMessage
+from ner.agents.direct_executor import DirectExecutor, DirectRuntime
+from ner.agents.tagger_agent import TAGGER_TOPIC_TYPE
+
+
+def create_session(session_id: str):
+    agent_config = AgentConfig(
+        tagger_system_prompt="tagger",
+        reviewer_system_prompt="reviewer",
+        researcher_system_prompt="researcher",
+    )
+    executor = DirectExecutor(agent_config=agent_config, llm_client=None, internet_access=False)  # type: ignore
+    return executor.create_session(session_id, {})
+
+
+def test_session_agents_share_one_runtime():
+    participants, supervisor = create_session("session")
+
+    runtimes = {id(agent.runtime) for agent in [*participants.values(), supervisor]}
+    assert len(runtimes) == 1
+    assert isinstance(supervisor.runtime, DirectRuntime)
+    assert {agent.id.key for agent in participants.values()} == {"session"}
+
+
+def test_agents_can_publish_through_the_direct_runtime():
+    participants, _ = create_session("session")
+    tagger = participants[TAGGER_TOPIC_TYPE]
+    message = GroupChatMessage(body=UserMessage(content="<output>IL-2</output>", source=TAGGER_TOPIC_TYPE))
+
+    asyncio.run(tagger.publish_message(message, DefaultTopicId(type="GroupChat", source="session")))
+
+    assert tagger.runtime.published == [(message, DefaultTopicId(type="GroupChat", source="session"))]  # type: ignore
+
+
+def test_direct_messages_are_not_supported():
+    participants, _ = create_session("session")
+    tagger = participants[TAGGER_TOPIC_TYPE]
+
+    with pytest.raises(NotImplementedError):
+        asyncio.run(tagger.send_message("hello", AgentId("reviewer", "session")))
@@ -0,0 +1,146 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from ner.eval.dataset import NERDataset, NERDatasetEntry
+from ner.eval.eval import get_grounding_engine, run_eval
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+from ner.grounding_online import OnlineGroundingEngine
+from ner.grounding_store import MappedGroundingKnowledgeBase, load_knowledge_base, write_knowledge_base
+from ner.tagger import Tagger
+
+
+@dataclass
+class CopyTagger(Tagger):
+    # predicts the reference labels, or is interrupted while predicting
+    interrupted: bool = False
+    closed: bool = False
+
+    def recognize(self, tokens: List[str], left_context: str = "", right_context: str = "") -> Tuple[str, List[str]]:
+        if self.interrupted:
+            raise KeyboardInterrupt
+        return " ".join(tokens), ["B-protein"] + ["O"] * (len(tokens) - 1)
+
+    def recognize_with_feedback(self, tokens: List[str], previous_output: str, feedback: str) -> Tuple[str, List[str]]:
+        return self.recognize(tokens)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@dataclass
+class FailingSessionsTagger(CopyTagger):
+    # tags sentences in concurrent sessions, the sessions of failing sentences raise
+    failing: List[str] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    def recognize_many(self, entries: List[NERDatasetEntry], max_concurrency: int) -> List[Optional[Tuple[str, List[str]]]]:
+        results: List[Optional[Tuple[str, List[str]]]] = list()
+        for entry in entries:
+            if entry.text in self.failing:
+                self.metadata.setdefault("errors", []).append(f"The model failed on '{entry.text}'")
+                results.append(None)
+            else:
+                results.append(self.recognize(entry.tokens))
+        return results
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    # predictions are written to pred/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pred").mkdir()
+    monkeypatch.setattr("ner.eval.eval.sleep", lambda seconds: None)
+
+    tokens = ["IL-2", "activates", "T", "cells"]
+    labels = ["B-protein", "O", "O", "O"]
+    entry = NERDatasetEntry(left_context="", right_context="", text=" ".join(tokens), tokens=tokens, labels=labels)
+    return NERDataset(entity_types=["protein"], entries=[entry], references=[labels])
+
+
+def test_run_eval_closes_the_tagger(dataset):
+    tagger = CopyTagger(entity_types=["protein"])
+
+    precision, recall, f1, _ = run_eval(tagger, dataset, "test", return_scores=True)
+
+    assert tagger.closed
+    assert (precision, recall, f1) == (1.0, 1.0, 1.0)
+
+
+def test_run_eval_closes_the_tagger_when_interrupted(dataset):
+    tagger = CopyTagger(entity_types=["protein"], interrupted=True)
+
+    with pytest.raises(KeyboardInterrupt):
+        run_eval(tagger, dataset, "test")
+    assert tagger.closed
+
+
+def test_run_eval_grades_the_predictions_against_the_knowledge_base(dataset, capsys):
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "DNA", count=5)
+    tagger = CopyTagger(entity_types=["protein"])
+    tagger.grounding_engine = GroundingEngine(knowledge_base=knowledge_base)  # type: ignore
+
+    run_eval(tagger, dataset, "test")
+
+    assert "Grounding: 1 predicted spans in 1 of 1 sentences disagree with the knowledge base" in capsys.readouterr().out
+
+
+def test_grounding_engine_options(dataset, tmp_path):
+    stored = str(tmp_path / "stored.kb")
+    write_knowledge_base(GroundingEngine.from_ner_dataset(dataset).knowledge_base, stored)
+
+    built = get_grounding_engine(dataset, fuzzy_max_distance=1)
+    mapped = get_grounding_engine(dataset, stored, fuzzy_max_distance=0)
+
+    assert type(built) is GroundingEngine and built.fuzzy_max_distance == 1
+    assert built.knowledge_base.get("il-2") == {"protein"}
+    assert isinstance(mapped.knowledge_base, MappedGroundingKnowledgeBase) and mapped.fuzzy_max_distance == 0
+
+
+def test_online_grounding_starts_from_a_copy_and_resumes_from_its_snapshot(dataset, tmp_path):
+    stored = str(tmp_path / "stored.kb")
+    snapshot = str(tmp_path / "online.kb")
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("t___cells", "cell_type")
+    write_knowledge_base(knowledge_base, stored)
+
+    from_dev = get_grounding_engine(dataset, online_grounding=snapshot)
+    from_stored = get_grounding_engine(dataset, stored, 1, online_grounding=snapshot)
+
+    assert isinstance(from_dev, OnlineGroundingEngine) and from_dev.knowledge_base.get("il-2") == {"protein"}
+    assert isinstance(from_stored, OnlineGroundingEngine) and type(from_stored.knowledge_base) is GroundingKnowledgeBase
+    assert from_stored.snapshot_path == snapshot and from_stored.fuzzy_max_distance == 1
+
+    from_stored.knowledge_base.add("cd28", "protein", timestamp=1.0)
+    from_stored.snapshot()
+    resumed = get_grounding_engine(dataset, stored, online_grounding=snapshot)
+    assert sorted(resumed.knowledge_base.keys()) == ["cd28", "t___cells"]
+
+
+def test_run_eval_keeps_what_online_grounding_learned(dataset, tmp_path):
+    snapshot = str(tmp_path / "online.kb")
+    tagger = CopyTagger(entity_types=["protein"])
+    tagger.grounding_engine = OnlineGroundingEngine(snapshot_path=snapshot)  # type: ignore
+    tagger.grounding_engine.knowledge_base.add("cd28", "protein", timestamp=1.0)  # type: ignore
+
+    run_eval(tagger, dataset, "test")
+
+    assert load_knowledge_base(snapshot).get("cd28") == {"protein"}
+
+
+def test_failed_sentences_are_left_out_of_the_scores(dataset, tmp_path, capsys):
+    labels = ["B-protein", "O", "B-protein", "O"]
+    dataset.entries.append(NERDatasetEntry(text="CD28 binds B7 .", tokens="CD28 binds B7 .".split(), labels=labels))
+    dataset.references.append(labels)
+    tagger = FailingSessionsTagger(entity_types=["protein"], failing=["CD28 binds B7 ."])
+
+    precision, recall, f1, _ = run_eval(tagger, dataset, "test", return_scores=True, max_concurrency=2)
+
+    # predicted without entities, the failed sentence would cost two misses
+    assert (precision, recall, f1) == (1.0, 1.0, 1.0)
+    assert "1 of 2 sentences failed and were left out of the scores" in capsys.readouterr().out
+    (prediction_file,) = (tmp_path / "pred").iterdir()
+    assert json.loads(prediction_file.read_text()) == [["B-protein", "O", "O", "O"], None]
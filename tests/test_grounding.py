@@ -0,0 +1,136 @@
+import pytest
+
+from ner.grounding import (
+    GroundingEngine,
+    GroundingFeedback,
+    GroundingKnowledgeBase,
+    GroundingResult,
+    WrongPrediction,
+)
+
+
+def test_masks_follow_counts():
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", count=5)
+    knowledge_base.add("il-2", "DNA", count=2)
+    knowledge_base.add("t___cells", "cell_type")
+
+    assert knowledge_base.get_counts("il-2") == {"protein": 5, "DNA": 2}
+    assert knowledge_base.get_mask("il-2") == knowledge_base.to_mask(["protein", "DNA"])
+    assert knowledge_base.get("t___cells") == {"cell_type"}
+    assert knowledge_base.get("il-3") is None
+    assert knowledge_base.get_counts("il-3") == {}
+    assert len(knowledge_base) == 2
+
+
+def test_new_labels_keep_existing_counts():
+    knowledge_base = GroundingKnowledgeBase()
+    for i in range(10):
+        knowledge_base.add(f"key-{i}", "DNA", count=i + 1)
+    for label in ["RNA", "protein", "cell_type"]:
+        knowledge_base.add("key-3", label)
+
+    assert knowledge_base.row_width == 4
+    assert len(knowledge_base.counts) == 10 * 4
+    assert all(knowledge_base.get_counts(f"key-{i}")["DNA"] == i + 1 for i in range(10))
+    assert knowledge_base.get_counts("key-3") == {"DNA": 4, "RNA": 1, "protein": 1, "cell_type": 1}
+
+
+def test_removed_rows_are_reused():
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", count=5, timestamp=1.0)
+    knowledge_base.add("cd28", "DNA")
+    knowledge_base.remove("il-2")
+
+    assert knowledge_base.get("il-2") is None
+    assert knowledge_base.get_last_seen("il-2") is None
+    assert list(knowledge_base.keys()) == ["cd28"]
+
+    knowledge_base.add("nf-kappa___b", "DNA")
+    assert len(knowledge_base.counts) == 2 * knowledge_base.row_width
+    assert knowledge_base.get_counts("nf-kappa___b") == {"DNA": 1}
+    assert knowledge_base.get_counts("cd28") == {"DNA": 1}
+
+
+SENTENCES = [
+    ("IL-2 and NF-kappa B activate T cells".split(), ["B-DNA", "O", "B-protein", "I-protein", "O", "B-cell_line", "I-cell_line"]),
+    ("IL-2 binds IL-2 receptors".split(), ["B-protein", "O", "B-DNA", "I-DNA"]),
+    ("No entities here".split(), ["O", "O", "O"]),
+    ("IL-2 and IL-2 genes".split(), ["B-DNA", "O", "B-DNA", "O"]),
+    ("Unknown mentions stay quiet".split(), ["B-RNA", "O", "O", "O"]),
+]
+
+
+def create_engine() -> GroundingEngine:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", count=9)
+    knowledge_base.add("il-2", "DNA", count=1)
+    knowledge_base.add("nf-kappa___b", "protein")
+    knowledge_base.add("t___cells", "cell_type", count=3)
+    knowledge_base.add("il-2___receptors", "protein", count=2)
+    knowledge_base.add("il-2___receptors", "DNA", count=2)
+    return GroundingEngine(knowledge_base=knowledge_base)
+
+
+@pytest.mark.parametrize("include_correct", [False, True])
+def test_verify_many_agrees_with_verify(include_correct):
+    engine = create_engine()
+    tokens_batch = [tokens for tokens, _ in SENTENCES]
+    labels_batch = [labels for _, labels in SENTENCES]
+
+    results = engine.verify_many(tokens_batch, labels_batch, include_correct=include_correct)
+
+    for i, (tokens, labels) in enumerate(SENTENCES):
+        feedback = GroundingFeedback.from_results([result for result in results if result.index == i])
+        expected = engine.verify(tokens, labels)
+        if not include_correct:
+            expected.correct = {}
+        assert feedback == expected
+
+
+def test_verify_many_returns_compact_results():
+    engine = create_engine()
+
+    results = engine.verify_many([tokens for tokens, _ in SENTENCES], [labels for _, labels in SENTENCES])
+
+    assert results == [
+        GroundingResult(index=0, start=0, end=1, entity="il-2", predicted="DNA", grounded=["protein"]),
+        GroundingResult(index=0, start=5, end=7, entity="t___cells", predicted="cell_line", grounded=["cell_type"]),
+        GroundingResult(index=3, start=0, end=1, entity="il-2", predicted="DNA", grounded=["protein"]),
+        GroundingResult(index=3, start=2, end=3, entity="il-2", predicted="DNA", grounded=["protein"]),
+    ]
+    assert engine.verify_many([], []) == []
+
+
+def test_verify_many_looks_each_entity_up_once(monkeypatch):
+    engine = create_engine()
+    lookups = []
+    get_counts_many = engine.knowledge_base.get_counts_many
+    monkeypatch.setattr(
+        GroundingKnowledgeBase, "get_counts_many", lambda self, keys: lookups.append(keys) or get_counts_many(keys)
+    )
+
+    engine.verify_many([tokens for tokens, _ in SENTENCES], [labels for _, labels in SENTENCES])
+
+    assert lookups == [["il-2", "nf-kappa___b", "t___cells", "il-2___receptors", "unknown"]]
+
+
+def test_feedback_from_results_collects_the_tags_of_each_entity():
+    results = [
+        GroundingResult(index=0, start=0, end=1, entity="il-2", predicted="DNA", grounded=["protein"]),
+        GroundingResult(index=1, start=0, end=1, entity="il-2", predicted="RNA", grounded=["protein"]),
+        GroundingResult(index=2, start=3, end=4, entity="il-2", predicted="DNA", grounded=["protein"]),
+        GroundingResult(index=0, start=2, end=4, entity="t___cells", predicted="cell_type", grounded=[]),
+        GroundingResult(index=1, start=5, end=7, entity="t___cells", predicted="cell_type", grounded=[]),
+    ]
+
+    feedback = GroundingFeedback.from_results(results)
+
+    assert feedback.wrong == {"il-2": WrongPrediction(predicted_tags=["DNA", "RNA"], grounded_tags=["protein"])}
+    assert feedback.correct == {"t___cells": ["cell_type"]}
+    assert feedback.get_text_feedback(include_correct=True) == (
+        "- 't cells' is correctly tagged as 'cell_type'\n"
+        "- 'il-2' is tagged as 'DNA'. It should likely be protein instead.\n"
+        "- 'il-2' is tagged as 'RNA'. It should likely be protein instead.\n"
+    )
+    assert GroundingFeedback.from_results([]) == GroundingFeedback()
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from ner import grounding_builder
+from ner.grounding import GroundingEngine
+from ner.grounding_builder import build_knowledge_base, write_built_knowledge_base
+from ner.grounding_store import MappedGroundingKnowledgeBase, write_entries
+
+
+def random_examples(count: int):
+    rng = random.Random(39)
+    words = ["IL-2", "T", "cells", "NF-kappa", "B", "mRNA", "Müller", "glia", "cd28"]
+    labels = ["O", "B-protein", "I-protein", "B-DNA", "I-DNA", "B-cell_type", "I-cell_type"]
+    for _ in range(count):
+        length = rng.randint(1, 12)
+        yield [rng.choice(words) for _ in range(length)], [rng.choice(labels) for _ in range(length)]
+
+
+def build_expected(examples):
+    engine = GroundingEngine()
+    for tokens, labels in examples:
+        for knowledge_key, label in GroundingEngine._get_entities(engine.knowledge_base, tokens, labels):
+            engine.knowledge_base.add(knowledge_key, label)
+    return engine.knowledge_base
+
+
+@pytest.fixture
+def many_merge_passes(monkeypatch):
+    monkeypatch.setattr(grounding_builder, "MERGE_FAN_IN", 3)
+
+
+def test_build_matches_in_memory_build(tmp_path, many_merge_passes):
+    examples = list(random_examples(500))
+    expected = build_expected(examples)
+
+    knowledge_base = build_knowledge_base(examples, run_size=40, max_workers=1, directory=str(tmp_path))
+
+    assert knowledge_base.labels == expected.labels
+    assert sorted(knowledge_base.keys()) == sorted(expected.keys())
+    assert all(knowledge_base.get_counts(key) == expected.get_counts(key) for key in expected.keys())
+
+
+def test_written_file_matches_in_memory_build(tmp_path, many_merge_passes):
+    examples = list(random_examples(500))
+    expected = build_expected(examples)
+    path = str(tmp_path / "built.kb")
+
+    written = write_built_knowledge_base(examples, path, run_size=40, max_workers=1, directory=str(tmp_path))
+
+    mapped = MappedGroundingKnowledgeBase.open(path)
+    assert written == len(mapped) == len(expected)
+    assert all(mapped.get_counts(key) == expected.get_counts(key) for key in expected.keys())
+    assert all(mapped.get_last_seen(key) is None for key in expected.keys())
+
+
+def test_write_entries_rejects_unsorted_keys(tmp_path):
+    entries = [("il-2", {"protein": 1}, None), ("cd28", {"DNA": 1}, None)]
+
+    with pytest.raises(ValueError):
+        write_entries(entries, ["protein", "DNA"], str(tmp_path / "unsorted.kb"))
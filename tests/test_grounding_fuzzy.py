@@ -0,0 +1,117 @@
+import pytest
+
+from ner.grounding import FuzzyPrediction, GroundingEngine, GroundingKnowledgeBase
+from ner.grounding_fuzzy import FuzzyIndex, get_deletes, get_edit_distance, normalize_key
+
+
+KEYS = ["ikb___alpha", "ikb-alpha", "il-2", "il-4", "interleukin", "interleukins"]
+
+
+def create_engine(fuzzy_max_distance=1) -> GroundingEngine:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("ikb___alpha", "protein", 5)
+    knowledge_base.add("il-2___receptor", "protein", 5)
+    knowledge_base.add("il-2___receptors", "DNA", 5)
+    knowledge_base.add("interleukin", "protein", 3)
+    knowledge_base.add("interleukins", "DNA", 10)
+    return GroundingEngine(knowledge_base=knowledge_base, fuzzy_max_distance=fuzzy_max_distance)
+
+
+@pytest.mark.parametrize(
+    "knowledge_key, normalized_key",
+    [("ikb___alpha", "ikbalpha"), ("IkB-alpha", "ikbalpha"), ("NF-kappa___B", "nfkappab"), ("-___(", "")],
+)
+def test_normalize_key_drops_separators_case_and_punctuation(knowledge_key, normalized_key):
+    assert normalize_key(knowledge_key) == normalized_key
+
+
+def test_get_deletes_lists_every_deletion_within_the_distance():
+    assert get_deletes("abc", 0) == {"abc"}
+    assert get_deletes("abc", 1) == {"abc", "bc", "ac", "ab"}
+    assert get_deletes("abc", 2) == {"abc", "bc", "ac", "ab", "a", "b", "c"}
+
+
+@pytest.mark.parametrize(
+    "first, second, max_distance, distance",
+    [
+        ("kitten", "sitting", 3, 3),
+        ("interleukin", "interleukins", 1, 1),
+        # adjacent characters swapped are a single edit
+        ("receptor", "recpetor", 1, 1),
+        ("receptor", "receptor", 0, 0),
+        # past the bound the distance is reported as max_distance + 1
+        ("kitten", "sitting", 2, 3),
+        ("abcdef", "ghijkl", 1, 2),
+        ("ab", "abcdef", 2, 3),
+    ],
+)
+def test_edit_distance_is_bounded(first, second, max_distance, distance):
+    assert get_edit_distance(first, second, max_distance) == distance
+    assert get_edit_distance(second, first, max_distance) == distance
+
+
+def test_lookup_finds_close_keys_closest_first():
+    index = FuzzyIndex.from_keys(KEYS, max_distance=1)
+
+    assert index.lookup("IkB alpha") == [("ikb___alpha", 0), ("ikb-alpha", 0)]
+    # the queried key itself is not a match
+    assert index.lookup("ikb-alpha") == [("ikb___alpha", 0)]
+    assert index.lookup("interleukim") == [("interleukin", 1)]
+    assert index.lookup("interleukin") == [("interleukins", 1)]
+    assert index.lookup("interferon") == []
+    assert index.lookup("-") == []
+
+
+def test_lookup_of_short_keys_needs_the_same_normalized_key():
+    index = FuzzyIndex.from_keys(KEYS, max_distance=2)
+
+    assert index.lookup("IL-3") == []
+    assert index.lookup("IL 2") == [("il-2", 0)]
+
+
+def test_fuzzy_feedback_for_unknown_spelling_variants():
+    engine = create_engine()
+
+    feedback = engine.verify(["IkB-alpha", "levels"], ["B-DNA", "O"])
+
+    assert feedback.wrong == {}
+    assert feedback.fuzzy == {
+        "ikb-alpha": FuzzyPrediction(predicted_tags=["DNA"], grounded_tags=["protein"], matched_entity="ikb___alpha", distance=0),
+    }
+    assert "The similar entity 'ikb alpha' is usually protein" in feedback.get_text_feedback()
+    assert feedback.get_text_feedback(include_fuzzy=False) == ""
+
+
+def test_fuzzy_feedback_agrees_with_the_prediction():
+    engine = create_engine()
+
+    assert engine.verify(["IkB-alpha"], ["B-protein"]).fuzzy == {}
+
+
+def test_exact_match_wins_over_fuzzy_match():
+    engine = create_engine()
+
+    # 'il-2 receptors' is known as DNA, its neighbour 'il-2 receptor' as protein
+    feedback = engine.verify(["IL-2", "receptors"], ["B-protein", "I-protein"])
+
+    assert feedback.fuzzy == {}
+    assert list(feedback.wrong) == ["il-2___receptors"]
+    assert feedback.wrong["il-2___receptors"].grounded_tags == ["DNA"]
+
+
+def test_only_the_closest_variants_vote():
+    engine = create_engine(fuzzy_max_distance=2)
+
+    # 'interleukinz' is one edit from both keys, which together are not confident
+    assert engine.verify(["interleukinz"], ["B-DNA"]).fuzzy == {}
+    # 'interleukinss' is one edit from 'interleukins' and two from 'interleukin'
+    feedback = engine.verify(["interleukinss"], ["B-protein"])
+    assert feedback.fuzzy["interleukinss"] == FuzzyPrediction(
+        predicted_tags=["protein"], grounded_tags=["DNA"], matched_entity="interleukins", distance=1
+    )
+
+
+def test_fuzzy_lookups_are_off_by_default():
+    engine = create_engine(fuzzy_max_distance=None)
+
+    assert engine.verify(["IkB-alpha"], ["B-DNA"]).fuzzy == {}
@@ -0,0 +1,58 @@
+import csv
+import json
+
+from ner.grounding import GroundingKnowledgeBase
+from ner.grounding_lexicon import LexiconSource, import_lexicons
+
+
+def test_import_tsv_lexicon(tmp_path):
+    path = tmp_path / "genes.tsv"
+    path.write_text(
+        "symbol\tlocus_group\n"
+        "IL2\tprotein-coding gene\n"
+        "MIR21\tnon-coding RNA\n"
+        "IL2\tprotein-coding gene\n"
+        "FOO1P\tpseudogene\n"
+        "NF-kappa B\tprotein-coding gene\n"
+    )
+    source = LexiconSource(
+        path=str(path),
+        term_field="symbol",
+        type_field="locus_group",
+        type_mapping={"protein-coding gene": "protein", "non-coding RNA": "RNA"},
+        weight=2,
+    )
+    knowledge_base = GroundingKnowledgeBase()
+
+    assert import_lexicons(knowledge_base, [source, source]) == 3
+    assert knowledge_base.get_counts("il2") == {"protein": 2}
+    assert knowledge_base.get_counts("mir21") == {"RNA": 2}
+    assert knowledge_base.get_counts("nf-kappa___b") == {"protein": 2}
+    assert knowledge_base.get("foo1p") is None
+
+
+def test_import_jsonl_lexicon_with_default_type(tmp_path):
+    path = tmp_path / "cell_lines.jsonl"
+    path.write_text("\n".join(json.dumps({"name": name}) for name in ["HeLa", "Jurkat"]) + "\n")
+    source = LexiconSource(path=str(path), format="jsonl", term_field="name", default_type="cell_line")
+    knowledge_base = GroundingKnowledgeBase()
+
+    assert import_lexicons(knowledge_base, [source]) == 2
+    assert knowledge_base.get("jurkat") == {"cell_line"}
+
+
+def test_long_fields_keep_the_global_field_size_limit(tmp_path):
+    path = tmp_path / "synonyms.tsv"
+    synonyms = "|".join(f"synonym-{i}" for i in range(20_000))
+    path.write_text(f"IL2\t{synonyms}\n")
+    source = LexiconSource(path=str(path), type_field=1, default_type="protein")
+    limit = csv.field_size_limit()
+
+    assert list(source.records()) == [("IL2", synonyms)]
+    assert csv.field_size_limit() == limit
+
+    # also restored when the reader is abandoned early
+    records = source.records()
+    next(records)
+    records.close()
+    assert csv.field_size_limit() == limit
@@ -0,0 +1,145 @@
+import os
+
+import pytest
+
+from ner.grounding import GroundingKnowledgeBase
+from ner.grounding_online import CountMinSketch, OnlineGroundingEngine
+from ner.grounding_store import MappedGroundingKnowledgeBase, load_knowledge_base, write_knowledge_base
+
+
+TOKENS = ["IL-2", "activates", "T", "cells"]
+LABELS = ["B-protein", "O", "B-cell_type", "I-cell_type"]
+
+
+def build_engine(**kwargs) -> OnlineGroundingEngine:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", count=4)
+    return OnlineGroundingEngine(knowledge_base=knowledge_base, **kwargs)
+
+
+def test_count_min_sketch_never_undercounts():
+    sketch = CountMinSketch(width=64, depth=3)
+    for i in range(500):
+        sketch.add(f"item-{i % 50}")
+
+    assert sketch.total == 500
+    assert all(sketch.estimate(f"item-{i}") >= 10 for i in range(50))
+
+
+def test_count_min_sketch_decay_halves_counts():
+    sketch = CountMinSketch()
+    sketch.add("il-2", count=8)
+    sketch.decay()
+
+    assert sketch.estimate("il-2") == 4
+    assert sketch.total == 4
+
+
+def test_count_min_sketch_columns_do_not_depend_on_the_process():
+    # hash() of a string changes with PYTHONHASHSEED, the sketch columns must not
+    assert CountMinSketch()._columns("protein\til-2").tolist() == [54879, 21570, 59261, 52414]
+    assert CountMinSketch(width=1000, depth=2)._columns("DNA\tcd28").tolist() == [962, 452]
+
+
+def test_count_min_sketch_depth_is_bounded_by_the_digest():
+    assert len(CountMinSketch(width=10, depth=8)._columns("il-2")) == 8
+    with pytest.raises(ValueError):
+        CountMinSketch(depth=9)
+
+
+def test_mapped_knowledge_base_is_rejected(tmp_path):
+    path = str(tmp_path / "offline.kb")
+    write_knowledge_base(build_engine().knowledge_base, path)
+
+    with pytest.raises(TypeError, match="load_knowledge_base"):
+        OnlineGroundingEngine(knowledge_base=MappedGroundingKnowledgeBase.open(path))
+    assert OnlineGroundingEngine(knowledge_base=load_knowledge_base(path)).knowledge_base.get("il-2") == {"protein"}
+
+
+def test_new_key_is_promoted_at_min_support():
+    engine = build_engine(min_support=3)
+
+    for timestamp in [1.0, 2.0]:
+        engine.accept(TOKENS, LABELS, timestamp=timestamp)
+        assert engine.knowledge_base.get("t___cells") is None
+
+    engine.accept(TOKENS, LABELS, timestamp=3.0)
+    assert engine.knowledge_base.get_counts("t___cells") == {"cell_type": 3}
+    assert engine.knowledge_base.get_last_seen("t___cells") == 3.0
+
+
+def test_promoted_key_is_found_by_mentions():
+    engine = build_engine(min_support=1)
+    assert [candidate.entity for candidate in engine.find_mentions(TOKENS)] == ["il-2"]
+
+    engine.accept(TOKENS, LABELS, timestamp=1.0)
+    assert [candidate.entity for candidate in engine.find_mentions(TOKENS)] == ["il-2", "t___cells"]
+
+
+def test_known_label_of_offline_key_is_updated_directly():
+    engine = build_engine(min_support=3)
+    engine.accept(TOKENS, LABELS, timestamp=1.0)
+
+    assert engine.knowledge_base.get_counts("il-2") == {"protein": 5}
+    # offline keys are never evicted
+    assert engine.knowledge_base.get_last_seen("il-2") is None
+
+
+def test_new_label_of_known_key_needs_min_support():
+    engine = build_engine(min_support=3)
+    labels = ["B-DNA", "O", "O", "O"]
+
+    for timestamp in [1.0, 2.0]:
+        engine.accept(TOKENS, labels, timestamp=timestamp)
+        assert engine.knowledge_base.get("il-2") == {"protein"}
+
+    engine.accept(TOKENS, labels, timestamp=3.0)
+    assert engine.knowledge_base.get_counts("il-2") == {"protein": 4, "DNA": 3}
+    assert engine.knowledge_base.get_last_seen("il-2") is None
+
+
+def test_evict_drops_old_weakly_supported_entries():
+    engine = build_engine(min_support=1, max_age_seconds=10, keep_support=3)
+    engine.accept(["NF-kappa", "B"], ["B-protein", "I-protein"], timestamp=0.0)
+    for timestamp in [0.0, 1.0, 2.0]:
+        engine.accept(TOKENS, LABELS, timestamp=timestamp)
+
+    assert engine.evict(now=100.0) == 1
+    assert engine.knowledge_base.get("nf-kappa___b") is None
+    assert engine.knowledge_base.get("t___cells") == {"cell_type"}
+    assert engine.knowledge_base.get("il-2") == {"protein"}
+
+
+def test_evict_keeps_online_entries_within_bound():
+    engine = build_engine(min_support=1, max_online_entries=10)
+    for i in range(20):
+        engine.accept([f"gene-{i}"], ["B-DNA"], timestamp=float(i))
+
+    assert len(engine.knowledge_base.last_seen) <= 10
+    # the oldest entries went first
+    assert engine.knowledge_base.get("gene-19") == {"DNA"}
+    assert engine.knowledge_base.get("gene-0") is None
+
+
+def test_snapshot_interval_uses_accepted_timestamps(tmp_path):
+    path = str(tmp_path / "online.kb")
+    engine = build_engine(min_support=1, snapshot_path=path, snapshot_interval_seconds=60)
+
+    engine.accept(TOKENS, LABELS, timestamp=1_000.0)
+    engine.accept(TOKENS, LABELS, timestamp=1_059.0)
+    assert not os.path.exists(path)
+
+    engine.accept(TOKENS, LABELS, timestamp=1_060.0)
+    assert load_knowledge_base(path).get_counts("t___cells") == {"cell_type": 3}
+
+
+def test_resumes_from_snapshot(tmp_path):
+    path = str(tmp_path / "online.kb")
+    engine = build_engine(min_support=1, snapshot_path=path)
+    engine.accept(TOKENS, LABELS, timestamp=5.0)
+    engine.snapshot()
+
+    resumed = OnlineGroundingEngine.from_snapshot(path)
+    assert resumed.knowledge_base.get_counts("il-2") == {"protein": 5}
+    assert resumed.knowledge_base.get_last_seen("t___cells") == 5.0
+    assert resumed.knowledge_base.get_last_seen("il-2") is None
@@ -0,0 +1,133 @@
+import pickle
+
+import pytest
+
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+from ner.grounding_store import (
+    MappedGroundingKnowledgeBase,
+    load_grounding_engine,
+    load_knowledge_base,
+    write_knowledge_base,
+)
+
+
+def build_knowledge_base() -> GroundingKnowledgeBase:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", count=5)
+    knowledge_base.add("il-2", "DNA", count=2)
+    knowledge_base.add("nf-kappa___b", "protein")
+    knowledge_base.add("t___cells", "cell_type", count=3, timestamp=1700000000.5)
+    knowledge_base.add("müller___glia", "cell_type")
+    knowledge_base.add("mrna", "RNA", timestamp=1700000100.0)
+    return knowledge_base
+
+
+@pytest.fixture
+def stored(tmp_path):
+    knowledge_base = build_knowledge_base()
+    path = str(tmp_path / "test.kb")
+    write_knowledge_base(knowledge_base, path)
+    return knowledge_base, path
+
+
+def assert_same_entries(expected: GroundingKnowledgeBase, actual: GroundingKnowledgeBase):
+    assert sorted(actual.keys()) == sorted(expected.keys())
+    assert len(actual) == len(expected)
+    for key in expected.keys():
+        assert actual.get_counts(key) == expected.get_counts(key)
+        assert actual.to_labels(actual.get_mask(key)) == expected.to_labels(expected.get_mask(key))
+        assert actual.get_last_seen(key) == expected.get_last_seen(key)
+
+
+def test_mapped_knowledge_base_matches_written_one(stored):
+    knowledge_base, path = stored
+    mapped = MappedGroundingKnowledgeBase.open(path)
+
+    assert_same_entries(knowledge_base, mapped)
+    assert mapped.token_separator == knowledge_base.token_separator
+
+
+def test_mapped_knowledge_base_misses_unknown_keys(stored):
+    _, path = stored
+    mapped = MappedGroundingKnowledgeBase.open(path)
+
+    for key in ["", "a", "il-3", "zzz", "il-2___receptor"]:
+        assert mapped.get_mask(key) == 0
+        assert mapped.get_counts(key) == {}
+        assert mapped.get_last_seen(key) is None
+
+
+def test_loaded_knowledge_base_is_mutable_copy(stored):
+    knowledge_base, path = stored
+    loaded = load_knowledge_base(path)
+
+    assert_same_entries(knowledge_base, loaded)
+    loaded.add("il-2", "protein")
+    assert loaded.get_counts("il-2") == {"protein": 6, "DNA": 2}
+
+
+def test_mapped_knowledge_base_looks_up_keys_in_bulk(stored):
+    knowledge_base, path = stored
+    mapped = MappedGroundingKnowledgeBase.open(path)
+    keys = ["t___cells", "unknown", "il-2", "mrna", "il-2", "", "müller___glia", "zzz", "aaa"]
+
+    assert mapped.get_counts_many(keys) == [knowledge_base.get_counts(key) for key in keys]
+    assert mapped.get_counts_many([]) == []
+
+
+def test_mapped_knowledge_base_is_read_only(stored):
+    _, path = stored
+    mapped = MappedGroundingKnowledgeBase.open(path)
+
+    with pytest.raises(TypeError):
+        mapped.add("il-2", "protein")
+    with pytest.raises(TypeError):
+        mapped.remove("il-2")
+
+
+def test_mapped_knowledge_base_pickles_by_path(stored):
+    knowledge_base, path = stored
+    unpickled = pickle.loads(pickle.dumps(MappedGroundingKnowledgeBase.open(path)))
+
+    assert isinstance(unpickled, MappedGroundingKnowledgeBase)
+    assert_same_entries(knowledge_base, unpickled)
+
+
+def test_mapped_engine_verifies_like_built_engine(stored):
+    knowledge_base, path = stored
+    built = GroundingEngine(knowledge_base=knowledge_base)
+    mapped = load_grounding_engine(path)
+
+    tokens = "IL-2 and NF-kappa B activate T cells".split()
+    labels = ["B-DNA", "O", "B-protein", "I-protein", "O", "B-cell_line", "I-cell_line"]
+    assert mapped.verify(tokens, labels) == built.verify(tokens, labels)
+
+
+def test_mapped_engine_looks_up_similar_keys(stored):
+    knowledge_base, path = stored
+    built = GroundingEngine(knowledge_base=knowledge_base, fuzzy_max_distance=1)
+    mapped = load_grounding_engine(path, fuzzy_max_distance=1)
+
+    tokens = "NF-kappaB activates T-cells".split()
+    labels = ["B-DNA", "O", "B-cell_line"]
+    feedback = mapped.verify(tokens, labels)
+    assert sorted(feedback.fuzzy) == ["nf-kappab", "t-cells"]
+    assert feedback == built.verify(tokens, labels)
+    assert load_grounding_engine(path).verify(tokens, labels).fuzzy == {}
+
+
+def test_empty_knowledge_base_roundtrip(tmp_path):
+    path = str(tmp_path / "empty.kb")
+    write_knowledge_base(GroundingKnowledgeBase(), path)
+
+    mapped = MappedGroundingKnowledgeBase.open(path)
+    assert len(mapped) == 0
+    assert mapped.get_mask("il-2") == 0
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other.kb"
+    path.write_bytes(b"not a knowledge base")
+
+    with pytest.raises(ValueError):
+        MappedGroundingKnowledgeBase.open(str(path))
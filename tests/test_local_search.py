@@ -0,0 +1,134 @@
+import asyncio
+import math
+import os
+
+import pytest
+
+from ner.agents.tools.local_search import (
+    BM25_B,
+    BM25_K1,
+    LocalSearchIndex,
+    dataset_documents,
+    tokenize,
+)
+from ner.eval.dataset import NERDataset, NERDatasetEntry
+
+
+DOCUMENTS = [
+    ("IL-2", "Interleukin 2 is a protein, a cytokine of T cells."),
+    ("NF-kappa B", "A protein complex controlling the transcription of DNA."),
+    ("CD28", "A protein on T cells providing co-stimulatory signals."),
+    ("black hole", "A region of spacetime from which nothing escapes."),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalSearchIndex(str(tmp_path / "index"))
+    yield index
+    index.close()
+
+
+def bm25(query, documents, document):
+    # the score of document for query over all documents, written out
+    tokenized = [tokenize(f"{title} {text}") for title, text in documents]
+    average_length = sum(map(len, tokenized)) / len(tokenized)
+    terms = tokenize(f"{document[0]} {document[1]}")
+    score = 0.0
+    for term in dict.fromkeys(tokenize(query)):
+        frequency = terms.count(term)
+        document_frequency = sum(term in document_terms for document_terms in tokenized)
+        idf = math.log(1 + (len(tokenized) - document_frequency + 0.5) / (document_frequency + 0.5))
+        score += idf * frequency * (BM25_K1 + 1) / (
+            frequency + BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / average_length)
+        )
+    return score
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is NF-kappa B?") == ["nf", "kappa", "b"]
+
+
+def test_search_ranks_by_bm25(index):
+    index.add_source("glossary", "v1", lambda: DOCUMENTS)
+
+    results = index.search("Which protein is found on T cells?")
+
+    assert [document for _, document in results] == [DOCUMENTS[2], DOCUMENTS[0], DOCUMENTS[1]]
+    for score, document in results:
+        assert score == pytest.approx(bm25("Which protein is found on T cells?", DOCUMENTS, document))
+
+
+def test_scores_use_the_statistics_of_all_segments(index, tmp_path):
+    index.add_source("proteins", "v1", lambda: DOCUMENTS[:3])
+    index.add_source("astronomy", "v1", lambda: DOCUMENTS[3:])
+    single = LocalSearchIndex(str(tmp_path / "single"))
+    single.add_source("all", "v1", lambda: DOCUMENTS)
+
+    try:
+        for query in ["protein T cells", "black hole spacetime", "transcription of DNA"]:
+            assert index.search(query) == pytest.approx(single.search(query))
+    finally:
+        single.close()
+
+
+def test_search_without_known_terms_finds_nothing(index):
+    assert index.search("What is it?") == []
+    index.add_source("glossary", "v1", lambda: DOCUMENTS)
+    assert index.search("quasar") == []
+    assert index.search("protein", top_k=1) == [(pytest.approx(bm25("protein", DOCUMENTS, DOCUMENTS[0])), DOCUMENTS[0])]
+
+
+def test_sources_are_only_reindexed_when_they_change(index):
+    assert index.add_source("glossary", "v1", lambda: DOCUMENTS[:2])
+    segment = index.manifest["glossary"]["segment"]
+
+    assert not index.add_source("glossary", "v1", lambda: pytest.fail("an unchanged source is not read"))
+    assert index.add_source("glossary", "v2", lambda: DOCUMENTS[3:])
+
+    assert not os.path.exists(os.path.join(index.directory, segment))
+    assert [document for _, document in index.search("protein black hole")] == [DOCUMENTS[3]]
+
+    index.remove_source("glossary")
+    assert index.manifest == {}
+    assert index.search("black hole") == []
+
+
+def test_reopened_index_keeps_its_sources(index):
+    index.add_source("glossary", "v1", lambda: DOCUMENTS)
+    reopened = LocalSearchIndex(index.directory)
+    try:
+        assert reopened.manifest == index.manifest
+        assert reopened.search("CD28") == index.search("CD28")
+        assert not reopened.add_source("glossary", "v1", lambda: [])
+    finally:
+        reopened.close()
+
+
+def test_search_tool_answers_every_query(index):
+    index.add_source("glossary", "v1", lambda: DOCUMENTS)
+
+    answer = asyncio.run(index.as_tool().run_json({"queries": ["What is CD28?", "What is a quasar?"]}, None))
+
+    assert answer == (
+        "Search results for 'What is CD28?':\n--\nCD28: A protein on T cells providing co-stimulatory signals.\n\n-----\n"
+        "Search results for 'What is a quasar?':\nNo results\n-----\n"
+    )
+
+
+def test_dataset_documents_describe_each_mention():
+    dataset = NERDataset(
+        entries=[
+            NERDatasetEntry(left_context="", right_context="", text=text, tokens=text.split(), labels=labels)
+            for text, labels in [
+                ("IL-2 binds .", ["B-protein", "O", "O"]),
+                ("il-2 gene", ["B-DNA", "O"]),
+                ("IL-2 binds .", ["B-protein", "O", "O"]),
+            ]
+        ],
+        references=[],
+    )
+
+    assert list(dataset_documents(dataset)) == [
+        ("IL-2", "Annotated as protein 2 times, DNA 1 time. Examples: IL-2 binds . | il-2 gene"),
+    ]
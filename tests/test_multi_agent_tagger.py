@@ -0,0 +1,174 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+import nltk
+import pytest
+
+from ner.agents.history_budget import HistoryBudget
+from ner.agents.multi_agent_tagger import MultiAgentTagger
+from ner.agents.review_policy import ReviewPolicy
+from ner.eval.dataset import NERDatasetEntry
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+
+
+TOKENS = "IL-2 gene expression requires NF-kappa B activation .".split()
+
+
+def has_punkt() -> bool:
+    # converting tagged entities back to labels tokenizes them with nltk
+    try:
+        nltk.word_tokenize("IL-2")
+    except LookupError:
+        return False
+    return True
+
+
+requires_punkt = pytest.mark.skipif(not has_punkt(), reason="nltk punkt tokenizer data is not installed")
+
+
+def to_entries(texts: List[str]) -> List[NERDatasetEntry]:
+    return [
+        NERDatasetEntry(left_context="", right_context="", text=text, tokens=text.split(), labels=[])
+        for text in texts
+    ]
+
+
+def record_transcripts(tagger: MultiAgentTagger) -> List[List[Tuple[str, str]]]:
+    transcripts: List[List[Tuple[str, str]]] = list()
+    recognize_in_session = tagger._recognize_in_session
+
+    async def record(session_id, session, *args):
+        try:
+            return await recognize_in_session(session_id, session, *args)
+        finally:
+            transcripts.append([(message.source, str(message.content)) for message in session["transcript"]])
+
+    tagger._recognize_in_session = record  # type: ignore
+    return transcripts
+
+
+def test_runtime_is_reused_and_sessions_are_dropped(agent_config, scripted_client):
+    tagger = MultiAgentTagger(["DNA", "protein"], agent_config, scripted_client())
+    try:
+        predictions = [tagger.recognize(TOKENS) for _ in range(3)]
+        runtime = tagger.runtime
+
+        assert predictions == [(" ".join(TOKENS), ["O"] * len(TOKENS))] * 3
+        assert runtime is not None
+        assert tagger.sessions == {}
+        assert not runtime._instantiated_agents
+    finally:
+        tagger.close()
+    assert tagger.runtime is None
+
+
+def test_concurrent_sessions_match_serial_ones(agent_config, scripted_client):
+    entries = to_entries([f"sentence number {i} about IL-2 ." for i in range(24)])
+    tagger = MultiAgentTagger(["DNA", "protein"], agent_config, scripted_client(latency=0.01, detours=True), internet_access=False)
+    try:
+        serial = [tagger.recognize(entry.tokens) for entry in entries]
+        concurrent = tagger.recognize_many(entries, max_concurrency=8)
+    finally:
+        tagger.close()
+
+    assert concurrent == serial
+
+
+def test_failed_session_has_no_prediction_and_the_others_go_on(agent_config, scripted_client):
+    entries = to_entries(["IL-2 binds .", "The model fails here .", "CD28 binds ."])
+    for direct_execution in [False, True]:
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], agent_config, scripted_client(failing_text="The model fails here ."),
+            direct_execution=direct_execution,
+        )
+        try:
+            predictions = tagger.recognize_many(entries, max_concurrency=3)
+        finally:
+            tagger.close()
+
+        assert predictions == [
+            ("IL-2 binds .", ["O", "O", "O"]),
+            None,
+            ("CD28 binds .", ["O", "O", "O"]),
+        ]
+        assert tagger.metadata["errors"] == ["The model failed on 'The model fails here .'"]
+
+
+def test_direct_executor_replays_the_runtime_transcripts(agent_config, scripted_client):
+    transcripts: Dict[bool, List[List[Tuple[str, str]]]] = dict()
+    predictions: Dict[bool, List[Tuple[str, List[str]]]] = dict()
+    for direct_execution in [False, True]:
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], agent_config, scripted_client(detours=True),
+            internet_access=False, direct_execution=direct_execution,
+        )
+        transcripts[direct_execution] = record_transcripts(tagger)
+        try:
+            predictions[direct_execution] = [tagger.recognize(TOKENS) for _ in range(3)]
+        finally:
+            tagger.close()
+
+    assert transcripts[True] == transcripts[False]
+    assert predictions[True] == predictions[False]
+    # the tagger asked the researcher and revised its output after review
+    assert [source for source, _ in transcripts[True][0]] == [
+        "User", "Tagger", "Researcher", "Tagger", "Reviewer", "User", "Tagger", "Reviewer",
+    ]
+
+
+def test_history_budget_keeps_predictions_and_saves_tokens(agent_config, scripted_client):
+    context = " ".join(f"Context sentence {i} about T cells and cytokines ." for i in range(30))
+    input_tokens: Dict[bool, int] = dict()
+    predictions: Dict[bool, List[Tuple[str, List[str]]]] = dict()
+    for budgeted in [False, True]:
+        client = scripted_client(detours=True)
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], agent_config, client, internet_access=False,
+            history_budget=HistoryBudget() if budgeted else None, direct_execution=True,
+        )
+        try:
+            predictions[budgeted] = [tagger.recognize(TOKENS, context, context) for _ in range(3)]
+        finally:
+            tagger.close()
+        input_tokens[budgeted] = client.input_tokens
+
+    assert predictions[True] == predictions[False]
+    assert input_tokens[True] < input_tokens[False]
+
+
+@requires_punkt
+def test_review_policy_keeps_predictions_with_fewer_calls(agent_config, scripted_client):
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", 10)
+    knowledge_base.add("cd28", "DNA", 10)
+    entries = to_entries(["The cells were washed twice .", "IL-2 expression was induced .", "CD28 signals were blocked ."])
+
+    calls = list()
+    predictions = list()
+    for review_policy in [None, ReviewPolicy()]:
+        client = scripted_client(tags={"IL-2": "protein", "CD28": "protein"})
+        tagger = MultiAgentTagger(
+            ["DNA", "protein"], agent_config, client,
+            GroundingEngine(knowledge_base=knowledge_base), review_policy=review_policy,
+        )
+        try:
+            predictions.append([tagger.recognize(entry.tokens) for entry in entries])
+        finally:
+            tagger.close()
+        calls.append(client.calls)
+
+    assert predictions[0] == predictions[1]
+    assert predictions[1][1][1] == ["B-protein", "O", "O", "O", "O"]
+    assert calls[1] < calls[0]
+
+
+def test_recognize_many_uses_one_event_loop(agent_config, scripted_client):
+    tagger = MultiAgentTagger(["DNA", "protein"], agent_config, scripted_client())
+    try:
+        tagger.recognize_many(to_entries(["IL-2 binds ."]))
+        loop = tagger._loop
+        tagger.recognize(["IL-2", "binds", "."])
+        assert tagger._loop is loop
+        assert isinstance(loop, asyncio.AbstractEventLoop)
+    finally:
+        tagger.close()
@@ -0,0 +1,83 @@
+import pytest
+
+from ner.prompt_budget import QUERY_OVERHEAD_TOKENS, PromptBudget, estimate_tokens
+
+
+# every context word below is a single token
+SENTENCE = ["x"]
+SENTENCE_TOKENS = 2 * estimate_tokens("x") + QUERY_OVERHEAD_TOKENS
+
+
+def words(prefix: str, count: int) -> str:
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def budget_for_context(tokens: int) -> PromptBudget:
+    return PromptBudget(SENTENCE_TOKENS + tokens)
+
+
+def test_estimate_tokens_splits_long_words_and_punctuation():
+    assert estimate_tokens("IL-2 activates T cells.") == 1 + 1 + 1 + 3 + 1 + 2 + 1
+    assert estimate_tokens("") == 0
+
+
+def test_context_is_split_evenly_around_the_sentence():
+    budget = budget_for_context(8)
+
+    left, right = budget.fit_context(SENTENCE, words("l", 10), words("r", 10))
+
+    # the words next to the sentence are kept
+    assert (left, right) == ("l6 l7 l8 l9", "r0 r1 r2 r3")
+    assert budget.tokens_saved == [12]
+
+
+@pytest.mark.parametrize(
+    "left_context, right_context, expected",
+    [
+        (words("l", 2), words("r", 10), ("l0 l1", "r0 r1 r2 r3 r4 r5")),
+        (words("l", 10), words("r", 3), ("l5 l6 l7 l8 l9", "r0 r1 r2")),
+        ("", words("r", 10), ("", "r0 r1 r2 r3 r4 r5 r6 r7")),
+    ],
+)
+def test_a_short_side_hands_its_leftover_to_the_other(left_context, right_context, expected):
+    budget = budget_for_context(8)
+
+    assert budget.fit_context(SENTENCE, left_context, right_context) == expected
+    assert budget.tokens_saved == [len((left_context + " " + right_context).split()) - 8]
+
+
+def test_context_within_the_budget_is_kept_as_it_is():
+    budget = budget_for_context(8)
+    left_context, right_context = "one  two\nsix", "and ten ."
+
+    assert budget.fit_context(SENTENCE, left_context, right_context) == (left_context, right_context)
+    assert budget.tokens_saved == [0]
+
+
+def test_sentence_longer_than_the_budget_drops_all_context():
+    budget = PromptBudget(10)
+    tokens = words("s", 20).split()
+
+    assert budget.fit_context(tokens, words("l", 3), words("r", 3)) == ("", "")
+    assert budget.tokens_saved == [6]
+
+
+def test_reserved_tokens_shrink_the_context():
+    budget = budget_for_context(8)
+
+    assert budget.fit_context(SENTENCE, words("l", 10), words("r", 10), reserved_tokens=4) == ("l8 l9", "r0 r1")
+    assert budget.tokens_saved == [16]
+
+
+def test_report_sums_up_the_runs():
+    budget = budget_for_context(8)
+    assert budget.report() == (
+        f"Prompt budget of {SENTENCE_TOKENS + 8} tokens: trimmed context in 0/0 runs, saved 0 tokens in total (0.0 per run)"
+    )
+
+    budget.fit_context(SENTENCE, words("l", 10), words("r", 10))
+    budget.fit_context(SENTENCE, "l0", "r0")
+
+    assert budget.report() == (
+        f"Prompt budget of {SENTENCE_TOKENS + 8} tokens: trimmed context in 1/2 runs, saved 12 tokens in total (6.0 per run)"
+    )
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from autogen_core.base import AgentId, AgentInstantiationContext
+from autogen_core.components.models import UserMessage
+
+from ner.agents.direct_executor import DirectRuntime
+from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE, ResearchAgent, parse_search_queries
+
+
+REQUEST = "I am not sure about two mentions.\n<search>\n1. What is NF-kappa B?\n2. What is IL-2?\n</search>"
+
+
+def create_researcher(client, **kwargs) -> ResearchAgent:
+    with AgentInstantiationContext.populate_context((DirectRuntime(), AgentId(RESEARCHER_TOPIC_TYPE, "session"))):  # type: ignore
+        return ResearchAgent(
+            description="researcher",
+            group_chat_topic_type="GroupChat",
+            model_client=client,
+            system_prompt="researcher",
+            **kwargs,
+        )
+
+
+def ask(researcher: ResearchAgent, request: str = REQUEST) -> str:
+    researcher.receive(UserMessage(content=request, source="Tagger"))
+    answer = asyncio.run(researcher.speak())
+    researcher.receive(UserMessage(content=answer, source=RESEARCHER_TOPIC_TYPE))
+    return answer
+
+
+@pytest.mark.parametrize(
+    "content, queries",
+    [
+        (REQUEST, ["What is NF-kappa B?", "What is IL-2?"]),
+        ("<search>- What is IL-2? Is it a protein?\n* What is IL-2? Is it a protein?</search>", ["What is IL-2? Is it a protein?"]),
+        ("<search>What is CD28?</search> and <search>2) What is CD4?</search>", ["What is CD28?", "What is CD4?"]),
+        ("Answer the questions inside <search> tags", []),
+        ("<search>\n" + "\n".join(f"Question {i}?" for i in range(8)) + "\n</search>", [f"Question {i}?" for i in range(5)]),
+    ],
+)
+def test_parse_search_queries(content, queries):
+    assert parse_search_queries(content) == queries
+
+
+@pytest.mark.parametrize("single_call", [False, True])
+def test_researcher_searches_the_questions_of_the_request(scripted_client, scripted_search, single_call):
+    client = scripted_client()
+    researcher = create_researcher(client, search_tool=scripted_search.as_tool(), single_call=single_call)
+
+    answer = ask(researcher)
+
+    assert answer == "<answer>IL-2 is a protein</answer>"
+    assert scripted_search.queries == ["What is NF-kappa B?", "What is IL-2?"]
+    # the single call skips the tool-choice call
+    assert client.calls == (1 if single_call else 2)
+
+
+def test_single_call_answers_the_latest_request(scripted_client, scripted_search):
+    researcher = create_researcher(scripted_client(), search_tool=scripted_search.as_tool(), single_call=True)
+
+    ask(researcher)
+    ask(researcher, "<search>What is CD28?</search>")
+
+    assert scripted_search.queries == ["What is NF-kappa B?", "What is IL-2?", "What is CD28?"]
+
+
+def test_single_call_without_questions_asks_for_the_tool_call(scripted_client, scripted_search):
+    client = scripted_client()
+    researcher = create_researcher(client, search_tool=scripted_search.as_tool(), single_call=True)
+
+    ask(researcher, "Please look into IL-2.")
+
+    assert client.calls == 2
+
+
+def test_disabled_researcher_does_not_call_the_model(scripted_client, scripted_search):
+    client = scripted_client()
+    researcher = create_researcher(client, search_tool=scripted_search.as_tool(), enabled=False)
+
+    assert "not available" in ask(researcher)
+    assert client.calls == 0
+    assert scripted_search.queries == []
+
+
+@pytest.mark.parametrize("single_call", [False, True])
+def test_researcher_without_internet_access_searches_a_given_tool(scripted_client, scripted_search, single_call):
+    researcher = create_researcher(
+        scripted_client(), internet_access=False, search_tool=scripted_search.as_tool(), single_call=single_call
+    )
+
+    ask(researcher)
+
+    assert scripted_search.queries == ["What is NF-kappa B?", "What is IL-2?"]
+
+
+def test_researcher_without_internet_access_or_tool_answers_from_the_model(scripted_client):
+    client = scripted_client()
+    researcher = create_researcher(client, internet_access=False)
+
+    assert ask(researcher) == "<answer>IL-2 is a protein</answer>"
+    assert client.calls == 1
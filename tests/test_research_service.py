@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from typing import List, Optional, Tuple
+
+import pytest
+from autogen_core.base import AgentId, AgentInstantiationContext
+from autogen_core.components.models import UserMessage
+
+from ner.agents.direct_executor import DirectRuntime
+from ner.agents.research_agent import RESEARCHER_TOPIC_TYPE, ResearchAgent
+from ner.agents.multi_agent_tagger import MultiAgentTagger
+from ner.agents.research_service import ResearchService, format_question, parse_batch_answers
+from ner.eval.dataset import NERDatasetEntry
+
+
+def create_researcher(session: int, client, search_tool, service: Optional[ResearchService]) -> ResearchAgent:
+    with AgentInstantiationContext.populate_context((DirectRuntime(), AgentId(RESEARCHER_TOPIC_TYPE, str(session)))):  # type: ignore
+        return ResearchAgent(
+            description="researcher",
+            group_chat_topic_type="GroupChat",
+            model_client=client,
+            system_prompt="researcher",
+            search_tool=search_tool,
+            single_call=True,
+            research_service=service,
+        )
+
+
+def run_sessions(client, search_tool, service: Optional[ResearchService], requests: List[Tuple[float, List[str]]]) -> List[str]:
+    # sessions asking their questions after the given delays, concurrently
+    async def run_session(session: int, delay: float, questions: List[str]) -> str:
+        researcher = create_researcher(session, client, search_tool, service)
+        await asyncio.sleep(delay)
+        researcher.receive(UserMessage(content="<search>\n" + "\n".join(questions) + "\n</search>", source="Tagger"))
+        return await researcher.speak()
+
+    async def run() -> List[str]:
+        return list(await asyncio.gather(*(run_session(session, *request) for session, request in enumerate(requests))))
+
+    return asyncio.run(run())
+
+
+def random_requests(count: int) -> List[Tuple[float, List[str]]]:
+    # sessions asking about a few recurring entities within 50ms
+    rng = random.Random(50)
+    entities = [f"entity-{i}" for i in range(12)]
+    return [
+        (rng.uniform(0, 0.05), [f"What is {entity}?" for entity in rng.sample(entities, 2)])
+        for _ in range(count)
+    ]
+
+
+def test_shared_service_answers_every_session_with_fewer_calls(scripted_client, scripted_search):
+    requests = random_requests(32)
+    client = scripted_client(latency=0.02)
+    service = ResearchService(client, "researcher", scripted_search.as_tool(), window_seconds=0.05)
+
+    answers = run_sessions(client, scripted_search.as_tool(), service, requests)
+
+    for answer, (_, questions) in zip(answers, requests):
+        assert answer == "<answer>" + "\n".join(f"{question}\n{question} is well known" for question in questions) + "</answer>"
+    assert client.calls == service.batches < len(requests)
+    # every question is searched once
+    assert sorted(scripted_search.queries) == sorted({question for _, questions in requests for question in questions})
+    assert service.requests == len(requests)
+
+
+def test_researcher_per_session_calls_the_model_per_request(scripted_client, scripted_search):
+    requests = random_requests(8)
+    client = scripted_client()
+
+    answers = run_sessions(client, scripted_search.as_tool(), None, requests)
+
+    assert answers == ["<answer>IL-2 is a protein</answer>"] * len(requests)
+    assert client.calls == len(requests)
+
+
+def test_shared_service_without_internet_access_searches_a_given_tool(scripted_client, scripted_search):
+    client = scripted_client()
+    service = ResearchService(client, "researcher", scripted_search.as_tool(), internet_access=False, window_seconds=0)
+
+    answers = run_sessions(client, scripted_search.as_tool(), service, [(0, ["What is IL-2?"])])
+
+    assert answers == ["<answer>What is IL-2?\nWhat is IL-2? is well known</answer>"]
+    assert scripted_search.queries == ["What is IL-2?"]
+
+
+@pytest.mark.parametrize(
+    "content, answers",
+    [
+        ("<answer_1>A protein</answer_1>\n<answer_2> A gene </answer_2>", ["A protein", "A gene"]),
+        ("<answer_2>A gene</answer_2>", [None, "A gene"]),
+        ("<answer_1></answer_1><answer_3>Out of range</answer_3>", [None, None]),
+        ("<answer_1>Multi\nline</answer_1><answer_2>Unclosed", ["Multi\nline", None]),
+        ("I can't answer these.", [None, None]),
+    ],
+)
+def test_parse_batch_answers(content, answers):
+    assert parse_batch_answers(content, 2) == answers
+
+
+def test_format_question_keeps_a_short_context():
+    assert format_question(1, "What is IL-2?", "") == "1. What is IL-2?"
+    assert format_question(2, "What is IL-2?", "IL-2 binds .") == "2. What is IL-2?\n   Text: IL-2 binds ."
+    question = format_question(3, "What is IL-2?", "IL-2 binds " * 50)
+    assert question.startswith("3. What is IL-2?\n   Text: IL-2 binds IL-2") and question.endswith(" ...")
+    assert len(question) < 250
+
+
+def test_batch_prompt_gives_the_text_of_each_question(scripted_client, scripted_search):
+    client = scripted_client()
+    service = ResearchService(client, "researcher", scripted_search.as_tool(), window_seconds=0)
+    researcher = create_researcher(0, client, scripted_search.as_tool(), service)
+    researcher.receive(UserMessage(content="<text_to_tag>IL-2 binds .</text_to_tag>", source="User"))
+    researcher.receive(UserMessage(content="<search>What is IL-2?</search>", source="Tagger"))
+
+    answer = asyncio.run(researcher.speak())
+
+    assert answer == "<answer>What is IL-2?\nWhat is IL-2? is well known</answer>"
+    assert "1. What is IL-2?\n   Text: IL-2 binds .\n" in client.prompts[-1]
+
+
+def test_window_closes_when_no_other_session_can_ask(scripted_client, scripted_search):
+    client = scripted_client()
+    service = ResearchService(client, "researcher", scripted_search.as_tool(), window_seconds=60)
+
+    async def run() -> List[Optional[str]]:
+        for _ in range(3):
+            service.open_session()
+        # two of three sessions ask, the window keeps them waiting until the third closes
+        first = asyncio.ensure_future(service.ask(["What is IL-2?"]))
+        second = asyncio.ensure_future(service.ask(["What is CD28?"]))
+        await asyncio.sleep(0.01)
+        assert not first.done()
+        service.close_session()
+        return list(await asyncio.wait_for(asyncio.gather(first, second), timeout=5))
+
+    answers = asyncio.run(run())
+
+    assert answers == ["What is IL-2?\nWhat is IL-2? is well known", "What is CD28?\nWhat is CD28? is well known"]
+    assert service.batches == 1
+
+
+def test_single_session_tagger_does_not_wait_for_the_window(agent_config, scripted_client):
+    tagger = MultiAgentTagger(
+        ["DNA", "protein"], agent_config, scripted_client(detours=True),
+        internet_access=False, shared_research=True, direct_execution=True,
+    )
+    service = tagger.get_research_service()
+    assert service is not None
+    service.window_seconds = 60
+    try:
+        start = time.perf_counter()
+        tagger.recognize_many(
+            [NERDatasetEntry(left_context="", right_context="", text="IL-2 binds .", tokens=["IL-2", "binds", "."], labels=[])] * 2,
+            max_concurrency=1,
+        )
+        assert time.perf_counter() - start < 10
+    finally:
+        tagger.close()
+
+    assert service.requests == 2
+    assert service.sessions == 0
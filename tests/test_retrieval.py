@@ -0,0 +1,132 @@
+import math
+from dataclasses import dataclass, field
+from typing import Any, List
+
+import pytest
+
+from ner.clients.llm_client import LLMClient
+from ner.eval.dataset import NERDataset, NERDatasetEntry
+from ner.prompt_budget import PromptBudget
+from ner.retrieval import ExampleIndex
+from ner.tagger_few_shot import FewShotTagger
+
+
+SENTENCES = [
+    ("IL-2 binds the IL-2 receptor .", ["B-protein", "O", "O", "B-protein", "O", "O"]),
+    ("The receptor is found on T cells .", ["O", "O", "O", "O", "O", "B-cell_type", "I-cell_type", "O"]),
+    ("NF-kappa B controls the transcription of DNA .", ["B-protein", "I-protein", "O", "O", "O", "O", "O", "O"]),
+    ("Black holes swallow light .", ["O", "O", "O", "O", "O"]),
+]
+
+
+@dataclass
+class RecordingClient(LLMClient):
+    # answers with the sentence untagged and keeps every query
+    queries: List[str] = field(default_factory=list)
+
+    def get_llm_response(self, query: str, system_prompt: str = "", functions: List[Any] = []) -> str:
+        self.queries.append(query)
+        return "<output>IL-2 activates T cells</output>"
+
+
+@pytest.fixture
+def dataset() -> NERDataset:
+    return NERDataset(
+        entries=[
+            NERDatasetEntry(text=text, tokens=text.split(), labels=labels)
+            for text, labels in SENTENCES
+        ],
+        references=[labels for _, labels in SENTENCES],
+    )
+
+
+def bm25(query: List[str], document: List[str], documents: List[List[str]], k1: float = 1.5, b: float = 0.75) -> float:
+    # the score of document for query, written out
+    to_terms = ExampleIndex._to_terms
+    lengths = [len(to_terms(tokens)) for tokens in documents]
+    average_length = sum(lengths) / len(lengths)
+    terms = to_terms(document)
+    score = 0.0
+    for term in set(to_terms(query)):
+        frequency = terms.count(term)
+        document_frequency = sum(term in to_terms(tokens) for tokens in documents)
+        idf = math.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(terms) / average_length))
+    return score
+
+
+def test_examples_are_ranked_by_bm25(dataset):
+    index = ExampleIndex.from_ner_dataset(dataset)
+    query = "the IL-2 receptor".split()
+    documents = [entry.tokens for entry in dataset.entries]
+    scores = [bm25(query, tokens, documents) for tokens in documents]
+
+    ids = index.search_ids(query, k=3)
+
+    # "the" is in three entries, the entry naming IL-2 twice comes first
+    assert ids == sorted(range(len(scores)), key=lambda i: -scores[i])[:3]
+    assert ids[0] == 0 and scores[ids[1]] > scores[ids[2]] > 0
+    assert [example.text_to_tag for example in index.search(query, k=1)] == ["IL-2 binds the IL-2 receptor ."]
+    assert "<protein>IL-2</protein>" in index.search(query, k=1)[0].tagged_text
+
+
+def test_only_examples_sharing_a_word_are_returned(dataset):
+    index = ExampleIndex.from_ner_dataset(dataset)
+
+    assert index.search_ids("Black holes".split(), k=3) == [3]
+    assert index.search_ids("Quasars ?".split(), k=3) == []
+    assert index.search_ids("IL-2".split(), k=0) == []
+
+
+def test_cached_queries_are_reused_and_not_shared(dataset):
+    index = ExampleIndex.from_ner_dataset(dataset)
+    query = "T cells".split()
+
+    first = index.search_ids(query)
+    first.append(0)
+    # a cached query is answered without looking at the postings
+    index.postings.clear()
+    second = index.search_ids(query)
+
+    assert second == [1] and second is not first
+    assert list(index._cache) == [(tuple(query), 3)]
+    assert index.search_ids(query, k=2) == []
+
+
+def test_query_cache_drops_the_least_recently_used_query(dataset):
+    index = ExampleIndex.from_ner_dataset(dataset)
+    index.cache_size = 2
+
+    for query in ["T cells", "DNA", "T cells", "Black holes"]:
+        index.search_ids(query.split())
+
+    assert list(index._cache) == [(("T", "cells"), 3), (("Black", "holes"), 3)]
+
+
+def test_tagger_skips_the_examples_without_similar_ones(dataset):
+    client = RecordingClient()
+    tagger = FewShotTagger(["protein", "cell_type"], "system", client, example_index=ExampleIndex.from_ner_dataset(dataset))
+
+    tagger.recognize("IL-2 activates T cells".split())
+    tagger.recognize("Quasars shine".split())
+
+    assert client.queries[0].startswith("Here are examples similar to the text you need to tag:")
+    assert "IL-2 binds the IL-2 receptor ." in client.queries[0]
+    assert client.queries[1].startswith("\n\n<text_to_tag>Quasars shine</text_to_tag>")
+
+
+def test_prompt_budget_counts_the_retrieved_examples(dataset):
+    context = " ".join(f"word{i}" for i in range(200))
+    tokens = "IL-2 activates T cells".split()
+    without_examples = FewShotTagger(["protein"], "system", RecordingClient(), prompt_budget=PromptBudget(400))
+    with_examples = FewShotTagger(
+        ["protein"], "system", RecordingClient(), example_index=ExampleIndex.from_ner_dataset(dataset),
+        prompt_budget=PromptBudget(400),
+    )
+
+    without_examples.recognize(tokens, context, context)
+    with_examples.recognize(tokens, context, context)
+
+    # the examples take part of the budget, less context is kept around the sentence
+    saved_without, saved_with = without_examples.prompt_budget.tokens_saved[0], with_examples.prompt_budget.tokens_saved[0]
+    assert 0 < saved_without < saved_with
@@ -0,0 +1,71 @@
+import pytest
+
+from ner.agents.review_policy import ReviewPolicy
+from ner.grounding import GroundingEngine, GroundingKnowledgeBase
+
+
+ENTITY_TYPES = ["DNA", "protein"]
+
+
+@pytest.fixture
+def grounding_engine() -> GroundingEngine:
+    knowledge_base = GroundingKnowledgeBase()
+    knowledge_base.add("il-2", "protein", 10)
+    knowledge_base.add("cd28", "DNA", 10)
+    return GroundingEngine(knowledge_base=knowledge_base)
+
+
+def check(output: str, labels, grounding_engine):
+    tokens = output.replace("<protein>", "").replace("</protein>", "").replace("<DNA>", "").replace("</DNA>", "").split()
+    return ReviewPolicy().check(f"<output>{output}</output>", tokens, labels, ENTITY_TYPES, grounding_engine)
+
+
+def test_output_with_every_entity_verified_is_grounded(grounding_engine):
+    checks = check("<protein>IL-2</protein> binds <DNA>CD28</DNA> .", ["B-protein", "O", "B-DNA", "O"], grounding_engine)
+
+    assert checks.fidelity and checks.ontology
+    assert checks.grounded
+    assert checks.grounding_feedback == ""
+
+
+def test_output_without_entities_is_not_grounded(grounding_engine):
+    checks = check("The cells were washed .", ["O"] * 5, grounding_engine)
+
+    assert checks.fidelity and checks.ontology
+    assert not checks.grounded
+
+
+def test_output_with_unknown_entity_is_not_grounded(grounding_engine):
+    checks = check("<protein>IL-2</protein> binds <protein>CD4</protein> .", ["B-protein", "O", "B-protein", "O"], grounding_engine)
+
+    assert not checks.grounded
+    assert checks.grounding_feedback == ""
+
+
+def test_output_missing_a_known_mention_is_not_grounded(grounding_engine):
+    checks = check("<protein>IL-2</protein> binds CD28 .", ["B-protein", "O", "O", "O"], grounding_engine)
+
+    assert not checks.grounded
+
+
+def test_output_contradicting_grounding_gets_feedback(grounding_engine):
+    checks = check("<protein>IL-2</protein> binds <protein>CD28</protein> .", ["B-protein", "O", "B-protein", "O"], grounding_engine)
+
+    assert not checks.grounded
+    assert "'cd28' is tagged as 'protein'" in checks.grounding_feedback
+
+
+def test_changed_text_fails_fidelity(grounding_engine):
+    policy = ReviewPolicy()
+    checks = policy.check("<output><protein>IL-2</protein> binds</output>", ["IL-2", "binds", "CD28"], ["B-protein", "O", "O"], ENTITY_TYPES, grounding_engine)
+
+    assert not checks.fidelity
+    assert not checks.grounded
+
+
+def test_unknown_tag_fails_ontology(grounding_engine):
+    policy = ReviewPolicy()
+    checks = policy.check("<output><gene>IL-2</gene> binds .</output>", ["IL-2", "binds", "."], ["O", "O", "O"], ENTITY_TYPES, grounding_engine)
+
+    assert not checks.ontology
+    assert not checks.grounded
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+
+import httpx
+import pytest
+
+from ner.agents.tools import search
+from ner.agents.tools.search_cache import SearchCache
+from ner.agents.tools.search_store import SearchResultStore
+
+
+@pytest.fixture
+def search_paths(tmp_path, monkeypatch):
+    # a fresh cache and store under tmp_path, created on the first search
+    monkeypatch.setattr(search, "_search_cache", None)
+    monkeypatch.setattr(search, "_search_store", None)
+    monkeypatch.setenv("SEARCH_CACHE_PATH", str(tmp_path / "cache" / "search_cache.jsonl"))
+    monkeypatch.setenv("SEARCH_RESULTS_PATH", str(tmp_path / "cache" / "search_results.jsonl"))
+    return tmp_path / "cache"
+
+
+async def simulated_search(query: str) -> str:
+    if "failing" in query:
+        raise httpx.ConnectError("connection refused")
+    await asyncio.sleep(30 if "hanging" in query else 0)
+    return f"{query} is a thing"
+
+
+def test_cache_and_store_are_created_on_the_first_search(search_paths):
+    assert search._search_cache is None and search._search_store is None
+
+    asyncio.run(search.search_all("simulated", ["What is IL-2?"], simulated_search))
+
+    assert search.get_search_cache() is search.get_search_cache()
+    assert sorted(os.listdir(search_paths)) == ["search_cache.jsonl", "search_results.jsonl"]
+
+
+def test_search_all_reports_every_query(search_paths, caplog):
+    queries = ["What is IL-2?", "what is IL-2", "failing query", "hanging query"]
+
+    with caplog.at_level(logging.WARNING, logger="ner.agents.tools.search"):
+        results = asyncio.run(search.search_all("simulated", queries, simulated_search, deadline_seconds=0.1))
+
+    assert [(result.query, result.status) for result in results] == [
+        ("What is IL-2?", "ok"),
+        ("what is IL-2", "ok"),
+        ("failing query", "error"),
+        ("hanging query", "timeout"),
+    ]
+    # both spellings of the question are searched once
+    assert search.get_search_cache().misses == 3
+    assert len(list(search.get_search_store().records("simulated"))) == 1
+    assert caplog.messages == [
+        "Error while calling the simulated search API for 'failing query': connection refused",
+        "Search for 'hanging query' did not finish within 0.1s",
+    ]
+
+
+def test_search_all_uses_the_given_cache_and_store(search_paths, tmp_path):
+    cache = SearchCache()
+    store = SearchResultStore(path=str(tmp_path / "own_results.jsonl"))
+
+    asyncio.run(search.search_all("simulated", ["What is IL-2?"], simulated_search, search_cache=cache, search_store=store))
+
+    assert len(cache) == 1 and len(list(store.records("simulated"))) == 1
+    # the cache and store of the process are not created
+    assert search._search_cache is None and search._search_store is None
+    assert not search_paths.exists()
+
+
+def test_empty_cache_path_keeps_the_cache_in_memory(search_paths, monkeypatch):
+    monkeypatch.setenv("SEARCH_CACHE_PATH", "")
+
+    cache = search.get_search_cache()
+
+    assert isinstance(cache, SearchCache) and cache.path is None
@@ -0,0 +1,97 @@
+import asyncio
+from typing import List
+
+import pytest
+from autogen_core.base import MessageContext, TopicId
+from autogen_core.components import DefaultTopicId, RoutedAgent, TypeSubscription, message_handler
+from pydantic import BaseModel
+
+from ner.agents.session_runtime import SessionRuntime
+
+
+class Countdown(BaseModel):
+    remaining: int
+
+
+class CountdownAgent(RoutedAgent):
+    # passes the countdown on to the other agent of the session until it
+    # reaches zero, fails on negative ones
+    def __init__(self, seen: List[str], next_topic_type: str) -> None:
+        super().__init__(description="countdown")
+        self._seen = seen
+        self._next_topic_type = next_topic_type
+
+    @message_handler
+    async def handle_countdown(self, message: Countdown, ctx: MessageContext) -> None:
+        if message.remaining < 0:
+            raise ValueError(f"Negative countdown in {self.id.key}")
+        await asyncio.sleep(0.001)
+        self._seen.append(f"{self.id.key}:{message.remaining}")
+        if message.remaining:
+            await self.publish_message(Countdown(remaining=message.remaining - 1), DefaultTopicId(type=self._next_topic_type))
+
+
+async def start_runtime(seen: List[str]) -> SessionRuntime:
+    runtime = SessionRuntime()
+    await CountdownAgent.register(runtime, "session", lambda: CountdownAgent(seen, "relay"))
+    await CountdownAgent.register(runtime, "relay", lambda: CountdownAgent(seen, "session"))
+    for topic_type in ["session", "relay"]:
+        await runtime.add_subscription(TypeSubscription(topic_type=topic_type, agent_type=topic_type))
+    runtime.start()
+    return runtime
+
+
+def test_wait_for_session_waits_for_the_whole_conversation():
+    async def run() -> List[str]:
+        seen: List[str] = list()
+        runtime = await start_runtime(seen)
+        await runtime.publish_message(Countdown(remaining=3), TopicId("session", "a"))
+        await runtime.wait_for_session("a")
+        await runtime.stop()
+        return seen
+
+    assert asyncio.run(run()) == ["a:3", "a:2", "a:1", "a:0"]
+
+
+def test_sessions_run_side_by_side():
+    async def run() -> List[str]:
+        seen: List[str] = list()
+        runtime = await start_runtime(seen)
+        for session in ["a", "b"]:
+            await runtime.publish_message(Countdown(remaining=2), TopicId("session", session))
+        await asyncio.gather(runtime.wait_for_session("a"), runtime.wait_for_session("b"))
+        await runtime.stop()
+        return seen
+
+    seen = asyncio.run(run())
+    assert [message for message in seen if message.startswith("a")] == ["a:2", "a:1", "a:0"]
+    assert [message for message in seen if message.startswith("b")] == ["b:2", "b:1", "b:0"]
+
+
+def test_handler_errors_are_raised_to_the_waiting_session():
+    async def run() -> List[str]:
+        seen: List[str] = list()
+        runtime = await start_runtime(seen)
+        await runtime.publish_message(Countdown(remaining=-1), TopicId("session", "failing"))
+        await runtime.publish_message(Countdown(remaining=1), TopicId("session", "working"))
+        with pytest.raises(ValueError, match="failing"):
+            await runtime.wait_for_session("failing")
+        await runtime.wait_for_session("working")
+        await runtime.stop()
+        return seen
+
+    assert asyncio.run(run()) == ["working:1", "working:0"]
+
+
+def test_close_session_drops_its_agents():
+    async def run() -> None:
+        runtime = await start_runtime(list())
+        for session in ["a", "b"]:
+            await runtime.publish_message(Countdown(remaining=0), TopicId("session", session))
+            await runtime.wait_for_session(session)
+
+        runtime.close_session("a")
+        assert {agent_id.key for agent_id in runtime._instantiated_agents} == {"b"}
+        await runtime.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import random
+from typing import List, Tuple
+
+import pytest
+from seqeval.metrics.sequence_labeling import get_entities
+
+from ner.converter import Converter
+from ner.spans import extract_spans, extract_spans_batch, get_entity_types
+
+
+EDGE_CASES = [
+    [],
+    ["O"],
+    ["O", "O", "O"],
+    ["B-DNA"],
+    ["I-DNA"],
+    ["B-DNA", "I-DNA", "I-DNA"],
+    # a span that runs to the end of the sentence
+    ["O", "B-DNA", "I-DNA"],
+    # I- without a B- starts a span
+    ["O", "I-DNA", "I-DNA", "O"],
+    # adjacent spans of the same type
+    ["B-DNA", "B-DNA"],
+    ["B-DNA", "I-DNA", "B-DNA", "I-DNA"],
+    # nested same-type entities flattened to IOB2
+    ["B-protein", "I-protein", "B-protein", "I-protein", "I-protein", "O"],
+    # adjacent spans of different types
+    ["B-DNA", "B-protein", "I-protein"],
+    ["B-DNA", "I-protein", "I-protein"],
+    ["I-DNA", "I-protein", "I-DNA"],
+    ["B-cell_type", "I-cell_type", "O", "B-cell_line", "I-cell_line"],
+]
+
+
+def get_seqeval_spans(labels: List[str]) -> List[Tuple[int, int, str]]:
+    # seqeval ends are inclusive
+    return [(start, end + 1, entity_type) for entity_type, start, end in get_entities(labels)]
+
+
+def get_batch_spans(labels_batch: List[List[str]]) -> List[List[Tuple[int, int, str]]]:
+    span_array = extract_spans_batch(labels_batch)
+    spans: List[List[Tuple[int, int, str]]] = [[] for _ in labels_batch]
+    for sentence_id, start, end, type_id in zip(*span_array[:4]):
+        spans[sentence_id].append((int(start), int(end), span_array.types[type_id]))
+    return spans
+
+
+def random_batches(count: int):
+    rng = random.Random(36)
+    labels = ["O", "B-DNA", "I-DNA", "B-protein", "I-protein", "B-RNA", "I-RNA"]
+    for _ in range(count):
+        yield [
+            [rng.choice(labels) for _ in range(rng.randint(0, 20))]
+            for _ in range(rng.randint(0, 6))
+        ]
+
+
+@pytest.mark.parametrize("labels", EDGE_CASES)
+def test_extract_spans_matches_seqeval_on_edge_cases(labels):
+    assert extract_spans(labels) == get_seqeval_spans(labels)
+
+
+def test_extract_spans_matches_seqeval_on_random_sequences():
+    for batch in random_batches(2000):
+        for labels in batch:
+            assert extract_spans(labels) == get_seqeval_spans(labels)
+
+
+def test_extract_spans_batch_matches_seqeval_on_edge_cases():
+    assert get_batch_spans(EDGE_CASES) == [get_seqeval_spans(labels) for labels in EDGE_CASES]
+
+
+def test_extract_spans_batch_matches_seqeval_on_random_batches():
+    for batch in random_batches(2000):
+        assert get_batch_spans(batch) == [get_seqeval_spans(labels) for labels in batch]
+
+
+def test_spans_do_not_cross_sentences():
+    # a sentence starting with I- continues nothing from the one before
+    batch = [["B-DNA", "I-DNA"], ["I-DNA", "O"], [], ["I-DNA"]]
+    assert get_batch_spans(batch) == [[(0, 2, "DNA")], [(0, 1, "DNA")], [], [(0, 1, "DNA")]]
+
+
+def test_extract_spans_batch_of_empty_sentences():
+    span_array = extract_spans_batch([[], []])
+    assert len(span_array.starts) == 0
+    assert span_array.types == []
+
+
+def test_get_entity_types():
+    assert get_entity_types(EDGE_CASES) == {"DNA", "protein", "cell_type", "cell_line"}
+
+
+@pytest.mark.parametrize(
+    "labels, expected",
+    [
+        (
+            ["B-DNA", "I-DNA", "B-DNA", "I-DNA"],
+            "<DNA>a b</DNA> <DNA>c d</DNA>",
+        ),
+        (
+            ["B-protein", "I-protein", "B-protein", "I-protein", "I-protein", "O"],
+            "<protein>a b</protein> <protein>c d e</protein> f",
+        ),
+        (["B-DNA", "B-DNA"], "<DNA>a</DNA> <DNA>b</DNA>"),
+        (["B-DNA", "I-protein", "O"], "<DNA>a</DNA> <protein>b</protein> c"),
+        (["O", "I-RNA", "I-RNA"], "a <RNA>b c</RNA>"),
+        (["O", "O"], "a b"),
+    ],
+)
+def test_convert_iob2_to_example_tags_each_span_once(labels, expected):
+    tokens = list("abcdef")[: len(labels)]
+    assert Converter.convert_iob2_to_example(labels, tokens) == expected